@@ -0,0 +1,142 @@
+'''Arranque de la aplicación con las cachés ya llenas.
+
+    python -m demografia.arranque                                # como streamlit run 1_👋_Bienvenida.py
+    python -m demografia.arranque --server.port 8080 --server.headless true
+    python -m demografia.arranque --solo-artefactos              # al construir la imagen
+    DEMOGRAFIA_LISTO=/tmp/listo python -m demografia.arranque     # el fichero se crea al acabar de calentar
+
+Antes de arrancar el servidor se construyen en disco los artefactos que
+falten o estén desfasados (los conjuntos de datos y las topologías de los
+mapas), con lo que también quedan hechos los imports de la capa de datos.
+Con el servidor ya escuchando, una sesión como la del navegador
+(demografia.carga) recorre las VISTAS más habituales: cada página con sus
+valores por defecto (el último año, la comparativa de matrimonios
+1982/2012), los mapas de folium y un nombre. El primer usuario encuentra
+así los datos cargados, las figuras y los mapas en las cachés y los imports
+pesados (plotly, folium, matplotlib) ya hechos, y el pool de
+demografia.nombres arrancado.
+
+Las cachés se llenan desde una sesión, y no llamando a las funciones al
+arrancar, porque fuera de una sesión @recurso guarda en otra caché y las
+st.cache_data de las páginas dependen del módulo del script.
+
+Las opciones que no son de aquí se pasan a streamlit run. Se ejecuta desde
+la raíz del repositorio.
+'''
+import argparse
+import asyncio
+import os
+import threading
+import time
+from urllib.request import urlopen
+
+import numpy as np
+from streamlit import config, logger, runtime
+from streamlit.web import cli
+
+from demografia import cache, carga, datos, geografia
+
+#--------------
+
+# (página, [(etiqueta del widget, valor)...]): cada página se abre con sus
+# valores por defecto y luego se cambian, en orden, los widgets indicados
+VISTAS = [
+    (2, []),
+    (3, []),
+    (4, []),
+    (4, [('Mapa animado', False)]),
+    (5, []),
+    (5, [('Mapa animado', False)]),
+    (6, []),
+    (7, [('Nombre a buscar:', 'MARIA')]),
+]
+
+LISTO = os.environ.get('DEMOGRAFIA_LISTO')
+
+_log = logger.get_logger(__name__)
+
+def artefactos():
+    '''Construye los artefactos en disco que falten o estén desfasados: los
+    conjuntos de datos y las topologías de cada nivel con geometría.'''
+    for cargar in datos.CARGADORES.values():
+        cargar()
+    for nivel in geografia.disponibles():
+        for zoom in nivel.zooms:
+            nivel.topologia(zoom)
+    # Lo leído aquí queda en las cachés de fuera de Streamlit, que las sesiones no usan
+    cache.limpiar()
+
+#--------------
+
+def _url():
+    # Donde escucha el servidor, ya con la configuración de streamlit run leída
+    direccion = config.get_option('server.address')
+    if not direccion or direccion in ('0.0.0.0', '::'):
+        direccion = '127.0.0.1'
+    base = config.get_option('server.baseUrlPath').strip('/')
+    return f'{direccion}:{config.get_option("server.port")}' + (f'/{base}' if base else '')
+
+def _esperar_servidor(segundos=120):
+    limite = time.monotonic() + segundos
+    while not runtime.exists():
+        if time.monotonic() >= limite:
+            raise TimeoutError('El servidor no ha arrancado')
+        time.sleep(0.2)
+    salud = f'http://{_url()}/_stcore/health'
+    while True:
+        try:
+            with urlopen(salud, timeout=1):
+                return
+        except OSError:
+            if time.monotonic() >= limite:
+                raise TimeoutError(f'El servidor no responde en {salud}')
+            time.sleep(0.2)
+
+async def recorrer(url, vistas=VISTAS):
+    '''Abre las `vistas` en una sesión del servidor de `url` (ws://...) y
+    devuelve la sesión, con la latencia de cada rerun y los errores.'''
+    sesion = carga.Sesion(url, np.random.default_rng(0), pausa=0)
+    await sesion.abrir()
+    try:
+        for pagina, cambios in vistas:
+            await sesion.ir(pagina)
+            for etiqueta, valor in cambios:
+                await sesion.cambiar(etiqueta, valor)
+    finally:
+        sesion.cerrar()
+    return sesion
+
+def calentar():
+    '''Espera a que el servidor escuche y recorre las VISTAS. Si falla, el
+    servidor sigue: solo se pierde la ventaja.'''
+    try:
+        _esperar_servidor()
+        t = time.perf_counter()
+        sesion = asyncio.run(recorrer(f'ws://{_url()}/_stcore/stream'))
+    except Exception as e:
+        _log.warning(f'No se han podido calentar las cachés: {e!r}')
+        return
+    _log.info(f'Cachés calientes: {len(sesion.latencias)} reruns en {time.perf_counter() - t:.1f} s'
+              + (f', {sesion.errores} con errores' if sesion.errores else ''))
+    if LISTO:
+        with open(LISTO, 'w') as f:
+            f.write(f'{time.time():.0f}\n')
+
+#--------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Arranca la aplicación con las cachés ya llenas',
+                                     epilog='El resto de opciones se pasan a streamlit run', allow_abbrev=False)
+    parser.add_argument('--solo-artefactos', action='store_true', help='Construir los artefactos en disco y salir')
+    parser.add_argument('--sin-calentar', action='store_true', help='No recorrer las vistas al arrancar')
+    args, resto = parser.parse_known_args()
+
+    artefactos()
+    if args.solo_artefactos:
+        return
+    if not args.sin_calentar:
+        threading.Thread(target=calentar, name='calentar', daemon=True).start()
+    cli.main(['run', carga.APP, *resto], prog_name='streamlit')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+'''Medidas de rendimiento de cada página y de la capa de datos.
+
+    python -m demografia.benchmark                          # todas las páginas
+    python -m demografia.benchmark -p 4 6 -o antes.json     # solo algunas, a JSON
+    python -m demografia.benchmark -o despues.json -c antes.json
+    python -m demografia.benchmark --escala 8000x100        # datos sintéticos
+
+Cada paso se mide en tres modos:
+  frio      sin cachés en memoria ni artefactos en disco (se leen los CSV)
+  disco     sin cachés en memoria, con los artefactos Arrow ya construidos
+  caliente  con todo cacheado, como en los reruns de una sesión
+
+Las páginas se ejecutan sin servidor de Streamlit (los st.* no pintan nada),
+así que el tiempo es el del código Python de cada rerun, sin el navegador.
+Se ejecuta desde la raíz del repositorio.
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import runpy
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from streamlit import config, logger
+
+# Sin servidor, Streamlit avisa de ello en cada página y en cada función cacheada
+config.set_option('global.showWarningOnDirectExecution', False)
+config.set_option('logger.level', 'error')
+logger.set_log_level('error')
+
+from demografia import cache, consultas, datos, mapas, nombres
+
+#--------------
+
+MODOS = ['frio', 'disco', 'caliente']
+
+def _pagina(n):
+    return glob.glob(f'pages/{n}_*.py')[0]
+
+# Pasos de cada página: (nombre, preparar, medir). `preparar(ns)` saca los
+# argumentos (no se mide) y `medir(ns, *args)` es lo que se cronometra; `ns`
+# son las variables globales de la página tras ejecutarla.
+
+def _mapa_movimiento(ns):
+    _, sinTotal, _, max_year, *_ = ns['get_data']()
+    return sinTotal, max_year
+
+PASOS = {
+    2: [
+        ('get_data_evolucion', lambda ns: (), lambda ns: ns['get_data_evolucion']()),
+        ('figura_general', lambda ns: (ns['max_year'],), lambda ns, year: ns['figura_general'](year)),
+        ('figura_crecimiento', lambda ns: (ns['max_year'],), lambda ns, year: ns['figura_crecimiento'](year)),
+    ],
+    3: [
+        ('get_data_poblacion_provs', lambda ns: (), lambda ns: ns['get_data_poblacion_provs']()),
+        ('get_poblacion_por_sexo', lambda ns: (datos.conjunto('poblacion_sexo_edad'), ns['min_year'], ns['max_year']),
+            lambda ns, tipo, a, b: ns['get_poblacion_por_sexo'](tipo, a, b)),
+        ('figura_donut', lambda ns: (datos.conjunto('poblacion_provincias'), ns['max_year']),
+            lambda ns, provs, year: ns['figura_donut'](provs, 4, year)),
+        ('figura_piramide', lambda ns: (ns['max_year'],), lambda ns, year: ns['figura_piramide'](year)),
+        ('figura_piramide_animada', lambda ns: (ns['max_year'],), lambda ns, year: ns['figura_piramide'](year, 5, True)),
+        ('figura_barras_genero', lambda ns: (datos.conjunto('poblacion_sexo_edad'), ns['min_year'], ns['max_year']),
+            lambda ns, tipo, a, b: ns['figura_barras_genero'](tipo, b, a, b)),
+    ],
+    4: [
+        ('get_data', lambda ns: (), lambda ns: ns['get_data']()),
+        ('mapa_construir', _mapa_movimiento, lambda ns, df, year: ns['build_map'](df, year, 'Total', True)),
+        ('mapa_renderizar', lambda ns: (ns['build_map'](*_mapa_movimiento(ns), 'Total', True),),
+            lambda ns, mapa: mapas.renderizar(mapa)),
+    ],
+    6: [
+        ('get_data', lambda ns: (), lambda ns: ns['get_data']()),
+        ('get_diff', lambda ns: (ns['get_data']()[1],), lambda ns, df: ns['get_diff'](1982, 2012, df)),
+        ('mapa_construir', lambda ns: (ns['get_diff'](1982, 2012, ns['get_data']()[1]),),
+            lambda ns, df: ns['build_map'](df, sameYear=False)),
+        ('figura_barras', lambda ns: (datos.conjunto('matrimonios'),),
+            lambda ns, matrimonios: ns['figura_barras'](1982, 2012, 'Total Nacional', matrimonios, True)),
+    ],
+    7: [
+        ('read_names', lambda ns: (), lambda ns: ns['read_names']()),
+        ('get_maps', lambda ns: (), lambda ns: ns['get_maps']()),
+        ('buscar_nombre', lambda ns: (), lambda ns: nombres.get_indice().buscar('luc')),
+        ('peticiones_nombre', lambda ns: (datos.conjunto('nombres'),),
+            lambda ns, conjunto: ns['get_peticiones']('LUCIA', conjunto)),
+        ('mapas_nombre', lambda ns: (ns['get_peticiones']('LUCIA', datos.conjunto('nombres'))[1],),
+            lambda ns, peticiones: list(nombres.imagenes('LUCIA', peticiones))),
+        ('figura_popularidad', lambda ns: (), lambda ns: ns['figura_popularidad']('LUCIA')),
+    ],
+}
+PASOS[5] = PASOS[4]
+
+#--------------
+
+class _Artefactos:
+    '''Usa un directorio de artefactos temporal; `vaciar()` lo deja vacío.'''
+
+    def __enter__(self):
+        self.original = datos.ARTEFACTOS_DIR
+        self.dir = tempfile.mkdtemp(prefix='artefactos-')
+        datos.ARTEFACTOS_DIR = self.dir
+        return self
+
+    def vaciar(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __exit__(self, *exc):
+        self.vaciar()
+        datos.ARTEFACTOS_DIR = self.original
+
+def _cronometrar(f, *args):
+    t = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - t
+
+def _preparar_modo(modo, artefactos):
+    if modo != 'caliente':
+        cache.limpiar()
+    if modo == 'frio':
+        artefactos.vaciar()
+
+def medir_pagina(n, repeticiones, artefactos):
+    '''{'pagina/paso/modo': [segundos, ...]} de la página `n`.'''
+    ruta = _pagina(n)
+    res = {}
+    for modo in MODOS:
+        tiempos = []
+        for _ in range(repeticiones):
+            _preparar_modo(modo, artefactos)
+            t = time.perf_counter()
+            ns = runpy.run_path(ruta, run_name='__pagina__')
+            tiempos.append(time.perf_counter() - t)
+        res[f'{n}/pagina/{modo}'] = tiempos
+
+    for paso, preparar, medir in PASOS.get(n, []):
+        for modo in MODOS:
+            tiempos = []
+            for _ in range(repeticiones):
+                args = preparar(ns)
+                _preparar_modo(modo, artefactos)
+                if modo == 'caliente':
+                    medir(ns, *args)  # Para que todo lo que usa el paso esté ya en caché
+                tiempos.append(_cronometrar(medir, ns, *args))
+            res[f'{n}/{paso}/{modo}'] = tiempos
+    return res
+
+#--------------
+# Datos sintéticos: `regiones` × `years` con la forma de los movimientos
+# naturales, para ver cómo escalan los mismos cálculos que usan las páginas.
+
+def datos_sinteticos(regiones, years, semilla=0):
+    rng = np.random.default_rng(semilla)
+    ids = np.arange(1, regiones + 1, dtype='int32')
+    periodos = np.arange(2023 - years, 2023, dtype='int16')
+    sexos = pd.Categorical(['Total', 'Hombres', 'Mujeres'])
+
+    malla = pd.MultiIndex.from_product([ids, sexos, periodos], names=['id', 'Sexo', 'Periodo']).to_frame(index=False)
+    malla['Nacimientos'] = rng.integers(0, 5000, len(malla), dtype='int32')
+    poblacion = pd.MultiIndex.from_product([ids, periodos], names=['id', 'Periodo']).to_frame(index=False)
+    poblacion['Poblacion'] = rng.uniform(1e3, 1e6, len(poblacion))
+    return malla, poblacion
+
+def geojson_sintetico(regiones):
+    '''Cuadrícula de `regiones` polígonos cuadrados sobre la península.'''
+    lado = int(np.ceil(np.sqrt(regiones)))
+    paso = 9 / lado
+    features = []
+    for i in range(regiones):
+        x, y = -9 + (i % lado) * paso, 36 + (i // lado) * paso
+        anillo = [[x, y], [x + paso, y], [x + paso, y + paso], [x, y + paso], [x, y]]
+        features.append({'type': 'Feature', 'properties': {'codigo': str(i + 1)},
+            'geometry': {'type': 'Polygon', 'coordinates': [anillo]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+def medir_escala(regiones, years, repeticiones):
+    import folium
+
+    df, poblacion = datos_sinteticos(regiones, years)
+    pasos = [
+        ('tasa', lambda: datos.con_tasa(df, poblacion, 'Nacimientos', 'NacimientosPorMil')),
+    ]
+    con_tasa = datos.con_tasa(df, poblacion, 'Nacimientos', 'NacimientosPorMil')
+    year = int(con_tasa.Periodo.max())
+    pasos += [
+        ('filtro_year_sexo', lambda: con_tasa[(con_tasa.Periodo == year) & (con_tasa.Sexo == 'Total')]),
+        ('matriz', lambda: consultas.Matriz(con_tasa[con_tasa.Sexo == 'Total'], ['Nacimientos', 'NacimientosPorMil', 'Poblacion'])),
+    ]
+    matriz = consultas.Matriz(con_tasa[con_tasa.Sexo == 'Total'], ['Nacimientos', 'NacimientosPorMil', 'Poblacion'])
+    primero = year - years + 1
+    pasos += [
+        ('comparar_years', lambda: matriz.media('NacimientosPorMil', year) - matriz.media('NacimientosPorMil', primero)),
+        ('comparar_periodos', lambda: matriz.media('NacimientosPorMil', (year - 5, year))
+            - matriz.media('NacimientosPorMil', (primero, primero + 5))),
+    ]
+
+    geo = geojson_sintetico(regiones)
+    del_year = con_tasa[(con_tasa.Periodo == year) & (con_tasa.Sexo == 'Total')].assign(Codigo=lambda d: d.id.astype(str))
+
+    def mapa():
+        m = folium.Map(location=[40.42, -3.7], zoom_start=5)
+        folium.Choropleth(geo_data=geo, data=del_year, columns=['Codigo', 'NacimientosPorMil'],
+            key_on='properties.codigo', fill_color='Purples').add_to(m)
+        return m
+
+    pasos += [('mapa_construir', mapa), ('mapa_renderizar', lambda: mapas.renderizar(mapa()))]
+
+    return {f'escala-{regiones}x{years}/{paso}/caliente': [_cronometrar(f) for _ in range(repeticiones)]
+        for paso, f in pasos}
+
+#--------------
+
+def resumir(tiempos):
+    return {k: {'min': min(v), 'mediana': statistics.median(v), 'n': len(v)} for k, v in tiempos.items()}
+
+def comparar(actual, base):
+    '''Tabla con la mediana de cada medida en `base` y en `actual` y el cociente.'''
+    filas = []
+    for k in sorted(set(actual) | set(base)):
+        a = actual.get(k, {}).get('mediana')
+        b = base.get(k, {}).get('mediana')
+        filas.append((k, b, a, a / b if a is not None and b else None))
+    return filas
+
+def _ms(x):
+    return '         -' if x is None else f'{x*1000:10.1f}'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de las páginas de la aplicación')
+    parser.add_argument('-p', '--paginas', type=int, nargs='*', default=sorted(PASOS))
+    parser.add_argument('-n', '--repeticiones', type=int, default=3)
+    parser.add_argument('-o', '--salida', help='Fichero JSON con los resultados')
+    parser.add_argument('-c', '--comparar', help='JSON de una ejecución anterior con la que comparar')
+    parser.add_argument('--escala', nargs='*', default=[], metavar='REGIONESxYEARS',
+        help='Medir también con datos sintéticos, p. ej. 8000x100')
+    parser.add_argument('--memoria', action='store_true',
+        help='Mostrar al final la memoria de los conjuntos de datos y la residente del proceso')
+    args = parser.parse_args()
+
+    tiempos = {}
+    with _Artefactos() as artefactos:
+        for n in args.paginas:
+            tiempos.update(medir_pagina(n, args.repeticiones, artefactos))
+    for escala in args.escala:
+        regiones, years = map(int, escala.lower().split('x'))
+        tiempos.update(medir_escala(regiones, years, args.repeticiones))
+
+    resultado = {
+        'meta': {'fecha': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'maquina': platform.machine(), 'cpus': os.cpu_count(), 'repeticiones': args.repeticiones},
+        'resultados': resumir(tiempos),
+    }
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)['resultados']
+        print(f'{"medida":45} {"base ms":>10} {"ahora ms":>10} {"ratio":>7}')
+        for k, b, a, r in comparar(resultado['resultados'], base):
+            ratio = '      -' if r is None else f'{r:7.2f}'
+            print(f'{k:45} {_ms(b)} {_ms(a)} {ratio}')
+    else:
+        print(f'{"medida":45} {"mediana ms":>10} {"min ms":>10}')
+        for k, v in resultado['resultados'].items():
+            print(f'{k:45} {_ms(v["mediana"])} {_ms(v["min"])}')
+
+    if args.memoria:
+        print()
+        print(datos.memoria().to_string(index=False))
+        print(f'Memoria residente: {datos.residente() / 2**20:.1f} MiB')
+
+if __name__ == '__main__':
+    main()
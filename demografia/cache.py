@@ -0,0 +1,85 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from demografia import perfil
+
+#--------------
+
+class CacheLRU:
+    '''Caché LRU acotada por el tamaño total (en bytes) de sus valores.
+    Segura entre hilos: Streamlit atiende cada sesión en un hilo distinto.
+    Con `nombre`, sus aciertos y fallos cuentan en el perfil del rerun.'''
+
+    def __init__(self, max_bytes, nombre=None):
+        self.max_bytes = max_bytes
+        self.nombre = nombre
+        self.bytes = 0
+        self.hits = self.misses = 0
+        self._datos = OrderedDict()  # clave -> (valor, tamaño)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._datos)
+
+    def get(self, clave):
+        with self._lock:
+            if clave not in self._datos:
+                self.misses += 1
+                valor = None
+            else:
+                self.hits += 1
+                self._datos.move_to_end(clave)
+                valor = self._datos[clave][0]
+        if self.nombre is not None:
+            perfil.acierto(self.nombre, valor is not None)
+        return valor
+
+    def put(self, clave, valor, tam):
+        with self._lock:
+            if clave in self._datos:
+                self.bytes -= self._datos.pop(clave)[1]
+            self._datos[clave] = (valor, tam)
+            self.bytes += tam
+            # Siempre se conserva al menos el último valor, aunque supere el límite
+            while self.bytes > self.max_bytes and len(self._datos) > 1:
+                _, (_, t) = self._datos.popitem(last=False)
+                self.bytes -= t
+
+#--------------
+
+RECURSOS = []  # Todas las funciones decoradas con @recurso, para poder vaciarlas
+
+def recurso(f):
+    '''Como st.cache_resource, pero también guarda el resultado cuando no hay
+    sesión de Streamlit (st.cache_resource entonces no guarda nada), p. ej. al
+    usar las consultas desde un script o el servidor HTTP.'''
+    return perfil.medir_cache(_recurso, f)
+
+def _recurso(f):
+    en_streamlit = st.cache_resource(f)
+    fuera = functools.lru_cache(maxsize=None)(f)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if get_script_run_ctx() is None:
+            return fuera(*args, **kwargs)
+        return en_streamlit(*args, **kwargs)
+
+    def clear():
+        en_streamlit.clear()
+        fuera.cache_clear()
+
+    wrapper.clear = clear
+    RECURSOS.append(wrapper)
+    return wrapper
+
+def limpiar():
+    '''Vacía todas las cachés en memoria: st.cache_data, st.cache_resource y @recurso.'''
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    for r in RECURSOS:
+        r.clear()
@@ -0,0 +1,516 @@
+'''Prueba de carga: cuántas sesiones simultáneas aguanta un proceso del
+servidor antes de que se degrade la latencia de los reruns.
+
+    python -m demografia.carga                                   # 1, 2, 4 y 8 sesiones, 30 s cada vez
+    python -m demografia.carga -s 1 5 10 20 -d 60 -o carga.json
+    python -m demografia.carga -e matrimonios nombres -c carga.json
+    python -m demografia.carga --perfil                          # con los aciertos de las cachés
+    python -m demografia.carga --url ws://localhost:8501 --pid 1234
+
+Arranca la aplicación (streamlit run) en un puerto libre y abre N sesiones
+por el mismo websocket que usa el navegador. Cada sesión repite uno de los
+ESCENARIOS, por turnos: cambia widgets por su etiqueta, como haría un
+usuario (con una pausa entre acciones), y espera al final del rerun. Para
+cada número de sesiones se da la latencia de los reruns (p50/p95/p99), los
+reruns por segundo y la CPU y la memoria residente del servidor (con los
+procesos del pool de demografia.nombres), en total y por sesión. Con
+--perfil el servidor guarda el perfil de cada rerun (demografia.perfil) y
+se da además el porcentaje de aciertos de las cachés.
+
+Solo se mide el servidor: no se descargan las imágenes ni los recursos de
+los componentes. Se ejecuta desde la raíz del repositorio.
+'''
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+from streamlit import config, logger
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.source_util import page_icon_and_name
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+# El escenario de nacimientos usa demografia.geografia, con cachés de Streamlit que sin servidor avisan
+config.set_option('logger.level', 'error')
+logger.set_log_level('error')
+
+#--------------
+
+APP = '1_👋_Bienvenida.py'
+SESIONES = [1, 2, 4, 8]
+DURACION = 30  # Segundos con cada número de sesiones
+PAUSA = 0.5  # Segundos, de media, entre la respuesta de un rerun y la siguiente acción
+MAPA = 'streamlit_folium.st_folium'  # Los componentes se identifican por su nombre, no por su etiqueta
+
+def _pagina(n):
+    # Nombre de la página tal y como lo pide el navegador
+    return page_icon_and_name(Path(glob.glob(f'pages/{n}_*.py')[0]))[1]
+
+def _indice(widget, opcion):
+    opciones = list(widget.options)
+    if opcion not in opciones:
+        raise ValueError(f'Opción desconocida: {opcion} (opciones: {", ".join(opciones)})')
+    return opciones.index(opcion)
+
+def _numero(estado, widget, valor):
+    if widget.data_type == widget.INT:
+        estado.int_value = int(valor)
+    else:
+        estado.double_value = float(valor)
+
+# clase del elemento -> pone en el WidgetState el valor que elige el usuario
+# (la opción como se ve, el número o la tupla de números, el texto...)
+WIDGETS = {
+    'slider': lambda e, w, v: e.double_array_value.data.extend(v if isinstance(v, (tuple, list)) else [v]),
+    'radio': lambda e, w, v: setattr(e, 'int_value', _indice(w, v)),
+    'selectbox': lambda e, w, v: setattr(e, 'int_value', _indice(w, v)),
+    'multiselect': lambda e, w, v: e.int_array_value.data.extend(_indice(w, x) for x in v),
+    'checkbox': lambda e, w, v: setattr(e, 'bool_value', v),
+    'text_input': lambda e, w, v: setattr(e, 'string_value', v),
+    'number_input': _numero,
+    'component_instance': lambda e, w, v: setattr(e, 'json_value', json.dumps(v)),
+}
+
+class _Fin(Exception):
+    pass
+
+class Sesion:
+    '''Una sesión de la aplicación por websocket, como la del navegador. Las
+    acciones esperan a que termine el rerun que provocan y guardan su latencia.'''
+
+    def __init__(self, url, rng, pausa=PAUSA, fin=float('inf')):
+        self.url = url
+        self.rng = rng
+        self.pausa = pausa
+        self.fin = fin
+        self.ws = None
+        self.pagina = None
+        self.hash = ''
+        self.widgets = {}  # etiqueta -> (clase, proto) de los widgets del último rerun
+        self.estados = {}  # id -> WidgetState de lo que ha cambiado el usuario en la página
+        self.mensajes = {}  # hash -> ForwardMsg cacheable ya recibido
+        self.latencias = []
+        self.errores = 0
+
+    async def abrir(self):
+        self.ws = await websocket_connect(self.url, max_message_size=2**30)
+
+    def cerrar(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    def widget(self, etiqueta):
+        if etiqueta not in self.widgets:
+            raise ValueError(f'Widget desconocido: {etiqueta} (opciones: {", ".join(self.widgets)})')
+        return self.widgets[etiqueta][1]
+
+    async def ir(self, pagina):
+        '''Abre la página número `pagina` con los widgets por defecto.'''
+        await self._esperar()
+        self.pagina, self.hash, self.estados = _pagina(pagina), '', {}
+        await self._rerun()
+
+    async def cambiar(self, etiqueta, valor):
+        '''Cambia el widget `etiqueta` a `valor`.'''
+        await self._esperar()
+        widget = self.widget(etiqueta)
+        estado = WidgetState(id=widget.id)
+        WIDGETS[self.widgets[etiqueta][0]](estado, widget, valor)
+        self.estados[widget.id] = estado
+        await self._rerun()
+
+    async def _esperar(self):
+        # El tiempo que el usuario tarda en hacer algo; al acabar la prueba no se empieza nada más
+        if time.monotonic() >= self.fin:
+            raise _Fin()
+        await asyncio.sleep(self.pausa * self.rng.uniform(0.5, 1.5))
+
+    async def _rerun(self):
+        msg = BackMsg()
+        msg.rerun_script.page_name = self.pagina
+        msg.rerun_script.page_script_hash = self.hash
+        msg.rerun_script.widget_states.widgets.extend(self.estados.values())
+
+        t = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        widgets = {}
+        while True:
+            datos = await self.ws.read_message()
+            if datos is None:
+                raise ConnectionError('El servidor ha cerrado la sesión')
+            fwd = await self._mensaje(ForwardMsg.FromString(datos))
+            tipo = fwd.WhichOneof('type')
+            if tipo == 'new_session':
+                # Al empezar cada ejecución, también las que repite st.experimental_rerun()
+                self.hash = fwd.new_session.page_script_hash
+                widgets = {}
+            elif tipo == 'delta' and fwd.delta.WhichOneof('type') == 'new_element':
+                elemento = fwd.delta.new_element
+                clase = elemento.WhichOneof('type')
+                if clase == 'exception':
+                    self.errores += 1
+                elif clase in WIDGETS:
+                    widget = getattr(elemento, clase)
+                    widgets[widget.component_name if clase == 'component_instance' else widget.label] = (clase, widget)
+            elif tipo == 'page_not_found':
+                raise ValueError(f'Página desconocida: {self.pagina}')
+            elif tipo == 'script_finished':
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    self.errores += 1
+                if fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        self.latencias.append(time.perf_counter() - t)
+        self.widgets = widgets
+
+    async def _mensaje(self, fwd):
+        # Los mensajes grandes que ya se han enviado en la sesión llegan como
+        # referencia; como el navegador, se guardan y, si no se tiene uno, se pide
+        if fwd.WhichOneof('type') == 'ref_hash':
+            if fwd.ref_hash not in self.mensajes:
+                url = self.url.replace('ws', 'http', 1).replace('/_stcore/stream', f'/_stcore/message?hash={fwd.ref_hash}')
+                respuesta = await AsyncHTTPClient().fetch(url)
+                self.mensajes[fwd.ref_hash] = ForwardMsg.FromString(respuesta.body)
+            return self.mensajes[fwd.ref_hash]
+        if fwd.metadata.cacheable:
+            self.mensajes[fwd.hash] = fwd
+        return fwd
+
+#--------------
+# Escenarios: lo que hace un usuario en una página, unas cuantas acciones.
+# Cada sesión repite el suyo hasta que se acaba el tiempo.
+
+NOMBRES = ['LUCIA', 'MARIA', 'HUGO', 'MARTIN', 'SOFIA', 'DANIEL', 'CARMEN', 'ANTONIO', 'JULIA', 'PABLO',
+           'luc', 'alej', 'jose', 'marí', 'Ainhoa', 'Iker', 'Noa', 'Xavier']
+
+async def matrimonios(sesion, rng):
+    '''Arrastra uno u otro extremo del slider de años de comparativa.'''
+    await sesion.ir(6)
+    slider = sesion.widget('Años de comparativa:')
+    minimo, maximo = int(slider.min), int(slider.max)
+    a, b = map(int, slider.default)
+    for _ in range(10):
+        if rng.random() < 0.5:
+            a = int(np.clip(a + rng.integers(-3, 4), minimo, b))
+        else:
+            b = int(np.clip(b + rng.integers(-3, 4), a, maximo))
+        await sesion.cambiar('Años de comparativa:', (a, b))
+
+async def nacimientos(sesion, rng):
+    '''En el mapa de nacimientos (el de folium, no el animado): cambia de
+    sexo, mueve el año o hace clic en una provincia.'''
+    from demografia import geografia
+
+    await sesion.ir(4)
+    await sesion.cambiar('Mapa animado', False)
+    year = int(sesion.widget('Año').default[0])
+    minimo = int(sesion.widget('Año').min)
+    puntos = geografia.PROVINCIAS.puntos()
+    for _ in range(10):
+        accion = rng.random()
+        if accion < 0.6:
+            await sesion.cambiar('Sexo', str(rng.choice(sesion.widget('Sexo').options)))
+        elif accion < 0.8:
+            year = max(minimo, year - int(rng.integers(1, 4)))
+            await sesion.cambiar('Año', year)
+        else:
+            lat, lon = puntos[rng.integers(len(puntos))]
+            await sesion.cambiar(MAPA, {'last_clicked': {'lat': lat, 'lng': lon}})
+
+SUGERENCIAS = '¿Quizás buscabas...?'
+
+async def nombres(sesion, rng):
+    '''Busca nombres, enteros o a medias (y entonces elige una de las
+    sugerencias), y a veces cambia la década de los más comunes.'''
+    await sesion.ir(7)
+    for _ in range(6):
+        await sesion.cambiar('Nombre a buscar:', str(rng.choice(NOMBRES)))
+        if SUGERENCIAS in sesion.widgets:
+            await sesion.cambiar(SUGERENCIAS, str(rng.choice(sesion.widget(SUGERENCIAS).options[1:])))
+        if rng.random() < 0.3:
+            await sesion.cambiar('Década', str(rng.choice(sesion.widget('Década').options)))
+
+ESCENARIOS = {f.__name__: f for f in [matrimonios, nacimientos, nombres]}
+
+#--------------
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class Servidor:
+    '''La aplicación arrancada con `streamlit run` en un puerto libre o, con
+    `url`, una ya arrancada (la CPU y la memoria solo si se da su `pid`).'''
+
+    def __init__(self, url=None, pid=None, perfil=None):
+        self.url = url
+        self.pid = pid
+        self.perfil = perfil
+        self.proceso = None
+
+    def __enter__(self):
+        if self.url is None:
+            puerto = _puerto_libre()
+            entorno = dict(os.environ)
+            if self.perfil:
+                entorno.update(DEMOGRAFIA_PERFIL='1', DEMOGRAFIA_PERFIL_SALIDA=self.perfil)
+            self.proceso = subprocess.Popen(
+                [sys.executable, '-m', 'streamlit', 'run', APP, '--server.headless', 'true', '--server.port', str(puerto),
+                 '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false'],
+                env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.pid = self.proceso.pid
+            self.url = f'ws://127.0.0.1:{puerto}'
+            self._esperar_arranque()
+        return self
+
+    def _esperar_arranque(self, segundos=60):
+        salud = self.url.replace('ws', 'http', 1) + '/_stcore/health'
+        limite = time.monotonic() + segundos
+        while time.monotonic() < limite:
+            if self.proceso.poll() is not None:
+                raise RuntimeError(f'streamlit run ha terminado con código {self.proceso.returncode}')
+            try:
+                with urlopen(salud, timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise TimeoutError(f'El servidor no responde en {salud}')
+
+    def __exit__(self, *exc):
+        if self.proceso is not None:
+            self.proceso.terminate()
+            self.proceso.wait(10)
+
+    @property
+    def stream(self):
+        return f'{self.url}/_stcore/stream'
+
+    def _procesos(self):
+        # El servidor y sus descendientes (los procesos del pool de demografia.nombres)
+        hijos = {}
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            campos = _stat(pid)
+            if campos is not None:
+                hijos.setdefault(int(campos[1]), []).append(int(pid))
+        procesos, pendientes = [], [self.pid]
+        while pendientes:
+            pid = pendientes.pop()
+            procesos.append(pid)
+            pendientes += hijos.get(pid, [])
+        return procesos
+
+    def cpu(self):
+        '''Segundos de CPU (usuario + sistema) del servidor y sus procesos hijos, o None.'''
+        if self.pid is None:
+            return None
+        # utime, stime y los de los hijos que ya han terminado
+        stats = [s for s in map(_stat, self._procesos()) if s is not None]
+        return sum(int(x) for s in stats for x in s[11:15]) / os.sysconf('SC_CLK_TCK') if stats else None
+
+    def residente(self):
+        '''Memoria residente (RSS) en bytes del servidor y sus procesos hijos
+        (las páginas compartidas cuentan en cada uno), o None.'''
+        if self.pid is None:
+            return None
+        total = None
+        for pid in self._procesos():
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total = (total or 0) + int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            except OSError:
+                pass
+        return total
+
+def _stat(pid):
+    # Campos de /proc/<pid>/stat a partir del estado (el nombre puede tener espacios), o None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+
+#--------------
+
+async def _usuario(url, escenario, rng, pausa, fin):
+    sesion = Sesion(url, rng, pausa, fin)
+    sesion.escenario = escenario.__name__
+    await sesion.abrir()
+    try:
+        while True:
+            await escenario(sesion, rng)
+    except _Fin:
+        pass
+    return sesion
+
+async def _calentar(url, escenarios):
+    # Una pasada por cada escenario, sin medir: la primera carga de cada
+    # página (datos, artefactos, imports) no es lo que se quiere medir
+    for i, escenario in enumerate(escenarios):
+        sesion = Sesion(url, np.random.default_rng(i), pausa=0)
+        await sesion.abrir()
+        try:
+            await escenario(sesion, sesion.rng)
+        finally:
+            sesion.cerrar()
+
+def _percentiles(latencias):
+    if not len(latencias):
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) * 1000
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+def _caches(perfil, desde):
+    # Aciertos y fallos de los reruns guardados en el perfil a partir del byte `desde`
+    aciertos = fallos = 0
+    try:
+        with open(f'{perfil}.jsonl', encoding='utf-8') as f:
+            f.seek(desde)
+            for linea in f:
+                for c in json.loads(linea)['caches'].values():
+                    aciertos += c['aciertos']
+                    fallos += c['fallos']
+            return f.tell(), aciertos, fallos
+    except OSError:
+        return desde, 0, 0
+
+async def medir(servidor, n, escenarios, duracion=DURACION, pausa=PAUSA, semilla=0, base=None):
+    '''Métricas de `n` sesiones simultáneas durante `duracion` segundos; la
+    sesión i repite el escenario i % len(escenarios). `base` es la memoria
+    residente del servidor sin sesiones, para la memoria por sesión.'''
+    inicio_perfil = os.path.getsize(f'{servidor.perfil}.jsonl') if servidor.perfil and os.path.exists(f'{servidor.perfil}.jsonl') else 0
+    cpu = servidor.cpu()
+    t = time.perf_counter()
+    fin = time.monotonic() + duracion
+    sesiones = await asyncio.gather(*[
+        _usuario(servidor.stream, escenarios[i % len(escenarios)], np.random.default_rng([semilla, n, i]), pausa, fin)
+        for i in range(n)])
+    segundos = time.perf_counter() - t
+    cpu = None if cpu is None else servidor.cpu() - cpu
+    residente = servidor.residente()
+    for sesion in sesiones:
+        sesion.cerrar()
+
+    latencias = np.concatenate([s.latencias for s in sesiones])
+    fila = {
+        'sesiones': n,
+        'reruns': len(latencias),
+        'errores': sum(s.errores for s in sesiones),
+        **_percentiles(latencias),
+        'reruns_s': len(latencias) / segundos,
+        'cpu_pct': None if cpu is None else cpu / segundos * 100,
+        'cpu_ms_rerun': None if cpu is None or not len(latencias) else cpu / len(latencias) * 1000,
+        'rss_mib': None if residente is None else residente / 2**20,
+        'rss_mib_sesion': None if residente is None or base is None else (residente - base) / 2**20 / n,
+        'escenarios': {e.__name__: _percentiles(np.concatenate([[]] + [s.latencias for s in sesiones if s.escenario == e.__name__]))
+                       for e in escenarios[:n]},
+    }
+    if servidor.perfil:
+        _, aciertos, fallos = _caches(servidor.perfil, inicio_perfil)
+        fila['aciertos_cache_pct'] = aciertos / (aciertos + fallos) * 100 if aciertos + fallos else None
+    return fila
+
+#--------------
+
+COLUMNAS = {
+    'sesiones': 'sesiones', 'reruns': 'reruns', 'errores': 'errores', 'p50_ms': 'p50 ms', 'p95_ms': 'p95 ms',
+    'p99_ms': 'p99 ms', 'reruns_s': 'reruns/s', 'cpu_pct': 'CPU %', 'cpu_ms_rerun': 'CPU ms/rerun',
+    'rss_mib': 'RSS MiB', 'rss_mib_sesion': 'MiB/sesión', 'aciertos_cache_pct': 'aciertos caché %',
+}
+
+def tabla(resultados):
+    df = pd.DataFrame(resultados).drop(columns='escenarios')
+    return df.rename(columns=COLUMNAS)
+
+def tabla_escenarios(resultados):
+    return pd.DataFrame([{'sesiones': r['sesiones'], 'escenario': e, **p}
+                         for r in resultados for e, p in r['escenarios'].items()]).rename(columns=COLUMNAS)
+
+def comparar(actual, base):
+    '''Tabla con p95 y reruns/s de `base` y de `actual` para cada número de sesiones, con su cociente.'''
+    base = {r['sesiones']: r for r in base}
+    filas = []
+    for r in actual:
+        b = base.get(r['sesiones'], {})
+        fila = {'sesiones': r['sesiones']}
+        for k in ['p95_ms', 'reruns_s']:
+            fila[f'{COLUMNAS[k]} base'] = b.get(k)
+            fila[f'{COLUMNAS[k]} ahora'] = r[k]
+            fila[f'{COLUMNAS[k]} ratio'] = r[k] / b[k] if r[k] is not None and b.get(k) else None
+        filas.append(fila)
+    return pd.DataFrame(filas)
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga con sesiones simultáneas de la aplicación')
+    parser.add_argument('-s', '--sesiones', type=int, nargs='*', default=SESIONES)
+    parser.add_argument('-e', '--escenarios', nargs='*', default=list(ESCENARIOS), metavar='ESCENARIO',
+        help=f'{", ".join(ESCENARIOS)} (por defecto, todos)')
+    parser.add_argument('-d', '--duracion', type=float, default=DURACION, help='Segundos con cada número de sesiones')
+    parser.add_argument('--pausa', type=float, default=PAUSA, help='Segundos de media entre acciones de un usuario')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--url', help='Servidor ya arrancado (ws://host:puerto) en lugar de arrancar uno')
+    parser.add_argument('--pid', type=int, help='Proceso del servidor de --url, para medir su CPU y memoria')
+    parser.add_argument('--perfil', action='store_true', help='Arrancar con el perfil activo y dar los aciertos de las cachés')
+    parser.add_argument('--sin-calentar', action='store_true', help='No hacer una pasada por cada escenario antes de medir')
+    parser.add_argument('-o', '--salida', help='Fichero JSON con los resultados')
+    parser.add_argument('-c', '--comparar', help='JSON de una ejecución anterior con la que comparar')
+    args = parser.parse_args()
+    for e in args.escenarios:
+        if e not in ESCENARIOS:
+            parser.error(f'Escenario desconocido: {e} (opciones: {", ".join(ESCENARIOS)})')
+    if args.perfil and args.url:
+        parser.error('--perfil solo con el servidor que arranca la prueba')
+    escenarios = [ESCENARIOS[e] for e in args.escenarios]
+
+    async def ejecutar(servidor):
+        if not args.sin_calentar:
+            await _calentar(servidor.stream, escenarios)
+        base = servidor.residente()
+        resultados = []
+        for n in args.sesiones:
+            r = await medir(servidor, n, escenarios, args.duracion, args.pausa, args.semilla, base)
+            print(f'{n} sesiones: {r["reruns"]} reruns, {r["errores"]} errores', flush=True)
+            resultados.append(r)
+        return resultados
+
+    with tempfile.TemporaryDirectory(prefix='carga-') as tmp:
+        with Servidor(args.url, args.pid, os.path.join(tmp, 'perfil') if args.perfil else None) as servidor:
+            resultados = asyncio.run(ejecutar(servidor))
+
+    print()
+    print(tabla(resultados).to_string(index=False, float_format='{:,.1f}'.format, na_rep='-'))
+    print()
+    print(tabla_escenarios(resultados).to_string(index=False, float_format='{:,.1f}'.format, na_rep='-'))
+
+    resultado = {
+        'meta': {'fecha': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'maquina': platform.machine(), 'cpus': os.cpu_count(), 'escenarios': args.escenarios,
+                 'duracion': args.duracion, 'pausa': args.pausa, 'semilla': args.semilla},
+        'resultados': resultados,
+    }
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)['resultados']
+        print()
+        print(comparar(resultados, base).to_string(index=False, float_format='{:,.2f}'.format, na_rep='-'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+from demografia import datos, indicadores, provincias
+from demografia.cache import recurso
+
+#--------------
+# Cálculos de las páginas que no dependen de la interfaz. Se pueden usar desde
+# Streamlit, desde un script o a través de demografia.servidor; los datos salen
+# siempre de la misma capa cacheada (demografia.datos). Los DataFrames que
+# devuelven son nuevos, pero sin copiar más de lo necesario: no modificarlos.
+
+SEXOS = ['Total', 'Hombres', 'Mujeres']
+
+def _movimiento(nombre, sex):
+    if nombre not in datos.MOVIMIENTOS:
+        raise ValueError(f'Indicador desconocido: {nombre} (opciones: {", ".join(datos.MOVIMIENTOS)})')
+    if sex not in SEXOS:
+        raise ValueError(f'Sexo desconocido: {sex} (opciones: {", ".join(SEXOS)})')
+
+    df = datos.get_movimiento(nombre)
+    if 'Sexo' in df:
+        df = df[df.Sexo == sex]
+    elif sex != 'Total':
+        raise ValueError(f'{nombre} no está desglosado por sexo')
+    return df
+
+def indicador(nombre, year=None, sex='Total', per_mil=False, provincia=None):
+    '''Nacimientos, defunciones o matrimonios (`nombre`) por provincia y año,
+    en cantidad o por mil habitantes. Incluye la fila del Total Nacional.'''
+    columna, por_mil = datos.MOVIMIENTOS.get(nombre, (None, None))
+    df = _movimiento(nombre, sex)
+    if year is not None:
+        df = df[df.Periodo == year]
+    if provincia is not None:
+        df = df[df.id == provincias.id_provincia(provincia)]
+
+    valor = por_mil if per_mil else columna
+    return df[['id', 'Codigo', 'Provincias', 'Periodo', valor, 'Poblacion']].reset_index(drop=True)
+
+class Matriz:
+    '''Un movimiento natural como matrices densas año × provincia (una por
+    columna: cantidad, tasa por mil y población), con sus sumas acumuladas
+    por año para sacar la media de cualquier periodo con una resta de filas.
+    Los años sin dato (NaN) no cuentan en la media.'''
+
+    def __init__(self, df, columnas):
+        self.years = np.arange(df.Periodo.min(), df.Periodo.max() + 1)
+        self.ids = np.sort(df.id.unique())
+        i = df.Periodo.to_numpy() - self.years[0]
+        j = np.searchsorted(self.ids, df.id.to_numpy())
+
+        self.valores, self._acumulados, self._contados = {}, {}, {}
+        for col in columnas:
+            m = np.full((len(self.years), len(self.ids)), np.nan)
+            m[i, j] = df[col].to_numpy()
+            # Sumas y número de años con dato hasta cada año (la fila 0 es antes del primero)
+            acumulado = np.zeros((len(self.years) + 1, len(self.ids)))
+            np.nancumsum(m, axis=0, out=acumulado[1:])
+            contados = np.zeros((len(self.years) + 1, len(self.ids)), dtype='int64')
+            np.cumsum(~np.isnan(m), axis=0, out=contados[1:])
+            for a in (m, acumulado, contados):
+                a.setflags(write=False)
+            self.valores[col], self._acumulados[col], self._contados[col] = m, acumulado, contados
+
+    def media(self, columna, periodo):
+        '''Media por provincia de `columna` en `periodo`: un año o (desde, hasta), ambos incluidos.'''
+        desde, hasta = (periodo, periodo) if np.isscalar(periodo) else periodo
+        if not self.years[0] <= desde <= hasta <= self.years[-1]:
+            raise ValueError(f'Periodo fuera de los datos ({self.years[0]}-{self.years[-1]}): {periodo}')
+        a, b = desde - self.years[0], hasta - self.years[0] + 1
+        n = self._contados[columna][b] - self._contados[columna][a]
+        suma = self._acumulados[columna][b] - self._acumulados[columna][a]
+        # NaN solo si la provincia no tiene ningún año con dato en el periodo
+        return np.divide(suma, n, out=np.full(len(self.ids), np.nan), where=n > 0)
+
+@recurso
+def get_matriz(nombre, sex='Total'):
+    columna, por_mil = datos.MOVIMIENTOS.get(nombre, (None, None))
+    return Matriz(_movimiento(nombre, sex), [columna, por_mil, 'Poblacion'])
+
+MEDIDAS = {
+    'diferencia': lambda a, b: b - a,
+    'ratio': lambda a, b: b / a,
+    'porcentaje': lambda a, b: (b - a) / a * 100,
+}
+
+def comparar(nombre, periodo1, periodo2, sex='Total', medida='diferencia'):
+    '''Por provincia, compara la cantidad y la tasa por mil de `periodo2` con
+    las de `periodo1` (cada uno un año o un intervalo (desde, hasta), del que
+    se toma la media). `medida` es 'diferencia', 'ratio' o 'porcentaje'. La
+    población es la media de los dos periodos.'''
+    if medida not in MEDIDAS:
+        raise ValueError(f'Medida desconocida: {medida} (opciones: {", ".join(MEDIDAS)})')
+    columna, por_mil = datos.MOVIMIENTOS.get(nombre, (None, None))
+    m = get_matriz(nombre, sex)
+
+    df = pd.DataFrame({'id': m.ids})
+    for col in (columna, por_mil):
+        df[col] = MEDIDAS[medida](m.media(col, periodo1), m.media(col, periodo2))
+    df['Poblacion'] = (m.media('Poblacion', periodo1) + m.media('Poblacion', periodo2)) / 2
+
+    # Entre años sueltos la diferencia de cantidades es entera
+    if medida == 'diferencia' and np.isscalar(periodo1) and np.isscalar(periodo2):
+        df[columna] = df[columna].astype('int64')
+    return provincias.con_nombres(df.dropna())[['id', 'Codigo', 'Provincias', columna, por_mil, 'Poblacion']]
+
+def diferencia(nombre, year1, year2, sex='Total'):
+    '''Por provincia, cambio de la cantidad y de la tasa por mil entre `year1`
+    y `year2` (el valor de `year2` si son el mismo año). La población es la
+    media de los dos años.'''
+    columna, por_mil = datos.MOVIMIENTOS.get(nombre, (None, None))
+    df = _movimiento(nombre, sex)
+
+    if year1 == year2:
+        return df.loc[df.Periodo == year1, ['id', 'Codigo', 'Provincias', columna, por_mil, 'Poblacion']].reset_index(drop=True)
+
+    return comparar(nombre, year1, year2, sex)
+
+ANCHOS_PIRAMIDE = [1, 5, 10]
+SEXOS_PIRAMIDE = ['Hombres', 'Mujeres']
+
+@recurso
+def get_cubo_piramide(ancho=10):
+    '''Población por año × sexo × grupo de edad de `ancho` años, calculada una
+    sola vez: (years, grupos, cubo) con cubo[i, s, g] la población del año
+    years[i], sexo SEXOS_PIRAMIDE[s] y grupo grupos[g]. El último grupo es
+    '>= 100'. Los arrays son de solo lectura.'''
+    if ancho not in ANCHOS_PIRAMIDE:
+        raise ValueError(f'Ancho de grupo no soportado: {ancho} (opciones: {ANCHOS_PIRAMIDE})')
+    # El mismo cubo por edad que los indicadores, con '85 y más' y '100 y más' contados una vez
+    years, cubo = indicadores.edades()
+    sexos = [indicadores.SEXOS.index(s) for s in SEXOS_PIRAMIDE]
+    cubo = np.add.reduceat(cubo[:, sexos], np.arange(0, 101, ancho), axis=-1).round().astype('int64')
+
+    grupos = np.array([f'{a}-{a+ancho-1}' if ancho > 1 else str(a) for a in range(0, 100, ancho)] + ['>= 100'])
+    for a in (years, grupos, cubo):
+        a.setflags(write=False)
+    return years, grupos, cubo
+
+def piramide(year, ancho=10):
+    '''Población de hombres y de mujeres por grupos de edad de `ancho` años
+    (1, 5 o 10; el último grupo es '>= 100'). Es una rebanada del cubo.'''
+    years, grupos, cubo = get_cubo_piramide(ancho)
+    i = np.searchsorted(years, year)
+    if i == len(years) or years[i] != year:
+        raise ValueError(f'No hay datos de población por edad para {year}')
+    return pd.DataFrame(cubo[i].T, index=pd.Index(grupos, name='Grupo'), columns=pd.Index(SEXOS_PIRAMIDE, name='Sexo'))
+
+def crecimiento(desde=None, hasta=None):
+    '''Nacimientos, defunciones y crecimiento vegetativo (Δ Personas) de España por año.'''
+    df = datos.get_evolucion()
+    if desde is not None:
+        df = df[df.Periodo >= desde]
+    if hasta is not None:
+        df = df[df.Periodo <= hasta]
+    crecimiento = indicadores.serie('crecimiento_natural').reindex(df.Periodo).to_numpy().astype('int64')
+    return df[['Periodo', 'Nacimientos', 'Defunciones']].assign(**{'Δ Personas': crecimiento}).reset_index(drop=True)
@@ -0,0 +1,309 @@
+import dataclasses
+import functools
+import hashlib
+import os
+import re
+import threading
+
+import pandas as pd
+import pyarrow as pa
+from streamlit import logger
+
+from demografia import perfil, provincias
+from demografia.cache import limpiar, recurso
+
+#--------------
+
+DATA_DIR = './data'
+ARTEFACTOS_DIR = os.path.join(DATA_DIR, '.artefactos')
+VERSION_ARTEFACTOS = 3  # Subir si cambia el esquema de algún artefacto
+
+_log = logger.get_logger(__name__)
+
+# Un fichero por década (data/nombres/nombres1920.csv...): basta añadir el de la siguiente
+DECADAS_NOMBRES = sorted(int(m.group(1)) for f in os.listdir(os.path.join(DATA_DIR, 'nombres'))
+                         if (m := re.fullmatch(r'nombres(\d{4})\.csv', f)))
+
+# fichero -> (columna de cantidad, columna por mil habitantes)
+MOVIMIENTOS = {
+    'nacimientos': ('Nacimientos', 'NacimientosPorMil'),
+    'defunciones': ('Defunciones', 'DefuncionesPerMil'),
+    'matrimonios': ('Matrimonios', 'MatrimoniosperMil'),
+}
+
+def _csv(nombre):
+    return os.path.join(DATA_DIR, nombre)
+
+# Los artefactos son ficheros Arrow sin comprimir: se leen con mmap y las
+# columnas del DataFrame son vistas de solo lectura sobre el fichero, sin
+# copiarlo. Cada proceso los carga una sola vez (@recurso) y todas las sesiones
+# y páginas comparten esas vistas; varios procesos comparten además las
+# páginas del fichero a través de la caché del sistema operativo.
+
+def _ruta_artefacto(nombre):
+    return os.path.join(ARTEFACTOS_DIR, f'{nombre}.v{VERSION_ARTEFACTOS}.arrow')
+
+def _guardar(df, ruta):
+    # Se escribe aparte y se renombra, para que nadie lea un fichero a medias
+    # (quien ya tenga mapeado el anterior lo sigue viendo entero)
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+    tmp = f'{ruta}.{os.getpid()}.tmp'
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(tmp, 'wb') as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    os.replace(tmp, ruta)
+
+def _leer(ruta):
+    # split_blocks: una columna por bloque, para que pandas no las junte en una copia
+    return pa.ipc.open_file(pa.memory_map(ruta)).read_all().to_pandas(split_blocks=True)
+
+def artefacto_al_dia(nombre):
+    '''Si el artefacto de `nombre` existe y es más reciente que sus CSV de origen.'''
+    try:
+        return os.path.getmtime(_ruta_artefacto(nombre)) >= max(os.path.getmtime(f) for f in FUENTES[nombre])
+    except OSError:
+        return False
+
+def _artefacto(nombre):
+    '''Devuelve el DataFrame tipado `nombre`, mapeando el artefacto ya
+    construido si es más reciente que sus CSV de origen. Si no, lo construye
+    y lo guarda (si el disco es de solo lectura no se guarda y el DataFrame
+    queda en memoria, sin compartir).'''
+    ruta = _ruta_artefacto(nombre)
+    if artefacto_al_dia(nombre):
+        try:
+            with perfil.tramo(f'datos.leer:{nombre}'):
+                return _leer(ruta)
+        except (OSError, pa.ArrowException) as e:
+            _log.warning(f'No se puede leer {ruta} ({e}): se reconstruye')
+
+    with perfil.tramo(f'datos.construir:{nombre}'):
+        df = CONSTRUCTORES[nombre]()
+    try:
+        _guardar(df, ruta)
+        return _leer(ruta)
+    except (OSError, pa.ArrowException) as e:
+        _log.warning(f'No se puede guardar {ruta} ({e}): {nombre} queda en memoria, sin compartir')
+        return df
+
+def _categorias(s, f):
+    # Aplica `f` a las categorías (~50 valores distintos) en vez de fila a fila
+    s = s.astype('category')
+    return s.cat.rename_categories([f(c) for c in s.cat.categories])
+
+#--------------
+# Cada función construye un artefacto a partir de su CSV de origen (o de otro
+# con el mismo formato, `ruta`: así se construyen solo las filas nuevas al
+# ampliar un conjunto, ver ampliado()).
+
+def _construir_poblacion_provincias(ruta=None):
+    df = pd.read_csv(ruta or _csv('poblacion_por_provincias.csv'), sep=';', usecols=['Provincias', 'Periodo', 'Total'],
+        thousands='.', decimal=',', dtype={'Provincias': 'category', 'Periodo': 'category'})
+    # '02 Albacete' -> 2; 'Total Nacional' -> 0
+    ids = df.Provincias.cat.categories.str.extract(r'^(\d\d) ')[0].fillna(provincias.TOTAL).astype('int8')
+    df = pd.DataFrame({
+        'id': ids.to_numpy()[df.Provincias.cat.codes],
+        'Periodo': _categorias(df.Periodo, lambda x: int(x.split()[-1])).astype('int16'),
+        # Son estimaciones con decimales; float32 no da precisión de unidades con 47M
+        'Poblacion': df.Total.astype('float64'),
+    })
+    return provincias.con_nombres(df)[['id', 'Codigo', 'Provincias', 'Periodo', 'Poblacion']]
+
+def _construir_poblacion_sexo_edad(ruta=None):
+    return pd.read_csv(ruta or _csv('poblacion_por_sexo_edad.csv'), sep=';',
+        dtype={'Edad': 'category', 'Sexo': 'category', 'Periodo': 'int16', 'Total': 'int32'})
+
+def _construir_evolucion(ruta=None):
+    df = pd.read_csv(ruta or _csv('evolucion_poblacion.csv'), sep=';', dtype='int32')
+    return df.astype({'Periodo': 'int16'})
+
+def _construir_movimiento(fichero, ruta=None):
+    columna, por_mil = MOVIMIENTOS[fichero]
+    # Los nombres de provincia del CSV no se leen: salen de la tabla de provincias
+    df = pd.read_csv(ruta or _csv(f'{fichero}.csv'), sep=';', usecols=lambda c: c != 'Provincias',
+        dtype={'Codigo': 'int8', 'Sexo': 'category', 'Periodo': 'int16', 'Total': 'int32'})
+    df = df.rename(columns={'Codigo': 'id', 'Total': columna})
+
+    df = con_tasa(df, get_poblacion_provincias(), columna, por_mil)
+    provincias.con_nombres(df)
+    return df[['id', 'Codigo', 'Provincias'] + [c for c in df.columns if c not in ('id', 'Codigo', 'Provincias')]]
+
+def _construir_nombres(ruta=None):
+    # Son varios ficheros, uno por década: no se amplía fila a fila
+    assert ruta is None
+    dfs = []
+    for decada in DECADAS_NOMBRES:
+        df = pd.read_csv(_csv(f'nombres/nombres{decada}.csv'), sep=';',
+            dtype={'cod_prov': str, 'prov': str, 'nameH': str, 'nameM': str,
+                   'freqH': 'int32', 'freqM': 'int32', 'por1000H': 'float32', 'por1000M': 'float32'})
+        df.insert(0, 'Decada', decada)
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
+    df['Decada'] = df.Decada.astype('int16')
+    df.insert(1, 'id', df.cod_prov.astype('int8'))
+    return df.astype({c: 'category' for c in ['cod_prov', 'prov', 'nameH', 'nameM']})
+
+#--------------
+
+# Ficheros de origen de cada conjunto de datos
+FUENTES = {
+    'poblacion_provincias': [_csv('poblacion_por_provincias.csv')],
+    'poblacion_sexo_edad': [_csv('poblacion_por_sexo_edad.csv')],
+    'evolucion': [_csv('evolucion_poblacion.csv')],
+    'nombres': [_csv(f'nombres/nombres{d}.csv') for d in DECADAS_NOMBRES],
+    **{f: [_csv(f'{f}.csv'), _csv('poblacion_por_provincias.csv')] for f in MOVIMIENTOS},
+}
+
+CONSTRUCTORES = {
+    'poblacion_provincias': _construir_poblacion_provincias,
+    'poblacion_sexo_edad': _construir_poblacion_sexo_edad,
+    'evolucion': _construir_evolucion,
+    'nombres': _construir_nombres,
+    **{f: functools.partial(_construir_movimiento, f) for f in MOVIMIENTOS},
+}
+
+# La versión (ver version()) forma parte de la clave: si cambian los ficheros
+# de origen, p. ej. tras demografia.ingesta, la entrada vieja no se usa más
+@recurso
+def _cargar(nombre, version):
+    return _artefacto(nombre)
+
+_versiones = {}  # nombre -> versión de lo que tienen las cachés del proceso
+_versiones_lock = threading.Lock()
+
+def _comprobar(versiones):
+    with _versiones_lock:
+        cambiado = any(_versiones.get(n, v) != v for n, v in versiones.items())
+        _versiones.update(versiones)
+    if cambiado:
+        limpiar()
+    return cambiado
+
+def al_dia(*nombres):
+    '''Comprueba si han cambiado los ficheros de origen de los conjuntos
+    `nombres` (de todos, si no se indica ninguno) desde la última vez, p. ej.
+    por demografia.ingesta desde otro proceso. Si es así, vacía las cachés
+    en memoria del proceso, también las de lo derivado de los datos
+    (matrices, índices, figuras), y devuelve True. Las páginas lo llaman al
+    empezar cada rerun: cuesta un stat por fichero de origen.'''
+    return _comprobar({n: version(n) for n in nombres or FUENTES})
+
+def cargar(nombre):
+    '''DataFrame tipado del conjunto `nombre`, compartido por todo el proceso
+    mientras no cambien sus ficheros de origen.'''
+    v = version(nombre)
+    _comprobar({nombre: v})
+    return _cargar(nombre, v)
+
+def get_poblacion_provincias():
+    return cargar('poblacion_provincias')
+
+def get_poblacion_sexo_edad():
+    return cargar('poblacion_sexo_edad')
+
+def get_evolucion():
+    return cargar('evolucion')
+
+def get_nombres():
+    return cargar('nombres')
+
+def con_tasa(df, poblacion, columna, por_mil):
+    '''Añade a `df` la población de cada (id, Periodo) y la tasa `por_mil` de `columna`.'''
+    poblacion = poblacion[['id', 'Periodo', 'Poblacion']]
+    poblacion = poblacion[poblacion.Periodo.between(df.Periodo.min(), df.Periodo.max())]
+
+    df = df.merge(poblacion, on=['id', 'Periodo'], how='left', validate='many_to_one')
+    if df.Poblacion.isna().any():
+        years = sorted(df.Periodo[df.Poblacion.isna()].unique())
+        raise ValueError(f'Faltan datos de población para {columna} en {", ".join(map(str, years))}')
+
+    df[por_mil] = (df[columna] / df.Poblacion * 1000).astype('float32')
+    return df
+
+def get_movimiento(fichero):
+    '''Nacimientos, defunciones o matrimonios por provincia y año, junto con la
+    población de la provincia y la tasa por mil habitantes.'''
+    return cargar(fichero)
+
+def memoria():
+    '''Memoria de cada conjunto de datos en este proceso (se cargan si no lo
+    estaban): filas, bytes de sus columnas y cuántos de ellos son vistas del
+    artefacto mapeado, compartidas entre sesiones, páginas y procesos.'''
+    filas = []
+    for nombre, cargar in CARGADORES.items():
+        df = cargar()
+        compartidos = 0
+        for c in df:
+            valores = df[c].cat.codes.to_numpy() if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c].to_numpy()
+            if not valores.flags.writeable:
+                compartidos += valores.nbytes
+        filas.append({'Conjunto': nombre, 'Filas': len(df), 'Bytes': int(df.memory_usage(deep=True, index=False).sum()),
+                      'Compartidos': compartidos})
+    return pd.DataFrame(filas)
+
+def residente():
+    '''Memoria residente (RSS) del proceso, en bytes.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # el máximo, no el actual
+
+def ampliado(nombre, ruta):
+    '''El artefacto de `nombre` con las filas del CSV `ruta` (mismo formato
+    que su CSV de origen) añadidas, sin reconstruir las que ya tenía y sin
+    guardarlo. Las filas nuevas van delante, como en el CSV tras la ingesta
+    (ver demografia.ingesta.con_filas()): el resultado es el mismo que al
+    construirlo entero.'''
+    viejo = _leer(_ruta_artefacto(nombre))
+    df = pd.concat([CONSTRUCTORES[nombre](ruta), viejo], ignore_index=True)
+    # Al concatenar categóricas con distintas categorías quedan como object
+    return df.astype({c: 'category' for c, t in viejo.dtypes.items() if isinstance(t, pd.CategoricalDtype)})
+
+def guardar_artefacto(nombre, df):
+    _guardar(df, _ruta_artefacto(nombre))
+
+def marcar_al_dia(nombre):
+    '''Da por bueno el artefacto de `nombre` tras cambiar un CSV de origen que
+    no altera su contenido.'''
+    os.utime(_ruta_artefacto(nombre))
+
+#--------------
+# Referencias ligeras a los conjuntos de datos para pasarlas a funciones
+# cacheadas en lugar del DataFrame: st.cache_data hashea los argumentos en cada
+# llamada para formar la clave, y hashear un Conjunto es hashear dos cadenas.
+
+CARGADORES = {
+    'poblacion_provincias': get_poblacion_provincias,
+    'poblacion_sexo_edad': get_poblacion_sexo_edad,
+    'evolucion': get_evolucion,
+    'nombres': get_nombres,
+    **{f: (lambda f=f: get_movimiento(f)) for f in MOVIMIENTOS},
+}
+
+def version(nombre):
+    '''Marca de versión del contenido de un conjunto: cambia si cambia alguno
+    de sus ficheros de origen (fecha o tamaño) o el esquema de los artefactos.'''
+    h = hashlib.blake2b(str(VERSION_ARTEFACTOS).encode(), digest_size=8)
+    for f in FUENTES[nombre]:
+        info = os.stat(f)
+        h.update(f'{f}:{info.st_mtime_ns}:{info.st_size}'.encode())
+    return h.hexdigest()
+
+@dataclasses.dataclass(frozen=True)
+class Conjunto:
+    '''Referencia a un conjunto de datos (nombre y versión). Como argumento de
+    una función cacheada, la clave solo depende de estos dos campos; los
+    datos se obtienen con `.df`, de la caché de la capa de datos.'''
+    nombre: str
+    version: str
+
+    @property
+    def df(self):
+        return CARGADORES[self.nombre]()
+
+def conjunto(nombre):
+    if nombre not in FUENTES:
+        raise ValueError(f'Conjunto de datos desconocido: {nombre}')
+    return Conjunto(nombre, version(nombre))
@@ -0,0 +1,267 @@
+'''Niveles geográficos sobre los que se pintan los mapas (por ahora, las
+provincias), y su geometría simplificada para cada zoom.
+
+    python -m demografia.geografia      # construye la geometría y muestra su tamaño por zoom
+'''
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+from shapely.ops import polylabel
+from streamlit import logger
+
+from demografia import datos, provincias, topologia
+from demografia.cache import recurso
+
+#--------------
+# Cada nivel sabe leer su GeoJSON, el id entero de cada feature y su nombre,
+# y da la geometría simplificada para un nivel de zoom: a zoom 5 un píxel son
+# ~0.04°, así que no tiene sentido mandar al navegador vértices a metros de
+# distancia. La geometría de cada zoom es una topología (demografia.topologia),
+# que se guarda como artefacto. Los datos, las páginas y la propiedad
+# `Provincia` de los tooltips dan por hecho que el nivel son las provincias
+# (ids de 2 cifras, int8): otro nivel necesitaría también sus datos y un
+# selector en las páginas.
+
+ZOOM_MAX = 18
+ZOOM_MIN = 5  # El de los mapas de las páginas al abrirse
+VERSION_TOPOLOGIA = 1  # Subir si cambia cómo se construye la topología
+
+_log = logger.get_logger(__name__)
+
+def tolerancia(zoom):
+    '''Grados que ocupa aproximadamente un píxel a ese zoom (teselas de 256px).'''
+    return 360 / (256 * 2**zoom)
+
+class Nivel:
+    '''Un nivel geográfico. `propiedad_id` es la propiedad de cada feature con
+    su código INE, que también es la clave `id` de los datos; `zoom_detalle`
+    es el zoom máximo al que la geometría simplificada se ve sin defectos.'''
+
+    def __init__(self, nombre, fichero, propiedad_id='codigo', propiedad_nombre='texto', zoom_detalle=7):
+        self.nombre = nombre
+        self.fichero = fichero
+        self.propiedad_id = propiedad_id
+        self.propiedad_nombre = propiedad_nombre
+        self.zoom_detalle = zoom_detalle
+
+    def __repr__(self):
+        return f'Nivel({self.nombre!r})'
+
+    @property
+    def key_on(self):
+        return f'properties.{self.propiedad_id}'
+
+    def disponible(self):
+        return os.path.exists(self.fichero)
+
+    def geojson(self):
+        # Parseado una vez por proceso y compartido: no modificar
+        return _geojson(self.fichero)
+
+    def ids(self):
+        '''id de cada feature del GeoJSON, en el mismo orden.'''
+        return _ids(self.nombre)
+
+    def nombres(self):
+        '''Nombre de cada feature del GeoJSON, en el mismo orden.'''
+        return np.array([f['properties'][self.propiedad_nombre] for f in self.geojson()['features']], dtype=object)
+
+    @property
+    def zooms(self):
+        '''Zooms para los que se construye la geometría de antemano.'''
+        return range(ZOOM_MIN, self.zoom_detalle + 1)
+
+    @property
+    def objeto(self):
+        '''Ruta de la colección en su TopoJSON (el argumento `topojson` de folium).'''
+        return f'objects.{self.nombre}'
+
+    def zoom(self, zoom=None):
+        return min(max(self.zoom_detalle if zoom is None else zoom, ZOOM_MIN), ZOOM_MAX)
+
+    def topologia(self, zoom=None):
+        '''TopoJSON simplificado y cuantizado para `zoom`, con las propiedades
+        de id y nombre. Compartido: no modificar.'''
+        return _topologia(self.nombre, self.zoom(zoom))
+
+    def geometrias(self, zoom=None):
+        '''Geometría (dicts GeoJSON) de cada feature, simplificada para `zoom`.'''
+        return _geometrias(self.nombre, self.zoom(zoom))
+
+    def en_punto(self, lat, lon):
+        '''Posición (en el orden del GeoJSON) de la feature que contiene el
+        punto, o None. Consulta un STRtree sobre la geometría original,
+        construido una vez por proceso: unas decenas de µs.'''
+        dentro = _indice(self.nombre).query(shapely.Point(lon, lat), predicate='intersects')
+        return int(dentro[0]) if len(dentro) else None
+
+    def puntos(self):
+        '''[lat, lon] del punto de etiqueta de cada feature, en el orden del
+        GeoJSON: el punto del interior más alejado del borde (polylabel) de
+        su polígono mayor, que a diferencia del centroide siempre cae dentro.'''
+        return _puntos(self.nombre)
+
+    def punto(self, id):
+        '''[lat, lon] del punto de etiqueta de la feature con ese id, o None si no está.'''
+        pos = np.flatnonzero(self.ids() == id)
+        return self.puntos()[pos[0]].tolist() if len(pos) else None
+
+    def _propiedades(self, df, campos, base):
+        # Propiedades de cada feature: las de `base`, `Provincia` y los campos formateados
+        ids = self.ids()
+        n = max(int(ids.max()), int(df.id.max())) + 1
+        filas = indice_filas(df.id.to_numpy(), n)[ids]
+
+        nombres = self.nombres()
+        valores = {col: df[col].to_numpy()[filas] for col in campos}
+        textos = {col: [fmt.format(v) if f >= 0 else 'Sin datos' for v, f in zip(valores[col], filas)] for col, fmt in campos.items()}
+        return [{**p, 'Provincia': nombres[i], **{col: textos[col][i] for col in campos}} for i, p in enumerate(base)]
+
+    def con_datos(self, df, campos, zoom=None):
+        '''FeatureCollection con la geometría para `zoom` y, en las propiedades,
+        `Provincia` (el nombre) y cada columna de `campos` (columna -> formato)
+        ya formateada para el tooltip. `df` debe tener una fila por id.'''
+        geometrias = self.geometrias(zoom)
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': geometrias[i], 'properties': p}
+            for i, p in enumerate(self._propiedades(df, campos, [f['properties'] for f in self.geojson()['features']]))
+        ]}
+
+    def topologia_con_datos(self, df, campos, zoom=None):
+        '''Como con_datos(), pero un TopoJSON: los arcos son los de
+        topologia(), compartidos; solo se crean las geometrías con sus
+        propiedades.'''
+        topo = self.topologia(zoom)
+        geometrias = topo['objects'][self.nombre]['geometries']
+        return {**topo, 'objects': {self.nombre: {'type': 'GeometryCollection', 'geometries': [
+            {'type': g['type'], 'arcs': g['arcs'], 'properties': p}
+            for g, p in zip(geometrias, self._propiedades(df, campos, [g['properties'] for g in geometrias]))
+        ]}}}
+
+class _NivelProvincias(Nivel):
+    # Mismo GeoJSON ya cargado por demografia.provincias y nombres de la tabla de dimensión
+
+    def geojson(self):
+        return provincias.get_geojson()
+
+    def nombres(self):
+        return _nombres_provincias()
+
+PROVINCIAS = _NivelProvincias('provincias', provincias.PROV_GEO, zoom_detalle=7)
+
+NIVELES = {n.nombre: n for n in [PROVINCIAS]}
+
+def disponibles():
+    return [n for n in NIVELES.values() if n.disponible()]
+
+def indice_filas(ids, n):
+    '''Array de tamaño `n` que da, para cada id, su fila en `ids` (-1 si no aparece).'''
+    pos = np.full(n, -1)
+    pos[ids] = np.arange(len(ids))
+    return pos
+
+#--------------
+
+@recurso
+def _geojson(fichero):
+    with open(fichero, encoding='utf-8') as f:
+        return json.load(f)
+
+@recurso
+def _ids(nombre):
+    nivel = NIVELES[nombre]
+    return np.array([int(f['properties'][nivel.propiedad_id]) for f in nivel.geojson()['features']], dtype='int32')
+
+@recurso
+def _nombres_provincias():
+    return provincias.get_provincias().Provincia.reindex(PROVINCIAS.ids()).to_numpy()
+
+@recurso
+def _originales(nombre):
+    # Geometría shapely sin simplificar, preparada para las consultas
+    geometrias = np.array([shape(f['geometry']) for f in NIVELES[nombre].geojson()['features']])
+    shapely.prepare(geometrias)
+    return geometrias
+
+@recurso
+def _indice(nombre):
+    return shapely.STRtree(_originales(nombre))
+
+@recurso
+def _puntos(nombre):
+    nivel = NIVELES[nombre]
+    mayor = lambda g: max(g.geoms, key=lambda p: p.area) if g.geom_type == 'MultiPolygon' else g
+    puntos = [polylabel(mayor(g), tolerancia(nivel.zoom_detalle)) for g in _originales(nombre)]
+    return np.array([[p.y, p.x] for p in puntos])
+
+def _ruta_topologia(nombre, zoom):
+    return os.path.join(datos.ARTEFACTOS_DIR, f'{nombre}.z{zoom}.v{VERSION_TOPOLOGIA}.topojson')
+
+@recurso
+def _topologia(nombre, zoom):
+    # Del artefacto si es más reciente que el GeoJSON; si no, se construye y se guarda
+    nivel = NIVELES[nombre]
+    ruta = _ruta_topologia(nombre, zoom)
+    try:
+        al_dia = os.path.getmtime(ruta) >= os.path.getmtime(nivel.fichero)
+    except OSError:
+        al_dia = False
+    if al_dia:
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            _log.warning(f'No se puede leer {ruta} ({e}): se reconstruye')
+
+    topo = topologia.topologia(nivel.geojson()['features'], tolerancia(zoom), nombre,
+                               [nivel.propiedad_id, nivel.propiedad_nombre])
+    tmp = f'{ruta}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(datos.ARTEFACTOS_DIR, exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(topo, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp, ruta)
+    except OSError as e:
+        _log.warning(f'No se puede guardar {ruta} ({e}): {nombre} a zoom {zoom} queda en memoria')
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return topo
+
+@recurso
+def _geometrias(nombre, zoom):
+    return topologia.geometrias(_topologia(nombre, zoom), nombre)
+
+#--------------
+
+def tamanos(nivel):
+    '''Tamaño de la geometría de `nivel` en cada zoom: vértices y bytes como
+    GeoJSON y como TopoJSON, en crudo y con gzip.'''
+    filas = [{'Zoom': 'original', 'Vértices': None, 'GeoJSON': os.path.getsize(nivel.fichero)}]
+    for zoom in nivel.zooms:
+        topo = nivel.topologia(zoom)
+        geojson, geojson_gz = topologia.tamano(nivel.geometrias(zoom))
+        topojson, topojson_gz = topologia.tamano(topo)
+        filas.append({'Zoom': zoom, 'Vértices': sum(len(a) for a in topo['arcs']), 'GeoJSON': geojson,
+                      'GeoJSON gzip': geojson_gz, 'TopoJSON': topojson, 'TopoJSON gzip': topojson_gz})
+    return pd.DataFrame(filas).astype({c: 'Int64' for c in ['Vértices', 'GeoJSON', 'GeoJSON gzip', 'TopoJSON', 'TopoJSON gzip']})
+
+def main():
+    parser = argparse.ArgumentParser(description='Construye la geometría simplificada de cada nivel y muestra su tamaño')
+    parser.add_argument('niveles', nargs='*', metavar='nivel',
+                        help=f'{", ".join(NIVELES)} (por defecto, todos los disponibles)')
+    args = parser.parse_args()
+    for nombre in args.niveles:
+        if nombre not in NIVELES:
+            parser.error(f'Nivel desconocido: {nombre} (opciones: {", ".join(NIVELES)})')
+    for nombre in args.niveles or [n.nombre for n in disponibles()]:
+        print(f'# {nombre}')
+        print(tamanos(NIVELES[nombre]).to_string(index=False, na_rep='-'))
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from demografia import datos, provincias
+from demografia.cache import recurso
+
+#--------------
+# Indicadores derivados. Cada uno se define una vez, como una función que los
+# calcula para todas las provincias, años y sexos a la vez; se materializan
+# todos juntos la primera vez que se piden (get_tabla) y después consultarlos
+# es seleccionar filas. Los de estructura por edad solo existen para España:
+# la población por edad y sexo no está desglosada por provincias.
+
+SEXOS = ['Total', 'Hombres', 'Mujeres']
+
+def _serie(ids, years, sexos, valores):
+    '''Series con índice (id, Periodo, Sexo) a partir de arrays alineados.'''
+    indice = pd.MultiIndex.from_arrays([np.asarray(ids, dtype='int64'), np.asarray(years, dtype='int64'),
+                                        np.asarray(sexos, dtype=object)], names=['id', 'Periodo', 'Sexo'])
+    return pd.Series(np.asarray(valores, dtype='float64'), index=indice)
+
+def _nacional(years, valores):
+    '''Series para España a partir de una matriz años × SEXOS.'''
+    years = np.repeat(years, len(SEXOS))
+    sexos = np.tile(SEXOS, len(valores))
+    return _serie(np.full(len(years), provincias.TOTAL), years, sexos, np.ravel(valores))
+
+def _movimiento(fichero, columna):
+    df = datos.get_movimiento(fichero)
+    sexos = df.Sexo.astype(str) if 'Sexo' in df else 'Total'
+    return _serie(df.id, df.Periodo, np.broadcast_to(sexos, len(df)), df[columna])
+
+@recurso
+def edades():
+    '''(years, cubo) con cubo[i, s, e] la población de España del año
+    years[i], sexo SEXOS[s] y edad e, de 0 a la mayor que publica el INE.
+    Los años en los que el INE no desglosa a los mayores de 85 tienen
+    todo '85 y más' en la edad 85. Cada edad está una sola vez: la suma es
+    la población total. Los arrays son de solo lectura.'''
+    df = datos.get_poblacion_sexo_edad()
+    edades = pd.to_numeric(df.Edad.cat.categories, errors='coerce').to_numpy()[df.Edad.cat.codes]
+    df, edades = df[~np.isnan(edades)], edades[~np.isnan(edades)].astype('int64')
+
+    years = np.sort(df.Periodo.unique())
+    i = np.searchsorted(years, df.Periodo.to_numpy())
+    s = pd.Categorical(df.Sexo, categories=SEXOS).codes
+    # Con 85 y con 100 hay dos filas, 'N años' y 'N y más años': la segunda
+    # incluye a la primera y es la que queda. Después, en cada una se deja
+    # solo lo que no está en las edades siguientes (las que haya desglosadas)
+    cubo = np.zeros((len(years), len(SEXOS), edades.max() + 1))
+    np.maximum.at(cubo, (i, s, edades), df.Total.to_numpy())
+    for e in [100, 85]:
+        cubo[..., e] -= cubo[..., e+1:].sum(-1)
+    for a in (years, cubo):
+        a.setflags(write=False)
+    return years, cubo
+
+def _grupos(cubo):
+    # Población de 0-15, 16-64 y 65 y más años, los grupos que usa el INE en sus indicadores
+    return cubo[..., :16].sum(-1), cubo[..., 16:65].sum(-1), cubo[..., 65:].sum(-1)
+
+#--------------
+
+def _poblacion():
+    years, cubo = edades()
+    return _nacional(years, cubo.sum(-1))
+
+def _crecimiento_natural(por_mil=False):
+    nac = _movimiento('nacimientos', 'Nacimientos')
+    defu = _movimiento('defunciones', 'Defunciones')
+    nac, defu = nac.align(defu, join='inner')
+    if not por_mil:
+        return nac - defu
+    poblacion = _movimiento('nacimientos', 'Poblacion').reindex(nac.index)
+    return (nac - defu) / poblacion * 1000
+
+def _razon_sexos():
+    years, cubo = edades()
+    total = cubo.sum(-1)
+    valores = np.full((len(years), len(SEXOS)), np.nan)
+    valores[:, 0] = total[:, 1] / total[:, 2] * 100
+    return _nacional(years, valores).dropna()
+
+def _tasa_dependencia():
+    years, cubo = edades()
+    jovenes, adultos, mayores = _grupos(cubo)
+    return _nacional(years, (jovenes + mayores) / adultos * 100)
+
+def _indice_envejecimiento():
+    years, cubo = edades()
+    jovenes, _, mayores = _grupos(cubo)
+    return _nacional(years, mayores / jovenes * 100)
+
+def _edad_mediana():
+    years, cubo = edades()
+    # Interpolando dentro del año de edad en el que la población acumulada pasa de la mitad
+    acumulada = cubo.cumsum(-1)
+    mitad = acumulada[..., -1:] / 2
+    e = (acumulada < mitad).sum(-1, keepdims=True)
+    antes = np.take_along_axis(acumulada, e, -1) - np.take_along_axis(cubo, e, -1)
+    mediana = e + (mitad - antes) / np.take_along_axis(cubo, e, -1)
+    return _nacional(years, mediana[..., 0])
+
+class Indicador:
+    '''Un indicador derivado. `calcular()` devuelve una Series con índice
+    (id, Periodo, Sexo) con todos sus valores; `ambito` es 'provincias' o
+    'España' (solo el total nacional); `formato` es para mostrarlo.'''
+
+    def __init__(self, nombre, titulo, calcular, formato, ambito='provincias'):
+        self.nombre = nombre
+        self.titulo = titulo
+        self.calcular = calcular
+        self.formato = formato
+        self.ambito = ambito
+
+    def __repr__(self):
+        return f'Indicador({self.nombre!r})'
+
+INDICADORES = {i.nombre: i for i in [
+    Indicador('tasa_natalidad', 'Tasa bruta de natalidad', lambda: _movimiento('nacimientos', 'NacimientosPorMil'), '{:.2f} ‰'),
+    Indicador('tasa_mortalidad', 'Tasa bruta de mortalidad', lambda: _movimiento('defunciones', 'DefuncionesPerMil'), '{:.2f} ‰'),
+    Indicador('tasa_nupcialidad', 'Tasa bruta de nupcialidad', lambda: _movimiento('matrimonios', 'MatrimoniosperMil'), '{:.2f} ‰'),
+    Indicador('crecimiento_natural', 'Crecimiento natural', _crecimiento_natural, '{:,.0f} personas'),
+    Indicador('tasa_crecimiento_natural', 'Tasa de crecimiento natural', lambda: _crecimiento_natural(por_mil=True), '{:.2f} ‰'),
+    Indicador('poblacion', 'Población', _poblacion, '{:,.0f}', 'España'),
+    Indicador('razon_sexos', 'Hombres por cada 100 mujeres', _razon_sexos, '{:.1f}', 'España'),
+    Indicador('tasa_dependencia', 'Tasa de dependencia', _tasa_dependencia, '{:.1f} %', 'España'),
+    Indicador('edad_mediana', 'Edad mediana', _edad_mediana, '{:.1f} años', 'España'),
+    Indicador('indice_envejecimiento', 'Índice de envejecimiento', _indice_envejecimiento, '{:.1f} %', 'España'),
+]}
+
+#--------------
+
+@recurso
+def get_tabla():
+    '''Todos los indicadores, materializados: una columna por indicador e
+    índice (id, Periodo, Sexo) ordenado. Compartida: no modificar.'''
+    return pd.concat({nombre: i.calcular() for nombre, i in INDICADORES.items()}, axis=1).sort_index()
+
+def _indicador(nombre, sex):
+    if nombre not in INDICADORES:
+        raise ValueError(f'Indicador desconocido: {nombre} (opciones: {", ".join(INDICADORES)})')
+    if sex not in SEXOS:
+        raise ValueError(f'Sexo desconocido: {sex} (opciones: {", ".join(SEXOS)})')
+
+@recurso
+def _columna(nombre, sex):
+    # Una sola columna y sexo, sin huecos, con (id, Periodo) como índice
+    return get_tabla()[nombre].xs(sex, level='Sexo').dropna()
+
+def serie(nombre, sex='Total', provincia=provincias.TOTAL):
+    '''Valores de un indicador por año (Series indexada por Periodo) para
+    una provincia (id o nombre) o, por defecto, España.'''
+    _indicador(nombre, sex)
+    col = _columna(nombre, sex)
+    return col[col.index.get_level_values('id') == provincias.id_provincia(provincia)].droplevel('id')
+
+def valores(nombre, year=None, sex='Total', provincia=None):
+    '''Un indicador por provincia y año (con el Total Nacional), filtrado por
+    año, sexo y provincia (id o nombre) si se indican.'''
+    _indicador(nombre, sex)
+    df = _columna(nombre, sex).reset_index()
+    if year is not None:
+        df = df[df.Periodo == year]
+    if provincia is not None:
+        df = df[df.id == provincias.id_provincia(provincia)]
+    return provincias.con_nombres(df.reset_index(drop=True))[['id', 'Codigo', 'Provincias', 'Periodo', nombre]]
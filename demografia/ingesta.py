@@ -0,0 +1,421 @@
+'''Ingesta incremental de nuevas publicaciones del INE.
+
+    python -m demografia.ingesta nacimientos descarga.px
+    python -m demografia.ingesta poblacion_provincias 2852.csv --simular
+
+Lee la exportación (CSV de INEbase o PC-Axis .px) por bloques, la valida
+contra el CSV de data/ del conjunto y le añade solo los periodos que aún no
+tiene. El artefacto ya construido se amplía con esas filas en lugar de
+reconstruirse, y evolucion_poblacion.csv se completa con los años que ya
+tienen todos sus datos (es la suma nacional de los demás conjuntos).
+
+Se ejecuta desde la raíz del repositorio (las rutas a ./data son relativas).
+'''
+import argparse
+import codecs
+import itertools
+import os
+import re
+import tempfile
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from streamlit import config, logger
+
+# Los cargadores de datos están cacheados con Streamlit, que sin servidor avisa de ello
+config.set_option('global.showWarningOnDirectExecution', False)
+config.set_option('logger.level', 'error')
+logger.set_log_level('error')
+
+from demografia import cache, datos, provincias
+
+#--------------
+# Lectura por bloques. Cada bloque es un DataFrame de textos con una columna
+# por variable (Provincias, Sexo, Edad, Periodo...) y la cantidad en Total.
+
+FILAS_BLOQUE = 50_000
+
+VARIABLES = {'provincia': 'Provincias', 'sexo': 'Sexo', 'edad': 'Edad', 'periodo': 'Periodo'}
+
+def _variable(nombre):
+    # 'Edad (año a año)' -> 'Edad'; las que no se reconocen se dejan como están
+    clave = unicodedata.normalize('NFKD', nombre).encode('ascii', 'ignore').decode().strip().lower()
+    if clave in ('total', 'valor'):
+        return 'Total'
+    return next((v for prefijo, v in VARIABLES.items() if clave.startswith(prefijo)), nombre)
+
+def leer_csv(ruta, filas=FILAS_BLOQUE):
+    '''CSV tal como lo descarga INEbase: ';' o tabuladores, números con
+    separador de miles '.' y decimales ','; '..' si falta el dato.'''
+    with open(ruta, 'rb') as f:
+        muestra = f.read(4096)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(muestra)
+        codificacion = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacion = 'cp1252'
+    primera = muestra.split(b'\n', 1)[0]
+    sep = '\t' if primera.count(b'\t') > primera.count(b';') else ';'
+
+    for bloque in pd.read_csv(ruta, sep=sep, encoding=codificacion, dtype=str, keep_default_na=False, chunksize=filas):
+        bloque = bloque.rename(columns=_variable)
+        if 'Total' not in bloque:
+            raise ValueError('falta la columna Total')
+        numeros = bloque.Total.str.strip().str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+        yield bloque.assign(Total=pd.to_numeric(numeros, errors='coerce'))
+
+def _sentencias(texto):
+    # 'CLAVE=valor;' de la cabecera, sin partir por los ';' que van entre comillas
+    dentro, inicio = False, 0
+    for i, c in enumerate(texto):
+        if c == '"':
+            dentro = not dentro
+        elif c == ';' and not dentro:
+            clave, _, valor = texto[inicio:i].partition('=')
+            inicio = i + 1
+            if clave.strip():
+                yield clave.strip(), valor.strip()
+
+def _textos(valor):
+    # '"a","b" "c"' -> ['a', 'bc']: las cadenas seguidas sin coma son una sola partida en líneas
+    res, nueva = [], True
+    for m in re.finditer(r'"([^"]*)"|,', valor):
+        if m.group(0) == ',':
+            nueva = True
+        elif nueva:
+            res.append(m.group(1))
+            nueva = False
+        else:
+            res[-1] += m.group(1)
+    return res
+
+def leer_px(ruta, filas=FILAS_BLOQUE):
+    '''Fichero PC-Axis: una cabecera con las variables (STUB y HEADING) y sus
+    valores, y después DATA= con las cifras en orden, variando más rápido la
+    última variable. Los datos se leen por líneas, sin cargarlos enteros.'''
+    with open(ruta, 'rb') as f:
+        cabecera = b''
+        for linea in f:
+            if linea.lstrip().startswith(b'DATA='):
+                resto = linea.split(b'=', 1)[1]
+                break
+            cabecera += linea
+        else:
+            raise ValueError('no es un fichero PC-Axis (falta DATA=)')
+
+        m = re.search(rb'CODEPAGE="([^"]+)"', cabecera)
+        codificacion = m.group(1).decode() if m else 'cp1252' if b'CHARSET="ANSI"' in cabecera else 'latin-1'
+        claves = dict(_sentencias(cabecera.decode(codificacion)))
+        if any(c.startswith('KEYS') for c in claves):
+            raise ValueError('no se admiten ficheros PC-Axis con KEYS')
+
+        variables = _textos(claves.get('STUB', '')) + _textos(claves.get('HEADING', ''))
+        try:
+            valores = [np.array(_textos(claves[f'VALUES("{v}")']), dtype=object) for v in variables]
+        except KeyError as e:
+            raise ValueError(f'faltan los valores de la variable {e}') from None
+        forma = [len(v) for v in valores]
+        columnas = [_variable(v) for v in variables]
+
+        def bloque(cifras, inicio):
+            i = np.unravel_index(np.arange(inicio, inicio + len(cifras)), forma)
+            df = pd.DataFrame({col: vals[i[j]] for j, (col, vals) in enumerate(zip(columnas, valores))})
+            # Los símbolos ('..', '.', '-') entre comillas son datos que faltan
+            return df.assign(Total=pd.to_numeric(pd.Series(cifras).str.decode('ascii'), errors='coerce'))
+
+        leidas, cifras = 0, []
+        for linea in itertools.chain([resto], f):
+            datos_linea, fin, _ = linea.partition(b';')
+            cifras.extend(datos_linea.split())
+            while len(cifras) >= filas:
+                yield bloque(cifras[:filas], leidas)
+                leidas, cifras = leidas + filas, cifras[filas:]
+            if fin:
+                break
+        if cifras:
+            yield bloque(cifras, leidas)
+
+    if leidas + len(cifras) != np.prod(forma):
+        raise ValueError(f'hay {leidas + len(cifras)} datos y se esperaban {np.prod(forma)}')
+
+def leer(ruta, filas=FILAS_BLOQUE):
+    return (leer_px if ruta.lower().endswith('.px') else leer_csv)(ruta, filas)
+
+#--------------
+# Formato de los CSV de data/ que se pueden ampliar y cómo se pasa a él cada
+# variable del INE. evolucion_poblacion.csv no está: se deriva de los demás.
+
+def _entero(total):
+    if (total != total.round()).any():
+        raise ValueError('Hay cantidades con decimales donde se esperaban enteros')
+    return total.astype('int64').astype(str)
+
+def _decimal_es(total):
+    # 387759.511738 -> '387.759,511738', como en las descargas del INE
+    return total.map(lambda v: f'{v:,.6f}'.rstrip('0').rstrip('.').translate(str.maketrans(',.', '.,')))
+
+class Esquema:
+    '''Un CSV de data/: `provincia` y `codigo` son las columnas con el nombre
+    y el código de la provincia (si las tiene), `categorias` el resto de
+    columnas de texto (Sexo, Edad) y `total` da formato a la cantidad.'''
+
+    def __init__(self, fichero, categorias=(), provincia=None, codigo=None, total=_entero):
+        self.fichero = fichero
+        self.categorias = list(categorias)
+        self.provincia = provincia
+        self.codigo = codigo
+        self.total = total
+
+ESQUEMAS = {
+    'poblacion_provincias': Esquema('poblacion_por_provincias.csv', ['Sexo', 'Edad'], provincia='Provincias', total=_decimal_es),
+    'poblacion_sexo_edad': Esquema('poblacion_por_sexo_edad.csv', ['Edad', 'Sexo']),
+    'nacimientos': Esquema('nacimientos.csv', ['Sexo'], provincia='Provincias', codigo='Codigo'),
+    'defunciones': Esquema('defunciones.csv', ['Sexo'], provincia='Provincias', codigo='Codigo'),
+    'matrimonios': Esquema('matrimonios.csv', provincia='Provincias', codigo='Codigo'),
+}
+
+def _id_provincia(texto):
+    # '02 Albacete' -> 2; si no lleva código, por el nombre ('Total Nacional' -> 0)
+    m = re.match(r'(\d\d)\s', texto)
+    return int(m.group(1)) if m else provincias.buscar(texto)
+
+TOTALES = ['Total', 'Todas', 'Ambos sexos', 'Todas las edades']
+
+def _categoria(texto, permitidos):
+    # 'Ambos sexos' y 'Todas las edades' -> 'Total' / 'Todas'; '5 años' -> '5'
+    texto = texto.strip()
+    if texto in permitidos:
+        return texto
+    m = re.match(r'(\d+)\b', texto)
+    candidatos = [m.group(1)] if m else TOTALES if texto in TOTALES else []
+    return next((c for c in candidatos if c in permitidos), None)
+
+def _periodos(textos):
+    '''(año, plantilla) de cada texto de periodo: '1 de enero de 2022' -> (2022, '1 de enero de {}').'''
+    unicos = pd.Series(textos.unique())
+    years = unicos.str.extract(r'(\d{4})')[0]
+    if years.isna().any():
+        raise ValueError(f'Periodos sin año: {", ".join(unicos[years.isna()][:5])}')
+    plantillas = pd.Series([re.sub(r'\d{4}', '{}', t, count=1).strip() for t in unicos])
+    return textos.map(dict(zip(unicos, years.astype(int)))), set(plantillas)
+
+class _Guardado:
+    '''Lo que hace falta del CSV guardado para validar y dar formato a las
+    filas nuevas: columnas, años que ya tiene, valores de cada categoría,
+    filas de su último año y nombre de cada provincia.'''
+
+    def __init__(self, esquema):
+        self.ruta = datos._csv(esquema.fichero)
+        df = pd.read_csv(self.ruta, sep=';', dtype=str, keep_default_na=False, usecols=lambda c: c != 'Total')
+        self.columnas = pd.read_csv(self.ruta, sep=';', nrows=0).columns.tolist()
+        esperadas = {c for c in [esquema.provincia, esquema.codigo, *esquema.categorias, 'Periodo', 'Total'] if c}
+        assert set(self.columnas) == esperadas, f'{self.ruta}: columnas inesperadas {self.columnas}'
+
+        years, plantillas = _periodos(df.Periodo)
+        self.years = set(years)
+        self.plantilla = plantillas.pop()
+        self.claves = [c for c in self.columnas if c not in ('Periodo', 'Total')]
+        # Cuántas filas hay de cada combinación (puede haber más de una: '85 años' y '85 y más años' son '85')
+        self.ultimo = df.loc[years == max(self.years), self.claves].value_counts().sort_index()
+        self.valores = {c: set(df[c].unique()) for c in esquema.categorias}
+
+        self.etiquetas = {}
+        if esquema.provincia:
+            etiquetas = df[esquema.provincia]
+            ids = df[esquema.codigo].astype(int) if esquema.codigo else _mapear(etiquetas, _id_provincia, esquema.provincia)
+            self.etiquetas = dict(zip(ids, etiquetas))
+
+def _mapear(s, f, variable):
+    # `f` sobre los valores distintos, no fila a fila; ValueError si alguno no vale
+    unicos = s.unique()
+    tabla = {u: f(u) for u in unicos}
+    malos = [u for u in unicos if tabla[u] is None]
+    if malos:
+        raise ValueError(f'Valores desconocidos de {variable}: {", ".join(map(str, malos[:5]))}')
+    return s.map(tabla)
+
+def _normalizar(bloque, esquema, guardado, constantes):
+    '''Pasa un bloque leído al formato del CSV guardado: (filas, año de cada fila).'''
+    if 'Periodo' not in bloque:
+        raise ValueError('Falta la variable Periodo')
+    years, plantillas = _periodos(bloque.Periodo)
+    constantes.setdefault('Periodo', plantillas)
+    # Un año suelto en lo guardado admite cualquier fecha, pero siempre la misma
+    if plantillas != constantes['Periodo'] or len(plantillas) > 1 or \
+            (guardado.plantilla != '{}' and plantillas != {guardado.plantilla}):
+        raise ValueError(f'Periodos con un formato distinto al guardado ({guardado.plantilla!r}): {plantillas}')
+
+    usadas = {'Periodo', 'Total', *esquema.categorias} | ({'Provincias'} if esquema.provincia else set())
+    for c in set(bloque.columns) - usadas:
+        # Variables que no están en lo guardado: solo si tienen un único valor
+        valores = set(bloque[c].unique()) | constantes.get(c, set())
+        if len(valores) > 1:
+            raise ValueError(f'La variable {c} no está en {esquema.fichero} y tiene varios valores: filtra la descarga')
+        constantes[c] = valores
+
+    filas = {}
+    if esquema.provincia:
+        if 'Provincias' not in bloque:
+            raise ValueError('Falta la variable Provincias')
+        conocida = lambda t: i if (i := _id_provincia(t)) in guardado.etiquetas else None
+        ids = _mapear(bloque.Provincias, conocida, 'Provincias')
+        if esquema.codigo:
+            filas[esquema.codigo] = ids.map('{:02d}'.format)
+        filas[esquema.provincia] = ids.map(guardado.etiquetas)
+    for c in esquema.categorias:
+        permitidos = guardado.valores[c]
+        if c in bloque:
+            filas[c] = _mapear(bloque[c], lambda t: _categoria(t, permitidos), c)
+        elif len(permitidos) == 1:
+            filas[c] = next(iter(permitidos))
+        else:
+            raise ValueError(f'Falta la variable {c}')
+    filas['Periodo'] = years.map(guardado.plantilla.format)
+
+    if bloque.Total.isna().any():
+        raise ValueError(f'Faltan datos en {bloque.Total.isna().sum()} filas')
+    if (bloque.Total < 0).any():
+        raise ValueError('Hay cantidades negativas')
+    filas['Total'] = esquema.total(bloque.Total)
+
+    return pd.DataFrame(filas, index=bloque.index)[guardado.columnas], years
+
+def _validar(nuevas, guardado):
+    # Cada año nuevo, con las mismas filas (provincias, sexos, edades) que el último guardado
+    esperado = guardado.ultimo
+    for periodo, df in nuevas.groupby('Periodo'):
+        n = df[guardado.claves].value_counts().sort_index()
+        if n.equals(esperado):
+            continue
+        sobran = n.index.difference(esperado.index).tolist()[:3]
+        faltan = esperado.index.difference(n.index).tolist()[:3]
+        repetidas = n.index[n.gt(esperado.reindex(n.index, fill_value=0))].tolist()[:3]
+        raise ValueError(f'{periodo}: las filas no son las del último año guardado '
+                         f'(sobran {sobran}, faltan {faltan}, repetidas {repetidas})')
+
+#--------------
+
+def con_filas(contenido, filas):
+    '''El CSV `contenido` (bytes) con `filas` justo tras la cabecera. En los
+    CSV del INE cada serie (provincia, sexo...) va del año más reciente al
+    más antiguo; con los años nuevos delante, lo sigue haciendo.'''
+    cabecera, salto, resto = contenido.partition(b'\n')
+    fin_linea = '\r\n' if cabecera.endswith(b'\r') else '\n'
+    nuevas = filas.to_csv(sep=';', header=False, index=False, lineterminator=fin_linea).encode('utf-8')
+    return cabecera + (salto or fin_linea.encode()) + nuevas + resto
+
+def _escribir(ruta, contenido):
+    # Se escribe aparte y se renombra, para que nadie lea un fichero a medias
+    tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(contenido)
+    os.replace(tmp, ruta)
+
+def _construir(nombre, filas, ampliar):
+    '''Las filas nuevas del artefacto de `nombre` construidas a partir de
+    `filas` o, con `ampliar`, el artefacto entero ya ampliado. ValueError si
+    no se pueden construir (p. ej. un año sin población para la tasa).'''
+    with tempfile.TemporaryDirectory() as tmp:
+        parcial = os.path.join(tmp, os.path.basename(datos.FUENTES[nombre][0]))
+        filas.to_csv(parcial, sep=';', index=False)
+        return datos.ampliado(nombre, parcial) if ampliar else datos.CONSTRUCTORES[nombre](parcial)
+
+def _anadir(nombre, filas):
+    '''Añade `filas` (en el formato de su CSV) al CSV del conjunto `nombre` y
+    a su artefacto. Si algo falla, el CSV queda como estaba.'''
+    ruta = datos.FUENTES[nombre][0]
+    # Artefactos que leen este CSV y estaban al día (antes de tocarlo)
+    al_dia = [n for n, fuentes in datos.FUENTES.items() if ruta in fuentes and datos.artefacto_al_dia(n)]
+
+    # Antes de tocar el CSV: si no se puede construir, no se añade nada
+    ampliado = _construir(nombre, filas, nombre in al_dia)
+    with open(ruta, 'rb') as f:
+        original = f.read()
+    try:
+        _escribir(ruta, con_filas(original, filas))
+        for n in al_dia:
+            if n != nombre:
+                # Los movimientos leen la población, pero solo la de sus años, que ya estaba
+                datos.marcar_al_dia(n)
+        if nombre in al_dia:
+            datos.guardar_artefacto(nombre, ampliado)
+    except BaseException:
+        # El artefacto se reemplaza de una vez: si ha fallado, sigue el anterior
+        _escribir(ruta, original)
+        raise
+    finally:
+        cache.limpiar()
+
+def derivar_evolucion():
+    '''Filas de evolucion_poblacion.csv para los años que ya tienen
+    nacimientos, defunciones, matrimonios y población, y aún no están.'''
+    totales = {}
+    for fichero, (columna, _) in datos.MOVIMIENTOS.items():
+        df = datos.get_movimiento(fichero)
+        df = df[(df.id == provincias.TOTAL) & ((df.Sexo == 'Total') if 'Sexo' in df else True)]
+        totales[columna] = df.set_index('Periodo')[columna]
+    df = datos.get_poblacion_sexo_edad()
+    totales['Población'] = df[(df.Edad == 'Todas') & (df.Sexo == 'Total')].set_index('Periodo').Total
+
+    df = pd.DataFrame(totales).dropna().astype('int64')
+    df = df[~df.index.isin(datos.get_evolucion().Periodo)].sort_index(ascending=False)
+    return df.rename_axis('Periodo').reset_index().astype(str)
+
+def ingestar(nombre, ruta, simular=False, filas=FILAS_BLOQUE):
+    '''Añade al conjunto `nombre` los periodos de la exportación del INE
+    `ruta` (.csv o .px) que aún no tiene. Devuelve {'nuevos': [años],
+    'existentes': [años ya guardados que se han ignorado], 'evolucion': [años]}.'''
+    if nombre not in ESQUEMAS:
+        raise ValueError(f'No se puede ampliar {nombre} (opciones: {", ".join(ESQUEMAS)})')
+    esquema = ESQUEMAS[nombre]
+    guardado = _Guardado(esquema)
+
+    partes, existentes, constantes = [], set(), {}
+    for bloque in leer(ruta, filas):
+        df, years = _normalizar(bloque, esquema, guardado, constantes)
+        nuevas = ~years.isin(guardado.years)
+        existentes.update(years[~nuevas])
+        partes.append(df[nuevas])
+    nuevas = pd.concat(partes, ignore_index=True)
+    _validar(nuevas, guardado)
+
+    # Los años más recientes primero, como en cada serie del CSV (ver con_filas())
+    years = nuevas.Periodo.str.extract(r'(\d{4})')[0].astype(int)
+    nuevas = nuevas.iloc[np.argsort(-years.to_numpy(), kind='stable')]
+    res = {'nuevos': sorted(set(years)), 'existentes': sorted(existentes), 'evolucion': []}
+    if nuevas.empty:
+        return res
+    if simular:
+        _construir(nombre, nuevas, False)
+        return res
+
+    _anadir(nombre, nuevas)
+    evolucion = derivar_evolucion()
+    if len(evolucion):
+        _anadir('evolucion', evolucion)
+        res['evolucion'] = sorted(evolucion.Periodo.astype(int))
+    return res
+
+def main():
+    parser = argparse.ArgumentParser(description='Añade a data/ los periodos nuevos de una descarga del INE')
+    parser.add_argument('conjunto', choices=list(ESQUEMAS))
+    parser.add_argument('fichero', help='CSV de INEbase o fichero PC-Axis (.px)')
+    parser.add_argument('--simular', action='store_true', help='valida y muestra qué se añadiría, sin escribir nada')
+    parser.add_argument('--filas', type=int, default=FILAS_BLOQUE, help='filas por bloque de lectura')
+    args = parser.parse_args()
+
+    try:
+        res = ingestar(args.conjunto, args.fichero, args.simular, args.filas)
+    except (ValueError, OSError) as e:
+        parser.exit(1, f'{args.fichero}: {e}\n')
+
+    formato = lambda years: ', '.join(map(str, years)) or 'ninguno'
+    print(f'{args.conjunto}: {"se añadirían" if args.simular else "añadidos"} los años {formato(res["nuevos"])}')
+    if res['existentes']:
+        print(f'Ya estaban (ignorados): {formato(res["existentes"])}')
+    if res['evolucion']:
+        print(f'evolucion_poblacion.csv: añadidos los años {formato(res["evolucion"])}')
+
+if __name__ == '__main__':
+    main()
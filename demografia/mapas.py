@@ -0,0 +1,242 @@
+import base64
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+import streamlit.components.v1 as components
+
+from demografia import geografia, perfil
+from demografia.cache import CacheLRU, recurso
+
+# folium, streamlit_folium y branca (medio segundo de import) se importan al
+# usarse: el mapa animado, el que se ve por defecto, no necesita streamlit_folium
+
+#--------------
+
+# Memoria máxima (en MB) para los mapas ya renderizados, compartida por todas las sesiones
+MAX_MB_MAPAS = int(os.environ.get('DEMOGRAFIA_MAX_MB_MAPAS', 256))
+
+# Zoom para el que se simplifica la geometría de los mapas: abren a zoom 5 y
+# así los bordes siguen nítidos al acercarse uno
+ZOOM_MAPAS = geografia.ZOOM_MIN + 1
+
+def topojson_con_datos(df, campos, nivel=geografia.PROVINCIAS, zoom=ZOOM_MAPAS):
+    '''TopoJSON de `nivel` (la colección es `nivel.objeto`) con las
+    propiedades `Provincia` y, para cada columna de `campos` (columna ->
+    formato), el valor de `df` ya formateado para el tooltip. `df` debe
+    tener una fila por id.
+
+    La geometría es la simplificada y cuantizada para `zoom`, calculada una
+    vez por proceso y compartida: solo se crean las geometrías con sus
+    propiedades.'''
+    return nivel.topologia_con_datos(df, campos, zoom)
+
+#--------------
+# Caché de mapas renderizados. Construir y serializar un folium.Map con el
+# GeoJSON de provincias es lo más caro de cada rerun, así que se guarda el
+# resultado ya serializado por parámetros (dataset, año, sexo, ...) y en cada
+# rerun solo se envía la capa con el marcador de la región destacada.
+#
+# Replica lo que hace st_folium() con su componente; depende de funciones
+# internas de streamlit-folium, por eso la versión está fijada en requirements.
+
+@recurso
+def get_cache_mapas():
+    return CacheLRU(MAX_MB_MAPAS * 2**20, 'mapas')
+
+def renderizar(mapa):
+    import streamlit_folium
+
+    script = streamlit_folium._get_map_string(mapa)
+    html = streamlit_folium._get_siblings(mapa)
+    (s, w), (n, e) = mapa.get_bounds()
+    return {
+        'script': script,
+        'html': html,
+        'id': streamlit_folium.get_full_id(mapa),
+        'key': streamlit_folium.generate_js_hash(script, None),
+        'default': {
+            'last_clicked': None,
+            'last_object_clicked': None,
+            'last_object_clicked_tooltip': None,
+            'all_drawings': None,
+            'last_active_drawing': None,
+            'bounds': {'_southWest': {'lat': s, 'lng': w}, '_northEast': {'lat': n, 'lng': e}},
+            'zoom': mapa.options.get('zoom'),
+            'last_circle_radius': None,
+            'last_circle_polygon': None,
+        },
+    }
+
+def mapa_cacheado(clave, construir):
+    '''Mapa renderizado para `clave`; si no está en la caché se construye con
+    `construir()` (que devuelve un folium.Map) y se guarda.'''
+    cache = get_cache_mapas()
+    render = cache.get(clave)
+    if render is None:
+        with perfil.tramo('folium.construir'):
+            mapa = construir()
+        with perfil.tramo('folium.serializar'):
+            render = renderizar(mapa)
+        cache.put(clave, render, len(render['script']) + len(render['html']))
+    return render
+
+def _capa_marcador(punto):
+    # Un mapa vacío solo para que el grupo tenga padre al generar su script
+    import folium
+    import streamlit_folium
+
+    grupo = folium.FeatureGroup(name='Región destacada')
+    if punto is not None:
+        folium.Marker(punto).add_to(grupo)
+    return streamlit_folium._get_feature_group_string(grupo, folium.Map())
+
+def st_mapa(render, marcador=None, width=700, height=450):
+    '''Como st_folium(), pero para un mapa de `mapa_cacheado()`. `marcador`
+    ([lat, lon] o None) se añade como capa aparte, sin recargar el mapa.'''
+    with perfil.tramo('st_folium'):
+        return _st_mapa(render, marcador, width, height)
+
+def _st_mapa(render, marcador, width, height):
+    import streamlit_folium
+
+    return streamlit_folium._component_func(
+        script=render['script'],
+        html=render['html'],
+        id=render['id'],
+        key=render['key'],
+        height=height,
+        width=width,
+        returned_objects=None,
+        default=render['default'],
+        zoom=None,
+        center=None,
+        feature_group=_capa_marcador(marcador),
+    )
+
+#--------------
+# Selección de la región con un clic en el mapa. st_folium y el mapa animado
+# devuelven el último clic en todos los reruns, no solo cuando es nuevo, así
+# que se recuerda el último atendido. Cuando se dibuja el mapa el widget de la región ya está
+# creado y Streamlit no deja cambiar su valor: el clic se deja pendiente, se
+# repite el rerun y aplicar_clic() se lo da al widget antes de crearlo.
+
+def aplicar_clic(clave, opciones):
+    '''Llamar antes de crear el widget `clave`: si en el rerun anterior se
+    hizo clic en una región de `opciones`, pasa a ser su valor.'''
+    region = st.session_state.pop(f'{clave}:clic', None)
+    if region in opciones:
+        st.session_state[clave] = region
+
+def seleccionar_con_clic(resultado, clave, nivel=geografia.PROVINCIAS):
+    '''Si `resultado` (lo que devuelve st_mapa()) trae un clic nuevo dentro
+    de una región de `nivel` distinta de la seleccionada en el widget
+    `clave`, la selecciona (por su nombre) y repite el rerun.'''
+    punto = (resultado or {}).get('last_clicked')
+    if not punto or punto == st.session_state.get(f'{clave}:ultimo'):
+        return
+    st.session_state[f'{clave}:ultimo'] = punto
+    pos = nivel.en_punto(punto['lat'], punto['lng'])
+    if pos is not None and nivel.nombres()[pos] != st.session_state.get(clave):
+        st.session_state[f'{clave}:clic'] = nivel.nombres()[pos]
+        st.experimental_rerun()
+
+def seleccionar_region(resultado, clave):
+    '''Como seleccionar_con_clic(), con lo que devuelve st_mapa_animado(),
+    que ya trae el nombre de la región.'''
+    if not resultado or resultado == st.session_state.get(f'{clave}:ultimo'):
+        return
+    st.session_state[f'{clave}:ultimo'] = resultado
+    if resultado['region'] != st.session_state.get(clave):
+        st.session_state[f'{clave}:clic'] = resultado['region']
+        st.experimental_rerun()
+
+#--------------
+# Coropletas animadas. La geometría va una sola vez, en TopoJSON, junto a
+# una tabla compacta año × sexo × medida × región (float32 en base64), a un
+# componente con Leaflet (mapa_animado/index.html) que repinta en el
+# navegador al cambiar de año, sexo o medida: sin rerun ni reenvío del mapa.
+# Empieza en el año, sexo, medida y región de los widgets de la página y los
+# sigue cuando cambian. Los datos son los mismos en cada rerun, pero van
+# en el mismo mensaje que el estado: si no cambia, Streamlit manda solo una
+# referencia a su caché de mensajes; si cambia (otro año en la página, por
+# ejemplo), se reenvía todo (~120 KB con las provincias). Las clases de color son cuantiles de todos los
+# años y regiones, para que los colores sean comparables al animar sin que
+# unas pocas regiones muy grandes (Madrid, Barcelona) dejen a las demás en
+# la primera clase.
+
+CLASES = 6
+SEXOS = ['Total', 'Hombres', 'Mujeres']
+
+_componente_animado = components.declare_component(
+    'mapa_animado', path=os.path.join(os.path.dirname(__file__), 'mapa_animado'))
+
+def valores_animados(df, columnas, nivel=geografia.PROVINCIAS):
+    '''(years, sexos, array float32 años × sexos × columnas × regiones del
+    nivel, en el orden de su GeoJSON; NaN donde no hay dato) a partir de
+    `df` con id, Periodo y, si lo tiene, Sexo.'''
+    years = np.sort(df.Periodo.unique())
+    sexos = [x for x in SEXOS if x in set(df.Sexo)] if 'Sexo' in df else ['Total']
+    ids = nivel.ids()
+    pos = geografia.indice_filas(ids, max(int(ids.max()), int(df.id.max())) + 1)[df.id.to_numpy()]
+
+    valores = np.full((len(years), len(sexos), len(columnas), len(ids)), np.nan, dtype='float32')
+    i = np.searchsorted(years, df.Periodo.to_numpy())
+    s = pd.Categorical(df.Sexo, categories=sexos).codes if 'Sexo' in df else np.zeros(len(df), dtype=int)
+    dentro = (pos >= 0) & (s >= 0)
+    for m, col in enumerate(columnas):
+        valores[i[dentro], s[dentro], m, pos[dentro]] = df[col].to_numpy()[dentro]
+    return years, sexos, valores
+
+def _sin_propiedades(topo, objeto):
+    geometrias = topo['objects'][objeto]['geometries']
+    return {**topo, 'objects': {objeto: {'type': 'GeometryCollection',
+                                         'geometries': [{'type': g['type'], 'arcs': g['arcs']} for g in geometrias]}}}
+
+def datos_animados(df, medidas, titulo, colores, nivel=geografia.PROVINCIAS):
+    '''JSON con la coropleta animada de `df` (ver valores_animados()).
+    `medidas` es una lista de (columna, etiqueta, unidad, decimales).
+    `colores` da la escala de ColorBrewer de cada sexo.'''
+    import folium
+    from branca.utilities import color_brewer
+
+    years, sexos, valores = valores_animados(df, [m[0] for m in medidas], nivel)
+    clases = []
+    for s in range(len(sexos)):
+        for m in range(len(medidas)):
+            v = valores[:, s, m]
+            clases.append(np.unique(np.nanquantile(v, np.linspace(0, 1, CLASES + 1))).tolist())
+
+    js, css = dict(folium.folium._default_js), dict(folium.folium._default_css)
+    datos = {
+        'titulo': titulo,
+        'years': years.tolist(),
+        'sexos': sexos,
+        'medidas': [{'etiqueta': e, 'unidad': u, 'decimales': d} for _, e, u, d in medidas],
+        'clases': clases,
+        'colores': [color_brewer(colores[s], CLASES) for s in sexos],
+        'nombres': nivel.nombres().tolist(),
+        'geo': _sin_propiedades(nivel.topologia(ZOOM_MAPAS), nivel.nombre),
+        'valores': base64.b64encode(valores.tobytes()).decode(),
+        'leaflet': {'js': js['leaflet'], 'css': css['leaflet_css']},
+    }
+    return json.dumps(datos, separators=(',', ':'), ensure_ascii=False)
+
+def st_mapa_animado(clave, construir, year=None, sexo='Total', medida=-1, region=None, alto=450):
+    '''Muestra la coropleta animada de `clave`; sus datos se construyen con
+    `construir()` (datos_animados()) una vez por proceso (caché de mapas).
+    Enseña el año `year` (el último si es None), `sexo` y la medida en la
+    posición `medida`, con `region` (su nombre) destacada. Devuelve el
+    último clic, {'region': nombre, 'clic': hora}, o None (ver
+    seleccionar_region()).'''
+    cache = get_cache_mapas()
+    datos = cache.get(('animado', *clave))
+    if datos is None:
+        with perfil.tramo('mapa_animado.construir'):
+            datos = construir()
+        cache.put(('animado', *clave), datos, len(datos))
+    estado = {'year': None if year is None else int(year), 'sexo': sexo, 'medida': medida, 'region': region}
+    with perfil.tramo('mapa_animado.enviar'):
+        return _componente_animado(datos=datos, estado=estado, alto=alto, key=f'animado:{"/".join(clave)}')
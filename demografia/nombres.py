@@ -0,0 +1,310 @@
+import atexit
+import bisect
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from demografia import datos, geografia, perfil, provincias
+from demografia.cache import CacheLRU, recurso
+
+#--------------
+
+EXCLUIDAS = [35, 38, 51, 52, 66] # canarias, ceuta, melilla y extranjero
+
+# Procesos para dibujar los mapas de cada década en paralelo (0 = en el propio proceso)
+WORKERS_NOMBRES = int(os.environ.get('DEMOGRAFIA_WORKERS_NOMBRES', min(4, os.cpu_count() or 1)))
+MAX_MB_IMAGENES = int(os.environ.get('DEMOGRAFIA_MAX_MB_IMAGENES', 128))
+
+ABREVIATURAS = [(r'MARIA\s', 'Mᵃ '), (r'JOSE\s', 'J. '), (r'FRANCISCO\s', 'FCO. ')]
+
+#--------------
+# Geometría base de los mapas de nombres. Se proyecta y se calculan los puntos
+# de las etiquetas una sola vez por proceso (también en cada worker del pool).
+
+_base = None
+_base_lock = threading.Lock()
+
+def get_base():
+    '''(GeoDataFrame en EPSG:3395 ordenado por id, array de puntos de etiqueta).'''
+    global _base
+    with _base_lock:
+        if _base is None:
+            import geopandas as gpd
+
+            geo = gpd.GeoDataFrame.from_features(provincias.get_geojson()['features'], crs='EPSG:4326')
+            geo['id'] = geo.codigo.astype('int8')
+            geo = geo[~geo.id.isin(EXCLUIDAS)].sort_values('id').reset_index(drop=True)
+            geo = geo[['id', 'geometry']].to_crs(crs=3395)
+
+            # Los mismos puntos de etiqueta que los marcadores de los mapas
+            nivel = geografia.PROVINCIAS
+            lat, lon = nivel.puntos().T
+            puntos = gpd.GeoSeries(gpd.points_from_xy(lon, lat), index=nivel.ids(), crs='EPSG:4326').to_crs(crs=3395)
+            puntos = puntos.loc[geo.id.to_numpy()]
+            _base = geo, np.column_stack([puntos.x, puntos.y])
+        return _base
+
+def ids_base():
+    return get_base()[0].id.to_numpy()
+
+def abreviar(nombres):
+    for patron, abreviatura in ABREVIATURAS:
+        nombres = nombres.str.replace(patron, abreviatura, regex=True)
+    return nombres
+
+def dibujar(etiquetas, destacadas, formato='png'):
+    '''Mapa de provincias con una etiqueta por provincia (en el orden de
+    `ids_base()`), resaltando las `destacadas`. Devuelve la imagen en bytes.
+    Usa Figure directamente (no pyplot) para poder ejecutarse en cualquier hilo o proceso.'''
+    from matplotlib.figure import Figure
+
+    geo, puntos = get_base()
+    fig = Figure(figsize=(12,12))
+    ax = fig.subplots(1,1)
+    geo.boundary.plot(color='Black', linewidth=.4, ax=ax)
+    ax.set_axis_off()
+    for texto, xy in zip(etiquetas, puntos):
+        ax.annotate(text=texto, xy=xy, ha='center', fontsize=10,
+            bbox=dict(boxstyle="round", fc="w", ec='k', pad=0.4, alpha=0.65))
+    geo.assign(color=np.where(destacadas, 0, 1)).plot(ax=ax, cmap='tab20c', column='color')
+
+    # Mismos parámetros que usa st.pyplot()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=formato, bbox_inches='tight', dpi=200)
+    return buf.getvalue()
+
+def _dibujar_medido(etiquetas, destacadas, formato):
+    # En el pool: devuelve también lo que ha tardado, para el perfil
+    t = time.perf_counter()
+    img = dibujar(etiquetas, destacadas, formato)
+    return img, time.perf_counter() - t
+
+#--------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    '''Pool de procesos compartido por todo el servidor, o None si está desactivado.'''
+    global _pool
+    with _pool_lock:
+        if _pool is None and WORKERS_NOMBRES > 0:
+            # spawn: hacer fork de un servidor con hilos (tornado, sesiones) no es seguro
+            _pool = ProcessPoolExecutor(max_workers=WORKERS_NOMBRES,
+                mp_context=multiprocessing.get_context('spawn'), initializer=get_base)
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+def _reset_pool(roto):
+    '''Cierra el pool `roto` (un worker ha muerto) para que get_pool() cree
+    otro: sin shutdown quedarían su hilo de gestión y los workers vivos.'''
+    global _pool
+    with _pool_lock:
+        # Otra sesión puede haberlo cambiado ya por uno nuevo
+        if _pool is roto:
+            _pool = None
+    atexit.unregister(roto.shutdown)
+    roto.shutdown(wait=False, cancel_futures=True)
+
+@recurso
+def get_cache_imagenes():
+    return CacheLRU(MAX_MB_IMAGENES * 2**20, 'imagenes')
+
+def imagenes(name, peticiones, formato='png'):
+    '''Dibuja (o saca de la caché) el mapa de cada década de `peticiones`,
+    un dict {(decada, sexo): (etiquetas, destacadas)}. Devuelve un generador
+    de ((decada, sexo), bytes) en el orden en que van estando listos.'''
+    cache = get_cache_imagenes()
+    pendientes = {}
+    for clave, args in peticiones.items():
+        img = cache.get((name, *clave, formato))
+        if img is None:
+            pendientes[clave] = args
+        else:
+            yield clave, img
+
+    pool = get_pool() if len(pendientes) > 1 else None
+    if pool is not None:
+        try:
+            futuros = {pool.submit(_dibujar_medido, list(e), list(d), formato): clave for clave, (e, d) in pendientes.items()}
+            for futuro in as_completed(futuros):
+                clave = futuros[futuro]
+                img, segundos = futuro.result()
+                perfil.registrar('matplotlib.dibujar', segundos)
+                cache.put((name, *clave, formato), img, len(img))
+                del pendientes[clave]
+                yield clave, img
+        except BrokenProcessPool:
+            _reset_pool(pool)
+
+    # Sin pool (o si se ha roto), se dibuja lo que falte aquí mismo
+    for clave, (etiquetas, destacadas) in pendientes.items():
+        with perfil.tramo('matplotlib.dibujar'):
+            img = dibujar(etiquetas, destacadas, formato)
+        cache.put((name, *clave, formato), img, len(img))
+        yield clave, img
+
+#--------------
+# Búsqueda de nombres sin distinguir mayúsculas ni tildes: 'Lucía', 'LUCIA' y
+# 'lucia' son el mismo nombre, 'Luc' se completa y 'Lucai' se corrige.
+
+def _trigramas(clave):
+    clave = f'  {clave} '
+    return {clave[i:i+3] for i in range(len(clave) - 2)}
+
+def _distancia(a, b, maximo):
+    '''Distancia de Levenshtein entre `a` y `b`, o `maximo + 1` si la supera.'''
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    previa = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        fila = [i]
+        for j, cb in enumerate(b, 1):
+            fila.append(min(previa[j] + 1, fila[j-1] + 1, previa[j-1] + (ca != cb)))
+        if min(fila) > maximo:
+            return maximo + 1
+        previa = fila
+    return min(previa[-1], maximo + 1)
+
+class IndiceNombres:
+    '''Índice de los nombres de `nombres` (iterable) con su cobertura: en
+    cuántas provincias y décadas han sido el más común. Los resultados de
+    todas las búsquedas se ordenan por esa cobertura.'''
+
+    def __init__(self, nombres, cobertura):
+        orden = sorted(range(len(nombres)), key=lambda i: (-cobertura[i], nombres[i]))
+        self.nombres = [nombres[i] for i in orden]
+        self.cobertura = [int(cobertura[i]) for i in orden]
+        self.claves = [provincias.clave(n) for n in self.nombres]
+        self._por_clave = {c: i for i, c in enumerate(self.claves)}
+
+        # Claves ordenadas para buscar prefijos con bisect
+        self._ordenadas = sorted((c, i) for i, c in enumerate(self.claves))
+
+        self._trigramas = {}
+        for i, c in enumerate(self.claves):
+            for t in _trigramas(c):
+                self._trigramas.setdefault(t, []).append(i)
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def exacto(self, texto):
+        '''El nombre tal y como aparece en los datos, o None.'''
+        i = self._por_clave.get(provincias.clave(texto))
+        return None if i is None else self.nombres[i]
+
+    def _prefijo(self, clave):
+        desde = bisect.bisect_left(self._ordenadas, (clave,))
+        hasta = bisect.bisect_left(self._ordenadas, (clave + '\uffff',))
+        return sorted(i for _, i in self._ordenadas[desde:hasta])
+
+    def prefijo(self, texto, n=10):
+        '''Nombres que empiezan por `texto`.'''
+        return [self.nombres[i] for i in self._prefijo(provincias.clave(texto))[:n]]
+
+    def _parecidos(self, clave, maximo):
+        candidatos = set()
+        for t in _trigramas(clave):
+            candidatos.update(self._trigramas.get(t, ()))
+        distancias = ((_distancia(clave, self.claves[i], maximo), i) for i in candidatos)
+        return sorted((d, i) for d, i in distancias if d <= maximo)
+
+    def parecidos(self, texto, n=10, maximo=None):
+        '''Nombres a `maximo` errores de `texto` como mucho (por defecto 1
+        para textos cortos y 2 para el resto), los más cercanos primero.'''
+        clave = provincias.clave(texto)
+        if maximo is None:
+            maximo = 1 if len(clave) <= 4 else 2
+        return [self.nombres[i] for _, i in self._parecidos(clave, maximo)[:n]]
+
+    def buscar(self, texto, n=10):
+        '''Sugerencias para `texto`: el nombre exacto, luego los que empiezan
+        por él y luego los parecidos, sin repetir.'''
+        clave = provincias.clave(texto)
+        if not clave:
+            return []
+        res = []
+        if clave in self._por_clave:
+            res.append(self._por_clave[clave])
+        res += self._prefijo(clave)
+        if len(res) < n:
+            res += [i for _, i in self._parecidos(clave, 1 if len(clave) <= 4 else 2)]
+        return [self.nombres[i] for i in dict.fromkeys(res)][:n]
+
+@recurso
+def get_indice():
+    df = datos.get_nombres()
+    df = df[~df.id.isin(EXCLUIDAS)]
+    cobertura = (df.nameH.astype(str).value_counts()
+        .add(df.nameM.astype(str).value_counts(), fill_value=0))
+    return IndiceNombres(cobertura.index.tolist(), cobertura.to_numpy())
+
+#--------------
+# Popularidad de los nombres. Cada CSV trae, por provincia y sexo, el nombre
+# más común con su frecuencia y su tasa por mil nacidos; con ambas se estima
+# el total de nacidos de la provincia y la cuota de cada nombre a nivel nacional.
+# Solo se conoce la frecuencia de un nombre donde fue el más común, así que las
+# cuotas nacionales son cotas inferiores.
+
+@recurso
+def get_popularidad():
+    '''Una fila por (Decada, id, Sexo) con el nombre más común (Nombre), su
+    frecuencia, su tasa por mil nacidos y el total estimado de nacidos.'''
+    df = datos.get_nombres()
+    partes = []
+    for sexo in 'HM':
+        parte = df[['Decada', 'id', f'name{sexo}', f'freq{sexo}', f'por1000{sexo}']]
+        partes.append(parte.set_axis(['Decada', 'id', 'Nombre', 'Frecuencia', 'PorMil'], axis=1).assign(Sexo=sexo))
+    df = pd.concat(partes, ignore_index=True)
+
+    # Las categorías de nameH y nameM son distintas; se unifican en una sola
+    df['Nombre'] = df.Nombre.astype(str).astype('category')
+    df['Sexo'] = df.Sexo.astype('category')
+    df['Nacidos'] = (df.Frecuencia * 1000 / df.PorMil).round().astype('int32')
+    return df[['Decada', 'id', 'Sexo', 'Nombre', 'Frecuencia', 'PorMil', 'Nacidos']]
+
+@recurso
+def get_nacidos():
+    '''Total estimado de nacidos por (Decada, Sexo) en toda España.'''
+    return get_popularidad().groupby(['Decada', 'Sexo'], observed=True).Nacidos.sum()
+
+@perfil.cache_data
+def top_nacional(n=10, sexo=None):
+    '''Los `n` nombres con más nacidos por década (y sexo), con su cuota
+    nacional por mil y su puesto.'''
+    df = get_popularidad()
+    if sexo is not None:
+        df = df[df.Sexo == sexo]
+    res = df.groupby(['Decada', 'Sexo', 'Nombre'], observed=True).agg(
+        Frecuencia=('Frecuencia', 'sum'), Provincias=('id', 'size')).reset_index()
+    res['PorMil'] = res.Frecuencia / get_nacidos().reindex(pd.MultiIndex.from_frame(res[['Decada', 'Sexo']])).to_numpy() * 1000
+    res['Puesto'] = res.groupby(['Decada', 'Sexo'], observed=True).Frecuencia.rank(method='first', ascending=False).astype('int16')
+    res = res[res.Puesto <= n].sort_values(['Decada', 'Sexo', 'Puesto'])
+    return res.reset_index(drop=True)
+
+def trayectoria(nombre):
+    '''Cuota nacional por mil nacidos de `nombre` en cada década, para los
+    sexos en los que aparece (0 donde no fue el más común en ninguna provincia).'''
+    df = get_popularidad()
+    df = df[df.Nombre == nombre]
+    nacidos = get_nacidos()
+    nacidos = nacidos[nacidos.index.get_level_values('Sexo').isin(df.Sexo.unique())]
+
+    res = df.groupby(['Decada', 'Sexo'], observed=True).agg(
+        Frecuencia=('Frecuencia', 'sum'), Provincias=('id', 'size')).reindex(nacidos.index, fill_value=0)
+    res['PorMil'] = res.Frecuencia / nacidos * 1000
+    return res.reset_index()
+
+def concentracion(nombre, n=10):
+    '''Las `n` provincias y décadas donde `nombre` tuvo más peso (por mil nacidos).'''
+    df = get_popularidad()
+    res = df[df.Nombre == nombre].nlargest(n, 'PorMil')
+    return provincias.con_nombres(res.reset_index(drop=True))
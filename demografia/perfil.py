@@ -0,0 +1,254 @@
+'''Perfil de cada rerun de las páginas, opcional: tiempo por tramo (carga de
+datos, cachés, folium, st_folium, plotly, matplotlib...), aciertos y fallos
+de las cachés y bytes enviados al navegador.
+
+    DEMOGRAFIA_PERFIL=1 streamlit run 1_👋_Bienvenida.py
+    DEMOGRAFIA_PERFIL=1 DEMOGRAFIA_PERFIL_SALIDA=/tmp/perfil streamlit run 1_👋_Bienvenida.py
+
+Con el perfil activo cada página muestra un panel en la barra lateral. Con
+DEMOGRAFIA_PERFIL_SALIDA, además, se añade una línea por rerun a
+`<salida>.jsonl` y se reescribe `<salida>.prom` con los totales del proceso
+en el formato de texto de Prometheus. Desactivado no cuesta nada: las
+cachés se decoran sin instrumentar y los tramos son un contexto vacío.
+'''
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+#--------------
+
+ACTIVO = os.environ.get('DEMOGRAFIA_PERFIL', '') not in ('', '0')
+SALIDA = os.environ.get('DEMOGRAFIA_PERFIL_SALIDA')
+
+_local = threading.local()  # Streamlit ejecuta cada sesión en su hilo
+_nada = contextlib.nullcontext()
+
+class Rerun:
+    '''Lo medido en un rerun de una página.'''
+
+    def __init__(self, pagina):
+        self.pagina = pagina
+        self.inicio = time.perf_counter()
+        self.tramos = {}  # nombre -> [veces, segundos, profundidad]
+        self.caches = {}  # nombre -> [aciertos, fallos]
+        self.bytes = 0
+        self.profundidad = 0
+
+    def registrar(self, nombre, segundos):
+        t = self.tramos.setdefault(nombre, [0, 0.0, self.profundidad])
+        t[0] += 1
+        t[1] += segundos
+
+    def tabla_tramos(self):
+        return pd.DataFrame([{'Tramo': '  ' * p + nombre, 'Veces': n, 'ms': s * 1000}
+                             for nombre, (n, s, p) in self.tramos.items()])
+
+    def tabla_caches(self):
+        return pd.DataFrame([{'Caché': nombre, 'Aciertos': a, 'Fallos': f}
+                             for nombre, (a, f) in sorted(self.caches.items())])
+
+def _actual():
+    return getattr(_local, 'rerun', None)
+
+#--------------
+# Lo que llaman los módulos instrumentados. Fuera de un rerun con el perfil
+# activo (desactivado, en el servidor HTTP, en el benchmark...) no hacen nada.
+
+@contextlib.contextmanager
+def _tramo(rerun, nombre):
+    # Se apunta al entrar, para que en el panel cada tramo vaya antes que los que anida
+    rerun.tramos.setdefault(nombre, [0, 0.0, rerun.profundidad])
+    rerun.profundidad += 1
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun.profundidad -= 1
+        rerun.registrar(nombre, time.perf_counter() - t)
+
+def tramo(nombre):
+    '''Contexto que mide lo que tarda su bloque como el tramo `nombre`.'''
+    rerun = _actual()
+    return _nada if rerun is None else _tramo(rerun, nombre)
+
+def registrar(nombre, segundos):
+    '''Añade un tramo medido en otro sitio (p. ej. en un proceso del pool).'''
+    rerun = _actual()
+    if rerun is not None:
+        rerun.registrar(nombre, segundos)
+
+def acierto(cache, acertado):
+    '''Cuenta una consulta a la caché `cache`, acertada o no.'''
+    rerun = _actual()
+    if rerun is not None:
+        rerun.caches.setdefault(cache, [0, 0])[0 if acertado else 1] += 1
+
+def enviados(n):
+    '''Cuenta `n` bytes enviados al navegador fuera de los mensajes de
+    Streamlit (las imágenes van por HTTP aparte).'''
+    rerun = _actual()
+    if rerun is not None:
+        rerun.bytes += n
+
+def medir_cache(cachear, f):
+    '''`cachear(f)` (st.cache_data, st.cache_resource, recurso...). Con el
+    perfil activo, cada llamada cuenta como acierto o fallo según se haya
+    ejecutado o no `f`, y su tiempo (en un acierto, sobre todo el hash de
+    los argumentos y la copia del resultado) como el tramo `cache:<f>`.'''
+    if not ACTIVO:
+        return cachear(f)
+    nombre = f.__qualname__
+
+    @functools.wraps(f)
+    def cuerpo(*args, **kwargs):
+        _local.fallo = True
+        return f(*args, **kwargs)
+
+    cacheada = cachear(cuerpo)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        anterior, _local.fallo = getattr(_local, 'fallo', False), False
+        try:
+            with tramo(f'cache:{nombre}'):
+                return cacheada(*args, **kwargs)
+        finally:
+            acierto(nombre, not _local.fallo)
+            _local.fallo = anterior
+
+    wrapper.clear = cacheada.clear
+    return wrapper
+
+def cache_data(func=None, **kwargs):
+    '''Como st.cache_data (con o sin argumentos), contando aciertos y fallos.'''
+    if func is None:
+        return lambda f: medir_cache(st.cache_data(**kwargs), f)
+    return medir_cache(st.cache_data, func)
+
+#--------------
+# Inicio y fin de cada rerun, desde las páginas
+
+def _contar_mensajes(ctx):
+    # Todo lo que la página manda al navegador pasa por ctx.enqueue(), que
+    # llama a ctx._enqueue: se envuelve una vez por sesión
+    enqueue = ctx._enqueue
+    if getattr(enqueue, 'perfil', False):
+        return
+
+    def contar(msg):
+        rerun = _actual()
+        if rerun is not None:
+            rerun.bytes += msg.ByteSize()
+        enqueue(msg)
+
+    contar.perfil = True
+    ctx._enqueue = contar
+
+def inicio(pagina):
+    '''Empieza a medir el rerun de `pagina`.'''
+    if not ACTIVO:
+        return
+    _local.rerun = Rerun(pagina)
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        _contar_mensajes(ctx)
+
+def fin():
+    '''Termina el rerun: muestra el panel en la barra lateral y, con
+    DEMOGRAFIA_PERFIL_SALIDA, lo guarda.'''
+    rerun = _actual()
+    if rerun is None:
+        return
+    _local.rerun = None
+    total = time.perf_counter() - rerun.inicio
+
+    with st.sidebar.expander('⏱️ Perfil del rerun'):
+        c1, c2 = st.columns(2)
+        c1.metric('Total', f'{total * 1000:,.0f} ms')
+        c2.metric('Enviado', f'{rerun.bytes / 1024:,.0f} KiB')
+        if rerun.tramos:
+            st.dataframe(rerun.tabla_tramos().style.format({'ms': '{:,.1f}'}), hide_index=True, use_container_width=True)
+        if rerun.caches:
+            st.dataframe(rerun.tabla_caches(), hide_index=True, use_container_width=True)
+
+    if SALIDA:
+        ctx = get_script_run_ctx()
+        _guardar(rerun, total, ctx.session_id if ctx is not None else None)
+
+#--------------
+# Salida: una línea JSON por rerun y los totales del proceso para Prometheus
+
+_totales = {
+    'reruns': Counter(),          # pagina
+    'segundos': Counter(),        # pagina
+    'bytes': Counter(),           # pagina
+    'tramo_veces': Counter(),     # (pagina, tramo)
+    'tramo_segundos': Counter(),  # (pagina, tramo)
+    'aciertos': Counter(),        # cache
+    'fallos': Counter(),          # cache
+}
+_lock = threading.Lock()
+
+# nombre, tipo, ayuda, clave de _totales, etiquetas
+METRICAS = [
+    ('demografia_reruns_total', 'counter', 'Reruns de cada página', 'reruns', ['pagina']),
+    ('demografia_rerun_segundos_total', 'counter', 'Tiempo total de los reruns', 'segundos', ['pagina']),
+    ('demografia_enviado_bytes_total', 'counter', 'Bytes enviados al navegador', 'bytes', ['pagina']),
+    ('demografia_tramo_total', 'counter', 'Veces que se ha ejecutado cada tramo', 'tramo_veces', ['pagina', 'tramo']),
+    ('demografia_tramo_segundos_total', 'counter', 'Tiempo en cada tramo', 'tramo_segundos', ['pagina', 'tramo']),
+    ('demografia_cache_aciertos_total', 'counter', 'Aciertos de cada caché', 'aciertos', ['cache']),
+    ('demografia_cache_fallos_total', 'counter', 'Fallos de cada caché', 'fallos', ['cache']),
+]
+
+def _etiquetas(nombres, valores):
+    valores = valores if isinstance(valores, tuple) else (valores,)
+    escapar = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{n}="{escapar(v)}"' for n, v in zip(nombres, valores))
+
+def prometheus():
+    '''Los totales del proceso en el formato de texto de Prometheus.'''
+    lineas = []
+    with _lock:
+        for nombre, tipo, ayuda, clave, etiquetas in METRICAS:
+            lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}']
+            lineas += [f'{nombre}{{{_etiquetas(etiquetas, k)}}} {v:g}' for k, v in sorted(_totales[clave].items())]
+    return '\n'.join(lineas) + '\n'
+
+def _guardar(rerun, total, sesion):
+    registro = {
+        'fecha': datetime.now().isoformat(timespec='milliseconds'),
+        'sesion': sesion,
+        'pagina': rerun.pagina,
+        'total_ms': round(total * 1000, 3),
+        'bytes': rerun.bytes,
+        'tramos': [{'tramo': nombre, 'veces': n, 'ms': round(s * 1000, 3)} for nombre, (n, s, _) in rerun.tramos.items()],
+        'caches': {nombre: {'aciertos': a, 'fallos': f} for nombre, (a, f) in rerun.caches.items()},
+    }
+    with _lock:
+        _totales['reruns'][rerun.pagina] += 1
+        _totales['segundos'][rerun.pagina] += total
+        _totales['bytes'][rerun.pagina] += rerun.bytes
+        for nombre, (n, s, _) in rerun.tramos.items():
+            _totales['tramo_veces'][rerun.pagina, nombre] += n
+            _totales['tramo_segundos'][rerun.pagina, nombre] += s
+        for nombre, (a, f) in rerun.caches.items():
+            _totales['aciertos'][nombre] += a
+            _totales['fallos'][nombre] += f
+        with open(f'{SALIDA}.jsonl', 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+
+    # Se escribe aparte y se renombra, para que quien lo lea no vea uno a medias
+    texto = prometheus()
+    tmp = f'{SALIDA}.prom.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(tmp, f'{SALIDA}.prom')
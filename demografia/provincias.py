@@ -0,0 +1,72 @@
+import json
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from demografia import perfil
+from demografia.cache import recurso
+
+#--------------
+
+PROVINCIAS_CSV = './data/provincias.csv'
+PROV_GEO = './data/provincias.geojson'
+
+TOTAL = 0  # id de 'Total Nacional'
+
+def clave(nombre):
+    # Minúsculas y sin tildes: 'ARABA/ÁLAVA', 'Araba/Álava' y 'araba/alava' dan la misma clave
+    nombre = unicodedata.normalize('NFKD', nombre.strip().casefold())
+    return ''.join(c for c in nombre if not unicodedata.combining(c))
+
+@recurso
+def get_geojson():
+    # Se parsea una vez por proceso y se comparte entre sesiones: no modificar
+    with open(PROV_GEO, encoding='utf-8') as f:
+        return json.load(f)
+
+@perfil.cache_data
+def get_provincias():
+    '''Tabla de dimensión de provincias indexada por `id` (el código INE como
+    entero, 0 para el Total Nacional). Todos los datasets se cruzan con ella
+    por esa clave en lugar de por el nombre de la provincia.'''
+    dim = pd.read_csv(PROVINCIAS_CSV, sep=';', index_col='id', keep_default_na=False,
+        dtype={'Codigo': str, 'CodigoCCAA': str})
+    dim.index = dim.index.astype('int8')
+    dim['Variantes'] = dim.Variantes.str.split('|')
+
+    # Identificador de la geometría, sacado del GeoJSON (los puntos de
+    # etiqueta se calculan sobre la geometría: geografia.Nivel.puntos)
+    props = pd.DataFrame([f['properties'] for f in get_geojson()['features']])
+    props.index = props.codigo.astype('int8')
+    dim['geo_id'] = props.codigo
+    return dim
+
+@perfil.cache_data
+def get_ids_por_variante():
+    dim = get_provincias()
+    return {clave(v): i for i, variantes in dim.Variantes.items() for v in variantes}
+
+def buscar(nombre):
+    '''id de la provincia a partir de cualquiera de sus variantes de nombre, o None.'''
+    return get_ids_por_variante().get(clave(nombre))
+
+def id_provincia(provincia):
+    '''id de una provincia dada por su id o por cualquier variante de su nombre; ValueError si no existe.'''
+    if isinstance(provincia, (int, np.integer)):
+        if provincia not in get_provincias().index:
+            raise ValueError(f'Provincia desconocida: {provincia}')
+        return int(provincia)
+    i = buscar(provincia)
+    if i is None:
+        raise ValueError(f'Provincia desconocida: {provincia}')
+    return i
+
+def con_nombres(df, col='id'):
+    '''Añade a `df` las columnas Codigo y Provincias (categóricas) a partir de
+    la clave entera `col`, sin comparar cadenas.'''
+    dim = get_provincias()
+    pos = dim.index.get_indexer(df[col])
+    df['Codigo'] = pd.Categorical.from_codes(pos, dim.Codigo)
+    df['Provincias'] = pd.Categorical.from_codes(pos, dim.Provincia)
+    return df
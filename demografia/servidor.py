@@ -0,0 +1,151 @@
+'''Servidor HTTP/JSON local con las consultas de demografia.consultas.
+
+    python -m demografia.servidor --port 8765
+
+    GET /indicator?name=nacimientos&year=2020&sex=Total&per_mil=1&province=Lugo
+    GET /diff?name=matrimonios&year1=2000&year2=2020
+    GET /compare?name=matrimonios&from1=1980&to1=1985&from2=2015&to2=2020&measure=porcentaje
+    GET /pyramid?year=2020&width=5
+    GET /growth?from=2000&to=2021
+    GET /derived?name=edad_mediana&sex=Mujeres
+    GET /export?name=nacimientos&format=parquet&from=2000&to=2020&sex=Total&province=Lugo
+
+Se ejecuta desde la raíz del repositorio (las rutas a ./data son relativas).
+'''
+import argparse
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from demografia import consultas, datos, indicadores, tablas
+from demografia.cache import CacheLRU
+
+#--------------
+
+MAX_MB_RESPUESTAS = int(os.environ.get('DEMOGRAFIA_MAX_MB_RESPUESTAS', 64))
+
+def _bool(v):
+    return v.lower() in ('1', 'true', 'si', 'sí', 'yes')
+
+def _provincia(v):
+    return int(v) if v.isdigit() else v
+
+def _comparar(nombre, desde1, hasta1, desde2, hasta2, **kwargs):
+    return consultas.comparar(nombre, (desde1, hasta1), (desde2, hasta2), **kwargs)
+
+# ruta -> (función, {parámetro de la URL: (argumento, tipo)}, orient de to_json)
+RUTAS = {
+    '/indicator': (consultas.indicador, {'name': ('nombre', str), 'year': ('year', int), 'sex': ('sex', str),
+                                         'per_mil': ('per_mil', _bool), 'province': ('provincia', _provincia)}, 'records'),
+    '/diff': (consultas.diferencia, {'name': ('nombre', str), 'year1': ('year1', int), 'year2': ('year2', int),
+                                     'sex': ('sex', str)}, 'records'),
+    '/compare': (_comparar,
+                 {'name': ('nombre', str), 'from1': ('desde1', int), 'to1': ('hasta1', int), 'from2': ('desde2', int),
+                  'to2': ('hasta2', int), 'sex': ('sex', str), 'measure': ('medida', str)}, 'records'),
+    '/pyramid': (consultas.piramide, {'year': ('year', int), 'width': ('ancho', int)}, 'index'),
+    '/growth': (consultas.crecimiento, {'from': ('desde', int), 'to': ('hasta', int)}, 'records'),
+    '/derived': (indicadores.valores, {'name': ('nombre', str), 'year': ('year', int), 'sex': ('sex', str),
+                                       'province': ('provincia', _provincia)}, 'records'),
+}
+
+_respuestas = CacheLRU(MAX_MB_RESPUESTAS * 2**20)
+
+def responder(ruta, query):
+    '''(código HTTP, cuerpo JSON en bytes) para `ruta` con los parámetros de
+    `query` (dict de listas, como lo da parse_qs). Las respuestas correctas se
+    guardan en una caché LRU, con la versión de los conjuntos de datos en la
+    clave: tras una ingesta (demografia.ingesta, desde otro proceso) se
+    vuelven a calcular, y las viejas salen de la caché por antigüedad.'''
+    if ruta not in RUTAS:
+        return 404, json.dumps({'error': f'Ruta desconocida: {ruta}', 'rutas': list(RUTAS)}).encode()
+    funcion, parametros, orient = RUTAS[ruta]
+
+    versiones = tuple(datos.version(n) for n in datos.FUENTES)
+    clave = (ruta, tuple(sorted((k, tuple(v)) for k, v in query.items())), versiones)
+    cuerpo = _respuestas.get(clave)
+    if cuerpo is not None:
+        return 200, cuerpo
+
+    try:
+        desconocidos = set(query) - set(parametros)
+        if desconocidos:
+            raise ValueError(f'Parámetros desconocidos: {", ".join(sorted(desconocidos))}')
+        kwargs = {arg: tipo(query[p][-1]) for p, (arg, tipo) in parametros.items() if p in query}
+        df = funcion(**kwargs)
+    except (ValueError, TypeError) as e:
+        return 400, json.dumps({'error': str(e)}, ensure_ascii=False).encode()
+
+    cuerpo = df.to_json(orient=orient, force_ascii=False).encode()
+    _respuestas.put(clave, cuerpo, len(cuerpo))
+    return 200, cuerpo
+
+# Exportación de un conjunto de datos entero o filtrado, en CSV o Parquet
+EXPORTAR = {'name': ('nombre', str), 'from': ('desde', int), 'to': ('hasta', int), 'sex': ('sex', str),
+            'province': ('provincia', _provincia)}
+
+def exportar(query):
+    '''(nombre del fichero, tipo MIME, generador de trozos en bytes) con el
+    conjunto y los filtros de `query`. Los errores en los parámetros saltan
+    aquí, antes de empezar a generar.'''
+    desconocidos = set(query) - set(EXPORTAR) - {'format'}
+    if desconocidos:
+        raise ValueError(f'Parámetros desconocidos: {", ".join(sorted(desconocidos))}')
+    if 'name' not in query:
+        raise ValueError('Falta el parámetro name')
+    formato = query.get('format', ['csv'])[-1]
+    if formato not in tablas.FORMATOS:
+        raise ValueError(f'Formato desconocido: {formato} (opciones: {", ".join(tablas.FORMATOS)})')
+    kwargs = {arg: tipo(query[p][-1]) for p, (arg, tipo) in EXPORTAR.items() if p in query}
+    df = tablas.filtrar(**kwargs)
+    return f'{kwargs["nombre"]}.{formato}', tablas.FORMATOS[formato], tablas.trozos(df, formato)
+
+class Manejador(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/export':
+            return self.exportar(parse_qs(url.query))
+        self.enviar(*responder(url.path, parse_qs(url.query)))
+
+    def enviar(self, codigo, cuerpo):
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def exportar(self, query):
+        try:
+            fichero, mime, trozos = exportar(query)
+        except (ValueError, TypeError) as e:
+            return self.enviar(400, json.dumps({'error': str(e)}, ensure_ascii=False).encode())
+        # Sin Content-Length: en HTTP/1.0 el cuerpo acaba al cerrar la conexión
+        self.send_response(200)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Disposition', f'attachment; filename="{fichero}"')
+        self.end_headers()
+        for trozo in trozos:
+            self.wfile.write(trozo)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas de datos demográficos por HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer((args.host, args.port), Manejador)
+    servidor.verbose = args.verbose
+    print(f'Sirviendo en http://{args.host}:{args.port} ({", ".join([*RUTAS, "/export"])})')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
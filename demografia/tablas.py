@@ -0,0 +1,135 @@
+'''Tablas de "Mostrar datos" y descarga de los conjuntos de datos.
+
+Las tablas son st.dataframe: una rejilla virtualizada (solo se pintan las
+filas visibles) y ordenable, con los números formateados en el navegador.
+La exportación a CSV o Parquet se genera por trozos de FILAS_TROZO filas,
+sin construir el fichero entero: demografia.servidor (ruta /export) lo
+envía según se genera. st.download_button necesita el contenido completo,
+así que en las páginas se juntan los trozos, una vez por selección.
+'''
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+from demografia import datos, perfil, provincias
+
+#--------------
+
+FILAS_TROZO = 20_000
+
+# formato -> tipo MIME
+FORMATOS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+TASAS = [tasa for _, tasa in datos.MOVIMIENTOS.values()]
+
+def filtrar(nombre, desde=None, hasta=None, sex=None, provincia=None):
+    '''Filas del conjunto `nombre` (uno de datos.CARGADORES) de los años
+    `desde` a `hasta`, del sexo `sex` y de la provincia `provincia` (id o
+    nombre). Lo que no se indica no se filtra.'''
+    if nombre not in datos.CARGADORES:
+        raise ValueError(f'Conjunto de datos desconocido: {nombre} (opciones: {", ".join(datos.CARGADORES)})')
+    df = datos.CARGADORES[nombre]()
+
+    filtros = [('Periodo', desde is not None or hasta is not None, 'año'), ('Sexo', sex is not None, 'sexo'),
+               ('id', provincia is not None, 'provincia')]
+    for columna, usado, que in filtros:
+        if usado and columna not in df:
+            raise ValueError(f'{nombre} no está desglosado por {que}')
+
+    mascara = np.ones(len(df), dtype=bool)
+    if desde is not None:
+        mascara &= df.Periodo.to_numpy() >= desde
+    if hasta is not None:
+        mascara &= df.Periodo.to_numpy() <= hasta
+    if sex is not None:
+        mascara &= (df.Sexo == sex).to_numpy()
+    if provincia is not None:
+        mascara &= df.id.to_numpy() == provincias.id_provincia(provincia)
+    return df[mascara]
+
+class _Salida(io.RawIOBase):
+    # Fichero de solo escritura que guarda lo escrito hasta que se recoge;
+    # tell() cuenta todo lo escrito, que es lo que usa el escritor de Parquet
+    # para las posiciones del pie del fichero
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.partes.append(bytes(b))
+        self.posicion += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.posicion
+
+    def recoger(self):
+        b = b''.join(self.partes)
+        self.partes = []
+        return b
+
+def trozos(df, formato='csv', filas=FILAS_TROZO):
+    '''Genera `df` en `formato` ('csv' o 'parquet') como una sucesión de
+    bytes, `filas` filas cada vez (en Parquet, un row group por trozo).'''
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato desconocido: {formato} (opciones: {", ".join(FORMATOS)})')
+
+    if formato == 'csv':
+        for i in range(0, max(len(df), 1), filas):
+            yield df.iloc[i:i+filas].to_csv(index=False, header=(i == 0)).encode()
+        return
+
+    salida = _Salida()
+    esquema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(salida, esquema) as escritor:
+        for i in range(0, len(df), filas):
+            escritor.write_table(pa.Table.from_pandas(df.iloc[i:i+filas], schema=esquema, preserve_index=False))
+            yield salida.recoger()
+    yield salida.recoger()
+
+#--------------
+# En las páginas
+
+def formatos(df):
+    '''column_config de st.dataframe para `df`: tasas por mil con dos
+    decimales y el resto de números como enteros.'''
+    return {c: st.column_config.NumberColumn(format='%.2f ‰' if c in TASAS else '%d')
+            for c, t in df.dtypes.items() if c != 'id' and pd.api.types.is_numeric_dtype(t)}
+
+def st_tabla(df, **kwargs):
+    st.dataframe(df, column_config=formatos(df), use_container_width=True, **kwargs)
+
+# `conjunto` hace que la clave cambie con los datos; `filtros` son los de filtrar(), como tupla
+@perfil.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def get_descarga(conjunto, formato, filtros):
+    return b''.join(trozos(filtrar(conjunto.nombre, **dict(filtros)), formato))
+
+def st_descarga(nombre, **seleccion):
+    '''Botón para descargar en CSV o Parquet las filas de `nombre` de la
+    selección de la página (filtros de `filtrar()`) o la serie completa.
+    Sin `seleccion`, solo la serie completa.
+
+    st.download_button manda el fichero entero al navegador en cada rerun
+    en que se muestra: solo se genera y se manda después de pulsar
+    "Preparar", y hasta que se descarga o cambia lo elegido.'''
+    c1, c2, c3 = st.columns([2, 2, 1])
+    completa = not seleccion or c1.radio('Descargar', ['Selección', 'Serie completa'], horizontal=True) == 'Serie completa'
+    formato = c2.radio('Formato', list(FORMATOS), horizontal=True, format_func=str.upper)
+    filtros = () if completa else tuple(sorted(seleccion.items()))
+
+    clave, pedida = f'descarga:{nombre}', (datos.conjunto(nombre), formato, filtros)
+    if st.session_state.get(clave) != pedida:
+        if not c3.button('⚙️ Preparar', key=f'{clave}:preparar'):
+            return
+        st.session_state[clave] = pedida
+    if c3.download_button('⬇️ Descargar', get_descarga(*pedida), key=f'{clave}:descargar',
+            file_name=f'{nombre}.{formato}' if completa else f'{nombre}_seleccion.{formato}', mime=FORMATOS[formato]):
+        del st.session_state[clave]
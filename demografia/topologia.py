@@ -0,0 +1,137 @@
+'''Geometría compacta para los mapas: topología con los bordes compartidos,
+simplificada y cuantizada como TopoJSON.
+
+Cada borde entre dos regiones es un solo arco, que se simplifica una vez:
+las dos regiones siguen encajando (simplificar cada polígono por su lado
+deja huecos y solapes) y el borde no se envía dos veces. Las coordenadas
+se cuantizan a una rejilla de medio píxel del zoom para el que se simplifica
+y se guardan como diferencias entre puntos consecutivos, enteros pequeños
+que ocupan pocas cifras en el JSON.
+'''
+import gzip
+import json
+
+import numpy as np
+import shapely
+from shapely.geometry import MultiLineString
+
+#--------------
+
+def _poligonos(geometria):
+    # Lista de polígonos, cada uno una lista de anillos (tuplas, sin repetir el primer punto al final)
+    coords = geometria['coordinates']
+    poligonos = coords if geometria['type'] == 'MultiPolygon' else [coords]
+    return [[[tuple(p) for p in anillo[:-1]] for anillo in poligono] for poligono in poligonos]
+
+def _uniones(anillos):
+    # Puntos donde se juntan más de dos bordes: ahí empieza o acaba cada arco
+    vecinos = {}
+    for anillo in anillos:
+        n = len(anillo)
+        for i, p in enumerate(anillo):
+            vecinos.setdefault(p, set()).update((anillo[i-1], anillo[(i+1) % n]))
+    return {p for p, v in vecinos.items() if len(v) > 2}
+
+def _cortar(anillo, uniones):
+    '''Trozos del anillo entre uniones, cada uno con sus dos extremos.'''
+    cortes = [i for i, p in enumerate(anillo) if p in uniones]
+    if not cortes:
+        # Anillo sin uniones (isla, o enclave que comparte todo su borde):
+        # empieza en su punto menor, para que el del vecino sea el mismo arco
+        i = anillo.index(min(anillo))
+        anillo = anillo[i:] + anillo[:i]
+        return [anillo + [anillo[0]]]
+    anillo = anillo[cortes[0]:] + anillo[:cortes[0]]
+    cortes = [c - cortes[0] for c in cortes] + [len(anillo)]
+    anillo = anillo + [anillo[0]]
+    return [anillo[a:b+1] for a, b in zip(cortes, cortes[1:])]
+
+def topologia(features, tol, objeto, propiedades=()):
+    '''TopoJSON de `features` (GeoJSON de Polygon/MultiPolygon) simplificado
+    con una tolerancia de `tol` grados (un píxel) y cuantizado a `tol` / 2.
+    La colección se llama `objeto` y cada geometría conserva las
+    `propiedades` indicadas de su feature. Un borde se reconoce como
+    compartido si tiene los mismos vértices en las dos regiones, como en
+    un GeoJSON sin huecos ni solapes.'''
+    geometrias = [_poligonos(f['geometry']) for f in features]
+    uniones = _uniones([a for poligonos in geometrias for poligono in poligonos for a in poligono])
+
+    # Arcos sin repetir: un borde compartido se recorre en sentidos opuestos
+    # desde cada lado, y se referencia como ~i (el arco i al revés)
+    arcos, indice = [], {}
+    def referencia(arco):
+        clave = tuple(arco)
+        if clave in indice:
+            return indice[clave]
+        inverso = clave[::-1]
+        if inverso in indice:
+            return ~indice[inverso]
+        indice[clave] = len(arcos)
+        arcos.append(arco)
+        return indice[clave]
+
+    refs = [[[[referencia(a) for a in _cortar(anillo, uniones)] for anillo in poligono] for poligono in poligonos]
+            for poligonos in geometrias]
+
+    # Simplificación de todos los arcos a la vez, sin que se crucen entre sí;
+    # los extremos de cada arco (las uniones) no se mueven
+    lineas = shapely.simplify(MultiLineString(arcos), tol, preserve_topology=True)
+    simplificados = [np.asarray(linea.coords) for linea in lineas.geoms]
+
+    # Cuantización: rejilla de medio píxel, con origen en la esquina de la caja
+    todos = np.concatenate(simplificados)
+    origen = todos.min(axis=0)
+    escala = tol / 2
+    cuantizados = []
+    for s in simplificados:
+        q = np.round((s - origen) / escala).astype('int64')
+        q = q[np.r_[True, (np.diff(q, axis=0) != 0).any(axis=1)]]  # puntos repetidos tras redondear
+        if len(q) < 2:
+            q = np.vstack([q, q])
+        cuantizados.append(np.vstack([q[:1], np.diff(q, axis=0)]).tolist())
+
+    salida = []
+    for f, r in zip(features, refs):
+        g = {'type': 'MultiPolygon', 'arcs': r} if f['geometry']['type'] == 'MultiPolygon' else {'type': 'Polygon', 'arcs': r[0]}
+        g['properties'] = {p: f['properties'][p] for p in propiedades}
+        salida.append(g)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [escala, escala], 'translate': origen.tolist()},
+        'objects': {objeto: {'type': 'GeometryCollection', 'geometries': salida}},
+        'arcs': cuantizados,
+    }
+
+#--------------
+
+def _anillo(arcos, refs):
+    puntos = []
+    for k, r in enumerate(refs):
+        a = arcos[r] if r >= 0 else arcos[~r][::-1]
+        puntos.extend(a if k == 0 else a[1:])
+    return puntos
+
+def _poligono(arcos, anillos):
+    # Los anillos que se quedan en menos de 4 puntos al cuantizar (islotes de
+    # menos de un píxel) se descartan; sin el exterior, el polígono entero
+    anillos = [_anillo(arcos, a) for a in anillos]
+    return [a for a in anillos if len(a) >= 4] if len(anillos[0]) >= 4 else []
+
+def geometrias(topo, objeto):
+    '''Geometrías GeoJSON (dicts) de la colección `objeto` de `topo`, en orden.'''
+    escala, origen = np.array(topo['transform']['scale']), np.array(topo['transform']['translate'])
+    arcos = [(np.cumsum(np.asarray(a), axis=0) * escala + origen).tolist() for a in topo['arcs']]
+    res = []
+    for g in topo['objects'][objeto]['geometries']:
+        if g['type'] == 'Polygon':
+            res.append({'type': 'Polygon', 'coordinates': _poligono(arcos, g['arcs'])})
+        else:
+            poligonos = [_poligono(arcos, p) for p in g['arcs']]
+            res.append({'type': 'MultiPolygon', 'coordinates': [p for p in poligonos if p]})
+    return res
+
+def tamano(obj):
+    '''(bytes, bytes con gzip) de `obj` serializado como JSON compacto.'''
+    texto = json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+    return len(texto), len(gzip.compress(texto))
@@ -1,125 +1,134 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from demografia import consultas, datos, perfil, tablas
+from demografia.cache import recurso
+
 mill = lambda n : f'{n/1e6:.1f}M'
 kilo = lambda n : f'{n/1e3:.0f}K'
 
-@st.cache_data
+@recurso
 def get_data_evolucion():
-    df = pd.read_csv('./data/evolucion_poblacion.csv', sep=';')
-    min_year, max_year = min(df.Periodo), max(df.Periodo)
+    df = datos.get_evolucion()
+    min_year, max_year = int(df.Periodo.min()), int(df.Periodo.max())
     return df, min_year, max_year
 
-@st.cache_data(ttl=3600)
-def metricas(year, df):
-    df = df.set_index('Periodo')
+# Las funciones cacheadas devuelven datos o figuras; las que pintan (llaman
+# a st.*) no se cachean, para que Streamlit no tenga que reproducir elementos
 
-    vars = ['Población', 'Nacimientos', 'Defunciones', 'Matrimonios']
-    cols = st.columns(len(vars))
+@perfil.cache_data(ttl=3600)
+def get_metricas(year, evolucion):
+    '''(etiqueta, valor, delta) de cada métrica, ya formateados.'''
+    df = evolucion.df.set_index('Periodo')
 
-    for i, var in enumerate(vars):
+    metricas = []
+    for var in ['Población', 'Nacimientos', 'Defunciones', 'Matrimonios']:
         this = df.at[year,var]
-        last = df.at[year-1,var] if year > 1975 else None
-    
-        cols[i].metric(f'{var} {year}', 
-            mill(this) if var=='Población' else kilo(this), kilo(this-last) if year > 1975 else '')
+        last = df.at[year-1,var] if year-1 in df.index else None
+        metricas.append((f'{var} {year}', mill(this) if var=='Población' else kilo(this), kilo(this-last) if last is not None else ''))
+    return metricas
+
+def metricas(year, evolucion):
+    datos_metricas = get_metricas(year, evolucion)
+    cols = st.columns(len(datos_metricas))
+    for col, (etiqueta, valor, delta) in zip(cols, datos_metricas):
+        col.metric(etiqueta, valor, delta)
 
-@st.cache_data
+@perfil.cache_data
 def get_color(var):
     if var == 'Población': return 'lightskyblue'
     elif var == 'Nacimientos': return 'rebeccapurple'
     elif var == 'Defunciones': return 'darkorange'
     else: return 'forestgreen'
 
-def grafica_general(data):
-    variables = st.multiselect('Variables a estudiar:',
-    ['Población', 'Nacimientos', 'Defunciones', 'Matrimonios'],
-    ['Población', 'Nacimientos', 'Defunciones', 'Matrimonios'])
-
-    data = data[data.Periodo>=v1]
-    data = data[data.Periodo<=v2]
+# Las gráficas llevan la serie completa (son unas 50 filas) y todo lo que se
+# cambia en ellas se hace en el navegador, sin rerun: el intervalo de años con
+# el range slider, las variables pulsando en la leyenda y el año destacado con
+# un slider de plotly que mueve la marca (relayout). El año destacado de la
+# barra lateral solo decide las métricas y dónde empieza ese slider.
+
+def slider_year(years, year, cambios):
+    '''Slider de plotly con un paso por año de `years`; `cambios(y)` son las
+    propiedades del layout que cambian al destacar el año `y`.'''
+    years = sorted(years)
+    return dict(
+        active=years.index(year), currentvalue=dict(prefix='Año destacado: '), pad=dict(t=70),
+        steps=[dict(method='relayout', label=str(y), args=[cambios(y)]) for y in years],
+    )
+
+@perfil.cache_data(ttl=3600)
+def figura_general(year):
+    data, min_year, max_year = get_data_evolucion()
 
     # Figura con dos ejes Y
     fig = make_subplots(specs=[[{'secondary_y': True}]])
-    for var in variables:
+    for var in ['Población', 'Nacimientos', 'Defunciones', 'Matrimonios']:
         fig.add_trace(go.Scatter(x=data.Periodo, y=data[var], name=var, mode='lines+markers', marker_color=get_color(var)), secondary_y=(var=='Población'))
 
-    fig.update_xaxes(title_text='Periodo')
+    fig.update_xaxes(title_text='Periodo', rangeslider=dict(visible=True, thickness=0.08), range=[min_year, max_year])
     fig.update_yaxes(title_text='Personas', secondary_y=False)
-    if 'Población' in variables:
-        fig.update_yaxes(title_text='Personas (Población)', secondary_y=True)
+    fig.update_yaxes(title_text='Personas (Población)', secondary_y=True)
 
-    len_vars = len(variables)
     fig.update_layout(legend=dict(
         orientation='h',
-        entrywidth=250 if len_vars==2 else 150 if len_vars==3 else 100,
+        entrywidth=100,
         yanchor='top', y=1.2, xanchor='left', x=0,
         bordercolor='gray', borderwidth=0.5
     ))
     fig.update_traces(hovertemplate='%{y:,}')
-    fig.update_layout(hovermode='x unified') 
-
-    if v1 < 2009 and v2 > 2007:
-        fig.add_vrect(x0=max(2007,v1),x1=min(2009,v2), line_width=0, fillcolor='gray', opacity=0.1, annotation_text='Gran Recesión', annotation_position='bottom', annotation_font=dict(color='black'))
-    
-    if v1 < 2022 and v2 > 2019:
-        fig.add_vrect(x0=max(2019,v1),x1=min(2022,v2), line_width=0, fillcolor='gray', opacity=0.1, annotation_text='COVID-19', annotation_position='bottom', annotation_font=dict(color='black'))
-    
-    if v1 <= year <= v2:
-        fig.add_vline(x=year, line_width=2, line_dash='dash', line_color='gray')
-
-    st.plotly_chart(fig, use_container_width=True)
-
-    exp = st.expander('Mostrar datos')
-    with exp:
-        df = data.set_index('Periodo')
-        df.Nacimientos = df.Nacimientos.apply(lambda x:f'{int(x):,}')
-        df.Defunciones = df.Defunciones.apply(lambda x:f'{int(x):,}')
-        df.Población = df.Población.apply(lambda x:f'{int(x):,}')
-        df.Matrimonios = df.Matrimonios.apply(lambda x:f'{int(x):,}')
-        exp.table(df)#.Nacimientos if tipo == 'Nacimientos' else df.Defunciones if tipo == 'Defunciones' else df)
-
-def crecimiento(df):
-    df = df[df.Periodo>=v1]
-    df = df[df.Periodo<=v2]
-
-    col1, col2 = st.columns([4, 1])
-
-    with col1:
-        df['Δ Personas'] = df.Nacimientos - df.Defunciones
-        fig = px.line(df, x='Periodo', y='Δ Personas', markers=True)
-        fig['data'][0]['line']['color']='black'
-        fig.add_hline(y=0, line_width=1, line_dash='dash', line_color='black')
-        if v2 > 2015: fig.add_vrect(x0=max(2015,v1),x1=v2, line_width=0, fillcolor='red', annotation_text='Crecimiento negativo', annotation_position='top', annotation_font=dict(color='black'), opacity=0.1)
-        if v1 < 2015: fig.add_vrect(x0=v1,x1=min(v2,2015), line_width=0, fillcolor='forestgreen', annotation_text='Crecimiento positivo', annotation_position='bottom', annotation_font=dict(color='black'), opacity=0.1)
-        
-        df, _, _ = get_data_evolucion()
-        df = df.set_index('Periodo')
-        df['Δ Personas'] = df.Nacimientos - df.Defunciones
-        y = df.at[year, 'Δ Personas']
-
-        if v1 <= year <= v2:
-            fig.add_shape(type='circle', x0=year-0.5, y0=y-2e4, x1=year+0.5, y1=y+2e4, line_color='#318CE7')
-
-        fig.update_traces(mode="markers+lines", hovertemplate='Δ Personas = %{y:,}')
-        fig.update_layout(hovermode='x unified')
-
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Añadimos espacios para conseguir un alineamiento vertical
-    col2.write(' ')
-    col2.write(' ')
-    col2.write(' ')
-    col2.write(' ')
-    col2.write(' ')
-    col2.write(' ')
-    col2.write(' ')
-    col2.metric('Año destacado', year)
-    col2.write(' ')
-    col2.metric('Total crecimiento', f'{round(y):,}')
+    fig.update_layout(hovermode='x unified', height=600)
+
+    fig.add_vrect(x0=2007,x1=2009, line_width=0, fillcolor='gray', opacity=0.1, annotation_text='Gran Recesión', annotation_position='bottom', annotation_font=dict(color='black'))
+    fig.add_vrect(x0=2019,x1=2022, line_width=0, fillcolor='gray', opacity=0.1, annotation_text='COVID-19', annotation_position='bottom', annotation_font=dict(color='black'))
+
+    fig.add_vline(x=year, line_width=2, line_dash='dash', line_color='gray')
+    marca = len(fig.layout.shapes) - 1
+    fig.update_layout(sliders=[slider_year(data.Periodo.tolist(), year,
+        lambda y: {f'shapes[{marca}].x0': y, f'shapes[{marca}].x1': y})])
+
+    return fig
+
+def grafica_general(data):
+    st.caption('Pulsa en la leyenda para mostrar u ocultar variables y usa la barra bajo la gráfica para elegir los años.')
+    st.plotly_chart(figura_general(year), use_container_width=True)
+
+    # Rejilla virtualizada; los números se formatean en el navegador
+    with st.expander('Mostrar datos'):
+        tablas.st_tabla(data.set_index('Periodo'))
+        tablas.st_descarga('evolucion')
+
+@perfil.cache_data(ttl=3600)
+def figura_crecimiento(year):
+    df = consultas.crecimiento()
+    v1, v2 = int(df.Periodo.min()), int(df.Periodo.max())
+
+    fig = px.line(df, x='Periodo', y='Δ Personas', markers=True)
+    fig['data'][0]['line']['color']='black'
+    fig.add_hline(y=0, line_width=1, line_dash='dash', line_color='black')
+    fig.add_vrect(x0=2015,x1=v2, line_width=0, fillcolor='red', annotation_text='Crecimiento negativo', annotation_position='top', annotation_font=dict(color='black'), opacity=0.1)
+    fig.add_vrect(x0=v1,x1=2015, line_width=0, fillcolor='forestgreen', annotation_text='Crecimiento positivo', annotation_position='bottom', annotation_font=dict(color='black'), opacity=0.1)
+
+    # El círculo y el rótulo del año destacado, que mueve el slider
+    crec = dict(zip(df.Periodo.tolist(), df['Δ Personas'].tolist()))
+    fig.add_shape(type='circle', x0=year-0.5, y0=crec[year]-2e4, x1=year+0.5, y1=crec[year]+2e4, line_color='#318CE7')
+    fig.add_annotation(x=year, y=crec[year], text=f'{crec[year]:,} personas', ax=0, ay=-40, bgcolor='white', bordercolor='#318CE7')
+    marca, rotulo = len(fig.layout.shapes) - 1, len(fig.layout.annotations) - 1
+    fig.update_layout(sliders=[slider_year(list(crec), year, lambda y: {
+        f'shapes[{marca}].x0': y-0.5, f'shapes[{marca}].x1': y+0.5,
+        f'shapes[{marca}].y0': crec[y]-2e4, f'shapes[{marca}].y1': crec[y]+2e4,
+        f'annotations[{rotulo}].x': y, f'annotations[{rotulo}].y': crec[y],
+        f'annotations[{rotulo}].text': f'{crec[y]:,} personas'})])
+
+    fig.update_xaxes(rangeslider=dict(visible=True, thickness=0.08), range=[v1, v2])
+    fig.update_traces(mode="markers+lines", hovertemplate='Δ Personas = %{y:,}')
+    fig.update_layout(hovermode='x unified', height=550)
+
+    return fig
+
+def crecimiento():
+    st.plotly_chart(figura_crecimiento(year), use_container_width=True)
 
 ###############################
 
@@ -127,6 +136,8 @@ TITLE = 'Visión general de España'
 SHORT_TITLE = 'Visión general'
 
 st.set_page_config(page_title=SHORT_TITLE, page_icon='📈')
+perfil.inicio(SHORT_TITLE)
+datos.al_dia()
 st.markdown('# ' + TITLE)
 st.sidebar.header(SHORT_TITLE)
 st.caption('Fuente: INE')
@@ -134,8 +145,9 @@ st.write(
     '''En esta sección, encontrarás gráficos de líneas que muestran 
     la evolución de la población, nacimientos, defunciones y 
     matrimonios desde 1975 hasta la fecha más actualizada.
-    En la barra lateral puedes seleccionar diferentes parámetros 
-    para filtrar los datos.'''
+    El rango de años, las variables (pulsando en la leyenda) y el año 
+    destacado se cambian sobre los propios gráficos; en la barra lateral 
+    eliges el año de las métricas.'''
 )
 st.write('')
 
@@ -144,13 +156,11 @@ st.write('')
 df, min_year, max_year = get_data_evolucion()
 year = st.sidebar.selectbox('Año destacado', list(range(max_year,min_year-1,-1)), 0)
 
-metricas(year, df)
+metricas(year, datos.conjunto('evolucion'))
 
 st.write('')
 st.sidebar.write(' ')
 
-v1, v2 = st.sidebar.slider('Intervalo de años a estudiar', min_value=min_year, max_value=max_year, value=(min_year, max_year), step=1, key='anyosEnCrecimiento')
-
 tab1, tab2 = st.tabs(['Visión general', 'Crecimiento natural de la población'])
 
 with tab1:
@@ -169,5 +179,8 @@ with tab2:
     Este indicador refleja la diferencia entre el número de nacimientos 
     y el número de defunciones en un determinado período de tiempo. 
     ''')
-    crecimiento(df)
+    crecimiento()
+
+#--------------
 
+perfil.fin()
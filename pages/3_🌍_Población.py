@@ -2,41 +2,37 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 import warnings; warnings.filterwarnings("ignore")
 
+from demografia import consultas, datos, indicadores, perfil, provincias
+from demografia.cache import recurso
+
 mill = lambda n : f'{n/1e6:.1f}M'
 kilo = lambda n : f'{n/1e3:.0f}K'
 
-@st.cache_data
+@recurso
 def get_data_poblacion_provs():
-    df = pd.read_csv('./data/poblacion_por_provincias.csv', sep=';', 
-        converters = {'Total':lambda x:float(x.replace('.','').replace(',','.')), 
-                      'Provincias':lambda x:x.replace('Araba/Álava','Álava/Araba'),
-                      'Periodo':lambda x : int(x.strip().split()[-1])})
-    df.drop(['Sexo','Edad'], axis=1, inplace=True)
-    return df, min(df.Periodo), max(df.Periodo)
-
-@st.cache_data
-def get_data_poblacion_tipo(min_year, max_year):
-    df = pd.read_csv('./data/poblacion_por_sexo_edad.csv', sep=';')
-    df1 = df[df.Periodo>=min_year+1]
-    df1 = df1[df1.Periodo<=max_year]
-    df2 = df[df.Periodo>=min_year]
-    df2 = df2[df2.Periodo<=max_year]
-    return df1, df2
+    df = datos.get_poblacion_provincias()
+    return int(df.Periodo.min()), int(df.Periodo.max())
+
                      
-@st.cache_data(ttl=3600)
-def donut(df, top, year):
-    df = df[df.Periodo==year]
-    df.drop(['Periodo'], axis=1, inplace=True)
-    df = df.set_index('Provincias')
-    df.drop('Total Nacional', inplace=True)
-    df = df.reset_index()
-    df = df.sort_values(by=['Total'], ascending=False).head(top)
-    df.Total = df.Total.apply(lambda x: round(x))
-    df.Provincias = df.Provincias.apply(lambda x:' '.join(x.split()[1:]))
-    df.Provincias = df.Provincias.apply(lambda x: ' '.join(reversed(x.strip().split(', '))) if ', ' in x else x)
-    df.Provincias = df.Provincias.apply(lambda x: list(reversed(x.strip().split('/')))[1] if '/' in x else x)
+# Cada gráfica va en tres capas: los datos (get_*), la figura (figura_*), ambas
+# cacheadas, y la función que la pinta, sin caché, que solo llama a st.*
+
+@perfil.cache_data(ttl=3600)
+def get_top_provincias(provs, top, year):
+    df = provs.df
+    df = df[(df.Periodo==year) & (df.id!=provincias.TOTAL)]
+    df = df.sort_values(by=['Poblacion'], ascending=False).head(top)
+    return pd.DataFrame({
+        'Provincias': df.id.map(provincias.get_provincias().NombreCorto).to_numpy(),
+        'Total': df.Poblacion.round().astype(int).to_numpy(),
+    })
+
+@perfil.cache_data(ttl=3600)
+def figura_donut(provs, top, year):
+    df = get_top_provincias(provs, top, year)
 
     colors = ['gold', 'mediumturquoise', 'darkorange', 'lightgreen']
 
@@ -46,52 +42,79 @@ def donut(df, top, year):
     fig.update_traces(textposition='inside', textinfo='percent+label', textfont_size=24,
                   marker=dict(colors=colors, line=dict(color='white', width=2)))
     fig.update_layout(width=700, height=700)
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-    df = df.reset_index()
+def donut(provs, top, year):
+    st.plotly_chart(figura_donut(provs, top, year), use_container_width=True)
+
+    df = get_top_provincias(provs, top, year)
     for c in range(top//3+1):
         cols = st.columns(3)
         r = top%3 if c == top//3 else 3
         for i in range(r):
             cols[i].metric(df.at[3*c+i,'Provincias'], f'{round(df.at[3*c+i,"Total"]):,}')
 
-@st.cache_data(ttl=3600)
-def piramide(df, year):
-    dfh = df[(df.Sexo=='Hombres') & (df.Edad!='Todas') & (df.Periodo==year)]
-    dfm = df[(df.Sexo=='Mujeres') & (df.Edad!='Todas') & (df.Periodo==year)]
+def ticks_piramide(maximo):
+    # Marcas simétricas cada 1, 2 o 5 × 10^k, con como mucho dos a cada lado
+    paso = min(p * 10**k for k in range(9) for p in (1, 2, 5) if maximo / (p * 10**k) <= 2.5)
+    n = int(maximo // paso)
+    vals = [paso * k for k in range(-n, n+1)]
+    texto = mill if paso >= 1e6 else kilo
+    return vals, [texto(abs(v)).replace('.0M', 'M') if v else '0' for v in vals]
 
-    dfh['Edad'] = pd.to_numeric(dfh['Edad'])
-    dfm['Edad'] = pd.to_numeric(dfm['Edad'])
-
-    dfh['Grupo'] = pd.cut(dfh['Edad'], bins=list(range(0,111,10)), right=False,
-        labels=[f'{x-10}-{x-1}'if x<=100 else '>= 100' for x in range(10,111,10)])
-    dfm['Grupo'] = pd.cut(dfm['Edad'], bins=list(range(0,111,10)), right=False,
-        labels=[f'{x-10}-{x-1}'if x<=100 else '>= 100' for x in range(10,111,10)])
-    
-    dh = dfh.groupby('Grupo').sum()['Total']*-1
-    dm = dfm.groupby('Grupo').sum()['Total']
+@perfil.cache_data(ttl=3600)
+def figura_piramide(year, ancho=10, animar=False):
+    # Cada año es una rebanada del cubo año × sexo × grupo, calculado una vez
+    years, grupos, cubo = consultas.get_cubo_piramide(ancho)
+    i = int(np.searchsorted(years, year))
 
     fig = go.Figure()
-    fig.add_trace(go.Bar(y=dh.index.tolist(),x=dh.tolist(),name='Hombres',orientation='h'))
-    fig.add_trace(go.Bar(y=dm.index.tolist(),x=dm.tolist(),name='Mujeres',orientation='h'))
+    fig.add_trace(go.Bar(y=grupos,x=-cubo[i,0],name='Hombres',orientation='h'))
+    fig.add_trace(go.Bar(y=grupos,x=cubo[i,1],name='Mujeres',orientation='h'))
 
     fig['data'][0]['marker']['color']='royalblue'
     fig['data'][1]['marker']['color']='sandybrown'
-    
+
+    maximo = cubo.max() if animar else cubo[i].max()
+    tickvals, ticktext = ticks_piramide(maximo)
     fig.update_layout(title='', barmode='relative', bargap=0, bargroupgap=0,
-        xaxis=dict(tickvals=[-4e6, -2e6, 0, 2e6, 4e6],
-                     ticktext=['4M', '2M', '0', '2M', '4M'],
+        xaxis=dict(tickvals=tickvals,
+                     ticktext=ticktext,
                      title='Población'),
         yaxis=dict(title='Grupo de edad'),
         legend_title='Sexo',
     )
     fig.update_traces(hovertemplate='%{x:,}')
 
-    st.plotly_chart(fig, use_container_width=True)
-
-@st.cache_data(ttl=3600)
-def barras_genero(df, year):
-    df = df[(df.Edad=='Todas') & (df.Sexo!='Total')]
+    if animar:
+        # Todos los años van en la figura: cambiar de año no provoca un rerun
+        fig.frames = [go.Frame(data=[go.Bar(x=-cubo[j,0]), go.Bar(x=cubo[j,1])], name=str(y)) for j, y in enumerate(years)]
+        transicion = {'frame': {'duration': 300, 'redraw': False}, 'transition': {'duration': 200}, 'mode': 'immediate'}
+        fig.update_layout(
+            xaxis_range=[-maximo*1.05, maximo*1.05],
+            updatemenus=[dict(type='buttons', showactive=False, x=0, y=-0.15, xanchor='left', yanchor='top', buttons=[
+                dict(label='▶', method='animate', args=[None, {**transicion, 'fromcurrent': True}]),
+                dict(label='⏸', method='animate', args=[[None], {**transicion, 'frame': {'duration': 0, 'redraw': False}}]),
+            ])],
+            sliders=[dict(active=i, x=0.1, len=0.9, y=-0.1, currentvalue={'prefix': 'Año '}, steps=[
+                dict(label=str(y), method='animate', args=[[str(y)], transicion]) for y in years
+            ])],
+        )
+
+    return fig
+
+def piramide(year, ancho=10, animar=False):
+    st.plotly_chart(figura_piramide(year, ancho, animar), use_container_width=True)
+
+@perfil.cache_data
+def get_poblacion_por_sexo(tipo, min_year, max_year):
+    df = tipo.df
+    df = df[(df.Periodo>min_year) & (df.Periodo<=max_year) & (df.Edad=='Todas') & (df.Sexo!='Total')]
+    return df[['Periodo', 'Sexo', 'Total']].assign(Sexo=df.Sexo.cat.remove_unused_categories())
+
+@perfil.cache_data(ttl=3600)
+def figura_barras_genero(tipo, year, min_year, max_year):
+    df = get_poblacion_por_sexo(tipo, min_year, max_year)
     fig = px.bar(df, x='Periodo', y='Total', color='Sexo')
     
     fig['data'][0]['marker']['color']='royalblue'
@@ -108,19 +131,29 @@ def barras_genero(df, year):
         bordercolor="#c7c7c7", borderwidth=2, borderpad=4, bgcolor="white", opacity=0.7
     )
 
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def barras_genero(tipo, year, min_year, max_year):
+    st.plotly_chart(figura_barras_genero(tipo, year, min_year, max_year), use_container_width=True)
+
+@perfil.cache_data(ttl=3600)
+def basic_metrics(year):
+    return [int(indicadores.serie('poblacion', sex).loc[year]) for sex in indicadores.SEXOS]
 
-@st.cache_data(ttl=3600)
-def basic_metrics(df, year):
-    df = df[(df.Edad=='Todas') & (df.Periodo==year)]
-    p, h, m = df.Total.values
-    return int(p), int(h), int(m)
+def metricas_estructura(year):
+    nombres = ['edad_mediana', 'indice_envejecimiento', 'tasa_dependencia', 'razon_sexos']
+    for col, nombre in zip(st.columns(len(nombres)), nombres):
+        indicador, serie = indicadores.INDICADORES[nombre], indicadores.serie(nombre)
+        col.metric(indicador.titulo, indicador.formato.format(serie.loc[year]), f'{serie.loc[year]-serie.loc[year-1]:+.1f}',
+            delta_color='off')
 
 ###############################
 
 TITLE = 'Población'
 
 st.set_page_config(page_title=TITLE, page_icon='🌍')
+perfil.inicio(TITLE)
+datos.al_dia()
 st.markdown('# ' + TITLE)
 st.sidebar.header(TITLE)
 st.caption('Fuente: INE')
@@ -133,17 +166,18 @@ st.write('')
 
 ###############################
 
-df_prov, min_year, max_year = get_data_poblacion_provs()
-df_tipo, real_df_tipo = get_data_poblacion_tipo(min_year, max_year)
+min_year, max_year = get_data_poblacion_provs()
+tipo = datos.conjunto('poblacion_sexo_edad')
 
 year = st.sidebar.selectbox('Año destacado', list(range(max_year,min_year,-1)), 0)
 
-p, h, m = basic_metrics(real_df_tipo, year)
-pp, ph, pm = basic_metrics(real_df_tipo, year-1)
+p, h, m = basic_metrics(year)
+pp, ph, pm = basic_metrics(year-1)
 col1, col2, col3 = st.columns(3)
 col1.metric(f'Población {year}', f'{p:,}', f'{p-pp:,}')
 col2.metric(f'Hombres', f'{h:,}', f'{h-ph:,}')
 col3.metric(f'Mujeres', f'{m:,}', f'{m-pm:,}')
+metricas_estructura(year)
 
 st.write('')
 
@@ -156,14 +190,17 @@ with tab1:
     edad y sexo. Esta herramienta visual te permitirá comprender la 
     estructura demográfica del país y observar cómo ha evolucionado 
     a lo largo del tiempo.''')
-    piramide(df_tipo, year)
+    c1, c2 = st.columns([3, 2])
+    ancho = c1.radio('Años por grupo de edad', consultas.ANCHOS_PIRAMIDE, index=2, horizontal=True)
+    animar = c2.checkbox('Animar todos los años')
+    piramide(year, ancho, animar)
     st.divider()
     st.header('Población por sexo')
     st.write('''Explora la distribución de la población en España 
     desglosada por sexo. Este análisis demográfico te permitirá 
     conocer la proporción de hombres y mujeres en el país y 
     comprender cómo ha evolucionado a lo largo del tiempo.''')
-    barras_genero(df_tipo, year)
+    barras_genero(tipo, year, min_year, max_year)
 
 with tab2:
     st.header('Distribución Geográfica')
@@ -172,6 +209,10 @@ with tab2:
     y compara la proporción de habitantes en cada una de ellas. 
     Recuerda que puedes cambiar el año seleccionado desde la barra lateral.''')
     top = st.slider('TOP provincias a mostrar:', 3, 52, 10)
-    donut(df_prov, top, year)
+    donut(datos.conjunto('poblacion_provincias'), top, year)
+
+###############################
+
+#--------------
 
-###############################
\ No newline at end of file
+perfil.fin()
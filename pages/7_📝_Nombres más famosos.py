@@ -1,37 +1,31 @@
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
+
+from demografia import datos, nombres, perfil, provincias
+from demografia.cache import recurso
 
 #--------------
 
 sep = lambda : st.write(' ')
 
-@st.cache_data
+@recurso
 def read_names():
     res = {} # year:df
-    years = list(map(str, range(1920,2021,10)))
-
-    for year in years:
 
-        df = pd.read_csv(f'./data/nombres/nombres{year}.csv', sep=';', 
-            converters = {'prov':lambda x:x.lower().replace('araba/álava','álava/araba').replace('avila','ávila')}
-        )
-        df = df.drop([34,37,50,51,52]) # extranjero, canarias, ceuta y melilla
+    df = datos.get_nombres()
+    df = df[~df.id.isin(nombres.EXCLUIDAS)]
+    df['prov'] = df.id.map(provincias.get_provincias().Provincia)
+    df = df.astype({'nameH': str, 'nameM': str})
 
-        df['prov'] = df['prov'].apply(lambda x: ' '.join([s.capitalize() for s in x.split()]))
-        df['prov'] = df['prov'].apply(lambda x: ' '.join(reversed(x.strip().split(', '))) if ', ' in x else x[0].upper()+x[1:])
-        df['prov'] = df['prov'].apply(lambda x: '/'.join(reversed(x.strip().split('/'))) if '/' in x else x[0].upper()+x[1:])
-        df['prov'] = df['prov'].apply(lambda x: x[0].upper()+x[1:])
-
-        res[year] = df
+    for year, aux in df.groupby('Decada'):
+        res[str(year)] = aux.drop(columns='Decada')
     
     return res
 
-@st.cache_data
+@recurso
 def get_dict_of_names_years():
     d = {} # k=name, v=(year,sex)
-    years = list(map(str, range(1920,2021,10)))
+    years = list(map(str, datos.DECADAS_NOMBRES))
     data = read_names()
 
     for year in years:
@@ -55,27 +49,64 @@ def get_dict_of_names_years():
     
     return d 
 
-@st.cache_data
+@recurso
 def get_maps():
-    provincias = gpd.read_file('./data/provincias.zip!provincias')
-    provincias = provincias[~provincias.NAMEUNIT.isin(['Ceuta','Melilla','Territorio no asociado a ninguna provincia'])]
-    provincias.to_crs(crs=3395, inplace=True)
-    provincias = provincias[['NAMEUNIT','CODNUT2', 'geometry']]
+    # Solo los nombres de cada provincia, en el orden de la geometría de nombres.get_base()
+    ids = nombres.ids_base()
+    geo = pd.DataFrame(index=ids)
 
     data_names = read_names()
 
     for year,df in data_names.items(): 
 
-        assert sorted(df.prov.to_list()) == sorted(provincias.NAMEUNIT.to_list()) 
+        assert sorted(df.id.to_list()) == sorted(ids.tolist()) 
+
+        df = df.set_index('id').reindex(ids)
+        geo['nameH'+str(year)] = df.nameH
+        geo['nameM'+str(year)] = df.nameM
+
+    return geo
+
+# Lo cacheado devuelve datos o figuras; lo que pinta (st.*) no se cachea, así
+# que en cada visita se vuelven a mostrar globos, pestañas y mapas
+
+@perfil.cache_data(ttl=3600)
+def figura_popularidad(name):
+    import plotly.express as px
+
+    df = nombres.trayectoria(name)
+    df['Sexo'] = df.Sexo.map({'H': 'Chicos', 'M': 'Chicas'})
+    return px.line(df, x='Decada', y='PorMil', color='Sexo', markers=True,
+        labels={'Decada': 'Década', 'PorMil': 'Por mil nacidos'})
+
+def popularidad(name):
+    st.divider()
+    st.subheader(f'Popularidad de {name.title()} en España')
+    st.caption('Nacidos por cada mil, contando solo las provincias donde fue el nombre más común')
 
-        df = df.rename(columns={'nameH': 'nameH'+str(year), 'nameM': 'nameM'+str(year)})
-        provincias = pd.merge(provincias, df[['prov', 'nameH'+str(year), 'nameM'+str(year)]], left_on='NAMEUNIT', right_on='prov', how='left')
-        provincias = provincias.drop('prov', axis=1)
+    st.plotly_chart(figura_popularidad(name), use_container_width=True)
 
-    return provincias
+    st.write('Dónde ha tenido más peso:')
+    df = nombres.concentracion(name)
+    st.dataframe(df[['Decada', 'Provincias', 'Frecuencia', 'PorMil']].rename(columns={'Decada': 'Década',
+        'Provincias': 'Provincia', 'PorMil': 'Por mil nacidos'}), hide_index=True, use_container_width=True)
 
-@st.cache_data(show_spinner=False,ttl=3600)
-def process_name(name, d):
+# `conjunto` (el de nombres) solo forma parte de la clave de la caché
+@perfil.cache_data(show_spinner=False,ttl=3600)
+def get_peticiones(name, conjunto):
+    '''(año, sexo) en que `name` fue el más común en alguna provincia, por
+    orden, y para cada uno las etiquetas del mapa y las provincias a destacar.'''
+    provs = get_maps()
+    sorted_list = sorted(get_dict_of_names_years()[name], key=lambda x:x[0])
+
+    peticiones = {}
+    for year, sex in sorted_list:
+        col = provs[f'name{sex}{year}']
+        peticiones[(year, sex)] = (nombres.abreviar(col).to_list(), (col == name).to_list())
+    return sorted_list, peticiones
+
+def process_name(name, conjunto):
+    d = get_dict_of_names_years()
     if name == '':
         st.info('''
             Escribe un nombre de bebé para empezar ☝️\n
@@ -89,35 +120,25 @@ def process_name(name, d):
 
         progress_bar = st.progress(0, text='Cargando mapas')
 
-        sorted_list = sorted(d[name], key=lambda x:x[0])
+        sorted_list, peticiones = get_peticiones(name, conjunto)
         len_list = len(sorted_list)
         sorted_years = [year for year,_ in sorted_list]
         tabs = st.tabs(sorted_years)
 
         for i, (year, sex) in enumerate(sorted_list):
-            t = tabs[i]
             letter = "o" if sex=="H" else "a"
-            t.header(f'Nombres de chic{letter} más comunes en l{letter}s recién nacid{letter}s del {year}')
-
-            aux = provs.copy()
-            aux['color'] = aux[f'name{sex}{year}'].map({x:0 if x == name else 1 for x in aux[f'name{sex}{year}'].unique()})
-            aux[f'name{sex}{year}'] = aux[f'name{sex}{year}'].str.replace('MARIA\s','Mᵃ ',regex=True)
-            aux[f'name{sex}{year}'] = aux[f'name{sex}{year}'].str.replace('JOSE\s','J. ',regex=True)
-            aux[f'name{sex}{year}'] = aux[f'name{sex}{year}'].str.replace('FRANCISCO\s','FCO. ',regex=True)
-
-            fig, ax = plt.subplots(1,1,figsize=(12,12))
-            ax = aux.boundary.plot(color='Black', linewidth=.4, ax=ax)
-            ax.set_axis_off()
-            aux.apply(lambda x:ax.annotate(text=x[f'name{sex}{year}'], xy=x.geometry.centroid.coords[0], ha='center', fontsize=10, 
-                        bbox=dict(boxstyle="round", fc="w", ec='k', pad=0.4, alpha=0.65)), axis=1)
-
-            aux.plot(ax=ax, cmap='tab20c', column='color')
-            t.pyplot(fig, clear_figure=True)
+            tabs[i].header(f'Nombres de chic{letter} más comunes en l{letter}s recién nacid{letter}s del {year}')
 
+        # Los mapas se dibujan en paralelo y se muestran según van terminando
+        for i, ((year, sex), img) in enumerate(nombres.imagenes(name, peticiones)):
+            tabs[sorted_list.index((year, sex))].image(img, use_column_width=True)
+            perfil.enviados(len(img))
             progress_bar.progress((i+1)/len_list, text=f'Cargando mapas:  ¡Mapa del {year} cargado!')
 
         progress_bar.empty()
 
+        popularidad(name)
+
     else:
         st.error(f'{name.capitalize()} no es uno de los nombres más famosos 😥')
 
@@ -126,6 +147,8 @@ def process_name(name, d):
 TITLE = 'Nombres más famosos'
 
 st.set_page_config(page_title=TITLE, page_icon='📝')
+perfil.inicio(TITLE)
+datos.al_dia()
 st.markdown('# ' + TITLE)
 st.caption('Fuente: INE')
 st.write(
@@ -150,9 +173,35 @@ st.write(' ')
 
 provs = get_maps()
 
-name = st.text_input('Nombre a buscar:', '')
-name = name.strip().upper()
+texto = st.text_input('Nombre a buscar:', '')
+
+# Sin distinguir mayúsculas ni tildes; si no es exacto, se sugieren nombres
+# parecidos, pero los mapas no salen hasta que se elige uno
+indice = nombres.get_indice()
+name = indice.exacto(texto)
+if name is None and texto.strip():
+    st.error(f'{texto.strip().capitalize()} no es uno de los nombres más famosos 😥')
+    sugerencias = indice.buscar(texto)
+    if sugerencias:
+        name = st.selectbox('¿Quizás buscabas...?', [''] + sugerencias, key=f'sugerencia:{provincias.clave(texto)}',
+                            format_func=lambda x: x.title() if x else 'Elige un nombre')
+    if name:
+        process_name(name, datos.conjunto('nombres'))
+else:
+    process_name(name or '', datos.conjunto('nombres'))
+
+###############################
 
-d = get_dict_of_names_years()
+sep()
+with st.expander('Nombres más comunes en España por década'):
+    c1, c2 = st.columns(2)
+    decada = c1.selectbox('Década', nombres.get_popularidad().Decada.unique()[::-1])
+    sexo = c2.radio('Sexo', ['M', 'H'], format_func={'H': 'Chicos', 'M': 'Chicas'}.get, horizontal=True)
+    df = nombres.top_nacional(10, sexo)
+    df = df[df.Decada == decada]
+    st.dataframe(df[['Puesto', 'Nombre', 'Frecuencia', 'PorMil', 'Provincias']].rename(columns={'PorMil': 'Por mil nacidos',
+        'Provincias': 'Provincias donde es el más común'}), hide_index=True, use_container_width=True)
+
+#--------------
 
-process_name(name, d)
\ No newline at end of file
+perfil.fin()
@@ -0,0 +1,18 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from demografia import cache
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+@pytest.fixture
+def data_copia(tmp_path, monkeypatch):
+    '''Copia de data/ (sin artefactos) en un directorio temporal, que pasa a
+    ser el de trabajo: las rutas de demografia son relativas a él.'''
+    shutil.copytree(RAIZ / 'data', tmp_path / 'data', ignore=shutil.ignore_patterns('.artefactos'))
+    monkeypatch.chdir(tmp_path)
+    cache.limpiar()
+    yield tmp_path / 'data'
+    cache.limpiar()
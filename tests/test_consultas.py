@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from demografia import consultas
+
+@pytest.fixture
+def df():
+    # 4 provincias, 1990-2009, con años que faltan (sin fila o con NaN) y
+    # una provincia sin ningún dato entre 1995 y 2004
+    rng = np.random.default_rng(0)
+    filas = [(id, year, rng.integers(0, 1000)) for id in [2, 7, 15, 28] for year in range(1990, 2010)]
+    df = pd.DataFrame(filas, columns=['id', 'Periodo', 'Total']).astype({'Total': 'float64'})
+    df = df[rng.random(len(df)) > 0.2]
+    df.loc[rng.random(len(df)) < 0.1, 'Total'] = np.nan
+    return df[~((df.id == 15) & df.Periodo.between(1995, 2004))]
+
+def _media(df, id, desde, hasta):
+    v = [t for i, p, t in zip(df.id, df.Periodo, df.Total) if i == id and desde <= p <= hasta and not np.isnan(t)]
+    return sum(v) / len(v) if v else np.nan
+
+def test_media_como_un_bucle(df):
+    m = consultas.Matriz(df, ['Total'])
+    assert m.ids.tolist() == [2, 7, 15, 28]
+    for desde in range(1990, 2010):
+        for hasta in range(desde, 2010):
+            esperado = [_media(df, id, desde, hasta) for id in m.ids]
+            np.testing.assert_allclose(m.media('Total', (desde, hasta)), esperado)
+    np.testing.assert_allclose(m.media('Total', 1999), [_media(df, id, 1999, 1999) for id in m.ids])
+
+def test_media_sin_datos_en_el_periodo(df):
+    media = consultas.Matriz(df, ['Total']).media('Total', (1996, 2003))
+    assert np.isnan(media[2]) and not np.isnan(media[[0, 1, 3]]).any()
+
+def test_media_fuera_de_los_datos(df):
+    m = consultas.Matriz(df, ['Total'])
+    for periodo in [1989, (2005, 2010), (2000, 1999)]:
+        with pytest.raises(ValueError):
+            m.media('Total', periodo)
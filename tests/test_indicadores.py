@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from demografia import consultas, indicadores
+
+def _filas(year, totales):
+    # (edad, total) para Total; Hombres y Mujeres llevan la mitad cada uno
+    return [(e, s, year, t if s == 'Total' else t // 2) for e, t in totales for s in indicadores.SEXOS]
+
+def test_edades(data_copia):
+    # 2000 desglosa hasta 105 y repite 85 y 100 con '85 y más' y '100 y más';
+    # 1975 solo da '85 y más', con las edades siguientes a 0
+    filas = _filas(2000, [(str(e), 10) for e in range(106)] + [('85', 210), ('100', 60), ('Todas', 1060)])
+    filas += _filas(1975, [(str(e), 10) for e in range(85)] + [('85', 0), ('85', 300)] + [(str(e), 0) for e in range(86, 106)])
+    pd.DataFrame(filas, columns=['Edad', 'Sexo', 'Periodo', 'Total']).sample(frac=1, random_state=0) \
+        .to_csv(data_copia / 'poblacion_por_sexo_edad.csv', sep=';', index=False)
+
+    years, cubo = indicadores.edades()
+    assert years.tolist() == [1975, 2000]
+    assert cubo.shape == (2, 3, 106)
+    assert (cubo[1] == [[10], [5], [5]]).all()
+    assert cubo[1].sum(-1).tolist() == [1060, 530, 530]
+    assert (cubo[0, :, :85] == [[10], [5], [5]]).all()
+    assert cubo[0, :, 85].tolist() == [300, 150, 150]
+    assert not cubo[0, :, 86:].any()
+
+    _, grupos, piramide = consultas.get_cubo_piramide(5)
+    sexos = [indicadores.SEXOS.index(s) for s in consultas.SEXOS_PIRAMIDE]
+    assert (piramide.sum(-1) == cubo[:, sexos].sum(-1)).all()
+    assert grupos[-1] == '>= 100'
+    assert piramide[1, :, -1].tolist() == [30, 30]
+    assert piramide[0, :, -4].tolist() == [150, 150]
+
+def test_edades_suman_el_total(monkeypatch):
+    # Con los datos del INE, cada año suma lo mismo que su fila 'Todas' (salvo
+    # unas pocas personas: el INE redondea cada edad por separado)
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    df = pd.read_csv('data/poblacion_por_sexo_edad.csv', sep=';')
+    todas = df[df.Edad == 'Todas'].pivot(index='Periodo', columns='Sexo', values='Total')[indicadores.SEXOS]
+    years, cubo = indicadores.edades()
+    np.testing.assert_allclose(cubo.sum(-1), todas.reindex(years).to_numpy(), rtol=1e-6)
@@ -0,0 +1,127 @@
+import pandas as pd
+import pytest
+
+from demografia import datos, ingesta
+
+def _exportacion(df, year, ruta):
+    # Exportación CSV de INEbase de los matrimonios de `year` en `df` (el CSV de data/)
+    dim = pd.read_csv('data/provincias.csv', sep=';', dtype=str)
+    nombres = dict(zip(dim.Codigo, dim.Provincia))
+    df = df[df.Periodo == year]
+    pd.DataFrame({
+        'Provincias': ['Total Nacional' if c == '00' else f'{c} {nombres[c]}' for c in df.Codigo],
+        'Periodo': df.Periodo.astype(str),
+        'Total': [f'{v:,}'.replace(',', '.') for v in df.Total],
+    }).to_csv(ruta, sep=';', index=False, encoding='utf-8-sig')
+
+def test_orden_tras_dos_ingestas(data_copia, tmp_path):
+    ruta = data_copia / 'matrimonios.csv'
+    original = pd.read_csv(ruta, sep=';', dtype={'Codigo': str})
+    for year in [2020, 2021]:
+        _exportacion(original, year, tmp_path / f'{year}.csv')
+    original[original.Periodo < 2020].to_csv(ruta, sep=';', index=False)
+    datos.get_movimiento('matrimonios')  # Con el artefacto construido, la ingesta lo amplía
+
+    assert ingesta.ingestar('matrimonios', str(tmp_path / '2020.csv'))['nuevos'] == [2020]
+    assert ingesta.ingestar('matrimonios', str(tmp_path / '2021.csv'))['nuevos'] == [2021]
+
+    df = pd.read_csv(ruta, sep=';', dtype={'Codigo': str})
+    # Cada serie sigue del año más reciente al más antiguo, y los nuevos van delante
+    assert df.groupby('Codigo', sort=False).Periodo.apply(lambda p: p.is_monotonic_decreasing).all()
+    assert (df.Periodo.iloc[:len(df.Codigo.unique())] == 2021).all()
+    claves = ['Codigo', 'Periodo']
+    pd.testing.assert_frame_equal(df[claves + ['Total']].sort_values(claves, ignore_index=True),
+                                  original[claves + ['Total']].sort_values(claves, ignore_index=True))
+
+    # El artefacto ampliado es el que saldría de construirlo entero con el CSV nuevo
+    pd.testing.assert_frame_equal(datos.get_movimiento('matrimonios'), datos.CONSTRUCTORES['matrimonios'](),
+                                  check_categorical=False)
+
+#--------------
+
+PX = '''CHARSET="ANSI";
+AXIS-VERSION="2000";
+CONTENTS="Nacimientos; por provincia";
+STUB="Provincias","Sexo";
+HEADING="Periodo";
+VALUES("Provincias")="Total Nacional","02 Albacete","29 Málaga; costa ",
+"33 Asturias";
+VALUES("Sexo")="Ambos sexos","Hombres";
+VALUES("Periodo")="2022","2021","20"
+"20";
+DATA=
+1 2 3 4 5 6
+7 8 9 ".." 11 12
+13 14
+15 16 17 18 19 20
+21 "-" 23 24;
+'''
+
+def test_leer_px(tmp_path):
+    ruta = tmp_path / 'nacimientos.px'
+    ruta.write_bytes(PX.encode('cp1252'))
+    df = pd.concat(ingesta.leer(str(ruta), filas=5), ignore_index=True)
+
+    provincias = ['Total Nacional', '02 Albacete', '29 Málaga; costa ', '33 Asturias']
+    esperado = pd.DataFrame([(p, s, y) for p in provincias for s in ['Ambos sexos', 'Hombres'] for y in ['2022', '2021', '2020']],
+                            columns=['Provincias', 'Sexo', 'Periodo'])
+    esperado['Total'] = [float(i) for i in range(1, 25)]
+    esperado.loc[[9, 21], 'Total'] = float('nan')
+    pd.testing.assert_frame_equal(df, esperado)
+
+def test_leer_px_incorrecto(tmp_path):
+    ruta = tmp_path / 'mal.px'
+    for texto, error in [(PX.replace('DATA=', 'DATOS='), 'DATA='),
+                         (PX.replace('21 "-" 23 24;', '21 "-" 23;'), 'hay 23 datos y se esperaban 24'),
+                         (PX.replace('VALUES("Sexo")', 'VALUES("Sexos")'), 'faltan los valores'),
+                         (PX.replace('DATA=', 'KEYS("Sexo")=VALUES;\nDATA='), 'KEYS')]:
+        ruta.write_bytes(texto.encode('cp1252'))
+        with pytest.raises(ValueError, match=error):
+            pd.concat(ingesta.leer(str(ruta), filas=5))
+
+def test_leer_csv(tmp_path):
+    ruta = tmp_path / 'poblacion.csv'
+    ruta.write_bytes('Provincias\tPeriodo\tTotal\n02 Albacete\t1 de enero de 2022\t387.759,51\n'
+                     '29 Málaga\t1 de enero de 2022\t..\n'.encode('cp1252'))
+    df = pd.concat(ingesta.leer(str(ruta)))
+    assert df.Provincias.tolist() == ['02 Albacete', '29 Málaga']
+    assert df.Total.iloc[0] == 387759.51 and pd.isna(df.Total.iloc[1])
+
+#--------------
+
+def test_sin_poblacion_no_toca_el_csv(data_copia, tmp_path):
+    # Nacimientos de un año sin población: no se puede calcular la tasa
+    ruta = data_copia / 'nacimientos.csv'
+    antes = ruta.read_bytes()
+    df = pd.read_csv(ruta, sep=';', dtype={'Codigo': str})
+    df = df[df.Periodo == 2021].assign(Periodo=2099)
+    dim = pd.read_csv('data/provincias.csv', sep=';', dtype=str)
+    nombres = dict(zip(dim.Codigo, dim.Provincia))
+    pd.DataFrame({
+        'Provincias': ['Total Nacional' if c == '00' else f'{c} {nombres[c]}' for c in df.Codigo],
+        'Sexo': df.Sexo.map({'Total': 'Ambos sexos'}).fillna(df.Sexo),
+        'Periodo': df.Periodo.astype(str),
+        'Total': df.Total.astype(str),
+    }).to_csv(tmp_path / '2099.csv', sep=';', index=False)
+
+    with pytest.raises(ValueError, match='Faltan datos de población'):
+        ingesta.ingestar('nacimientos', str(tmp_path / '2099.csv'))
+    assert ruta.read_bytes() == antes
+
+def test_fallo_al_guardar_deja_el_csv(data_copia, tmp_path, monkeypatch):
+    ruta = data_copia / 'matrimonios.csv'
+    original = pd.read_csv(ruta, sep=';', dtype={'Codigo': str})
+    _exportacion(original, 2021, tmp_path / '2021.csv')
+    original[original.Periodo < 2021].to_csv(ruta, sep=';', index=False)
+    antes = ruta.read_bytes()
+    datos.get_movimiento('matrimonios')
+
+    def falla(nombre, df):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(datos, 'guardar_artefacto', falla)
+    with pytest.raises(OSError):
+        ingesta.ingestar('matrimonios', str(tmp_path / '2021.csv'))
+    assert ruta.read_bytes() == antes
+    assert not list(data_copia.glob('*.tmp'))
+    # Y el artefacto sigue siendo el de antes, sin 2021
+    assert datos.get_movimiento('matrimonios').Periodo.max() == 2020
@@ -0,0 +1,46 @@
+import itertools
+
+import pytest
+
+from demografia import nombres
+
+@pytest.fixture
+def indice():
+    return nombres.IndiceNombres(['LUCIA', 'LUCAS', 'LUIS', 'MARIA', 'MARIO', 'JOSE MARIA', 'ÁNGEL', 'ANGELA', 'IKER'],
+                                 [30, 10, 20, 50, 5, 8, 12, 3, 1])
+
+def test_exacto_sin_mayusculas_ni_tildes(indice):
+    for texto in ['Lucía', 'LUCIA', ' lucia ', 'LÚCÍA']:
+        assert indice.exacto(texto) == 'LUCIA'
+    assert indice.exacto('angel') == 'ÁNGEL'
+    assert indice.exacto('Ángela') == 'ANGELA'
+    assert indice.exacto('Luc') is None
+
+def test_prefijo_por_cobertura(indice):
+    assert indice.prefijo('luc') == ['LUCIA', 'LUCAS']
+    assert indice.prefijo('lu') == ['LUCIA', 'LUIS', 'LUCAS']
+    assert indice.prefijo('án') == ['ÁNGEL', 'ANGELA']
+    assert indice.prefijo('x') == []
+
+def test_parecidos_con_erratas(indice):
+    assert indice.parecidos('Lucai') == ['LUCAS', 'LUCIA']  # A 1 y 2 errores; con 5 letras valen 2
+    assert indice.parecidos('Mraia') == ['MARIA']
+    assert indice.parecidos('Ikre') == []  # Con 4 letras, solo uno
+    assert indice.parecidos('Iler') == ['IKER']
+
+def test_buscar(indice):
+    # El exacto, luego los que empiezan por el texto y luego los parecidos, sin repetir
+    assert indice.buscar('María') == ['MARIA', 'MARIO']
+    assert indice.buscar('lu') == ['LUCIA', 'LUIS', 'LUCAS']
+    assert indice.buscar('Carla') == []
+    assert indice.buscar('  ') == []
+    assert indice.buscar('Lucai', n=1) == ['LUCAS']
+
+def test_distancia():
+    palabras = ['', 'a', 'ab', 'ba', 'abc', 'acb', 'lucia', 'lucas', 'luis']
+    for a, b in itertools.product(palabras, repeat=2):
+        d = nombres._distancia(a, b, 10)
+        assert d == nombres._distancia(b, a, 10)
+        assert (d == 0) == (a == b)
+        assert nombres._distancia(a, b, 1) == min(d, 2)
+    assert nombres._distancia('lucia', 'lucas', 10) == 2
@@ -0,0 +1,56 @@
+import shapely
+from shapely.geometry import shape
+
+from demografia import geografia, topologia
+
+def _feature(tipo, coordenadas, codigo):
+    return {'type': 'Feature', 'properties': {'codigo': codigo},
+            'geometry': {'type': tipo, 'coordinates': coordenadas}}
+
+def _cuadrado(x, y, lado=1):
+    return [(x, y), (x + lado, y), (x + lado, y + lado), (x, y + lado), (x, y)]
+
+# Dos cuadrados con un lado en común, el segundo con un agujero, y encima
+# un MultiPolygon (con una isla) que linda con los dos: todos los vértices
+# caen en la rejilla, y los bordes compartidos tienen los mismos vértices
+# a cada lado, como en un GeoJSON sin huecos ni solapes
+FEATURES = [
+    _feature('Polygon', [_cuadrado(0, 0, 4)], 1),
+    _feature('Polygon', [_cuadrado(4, 0, 4), _cuadrado(5, 1, 2)[::-1]], 2),
+    _feature('MultiPolygon', [[[(0, 4), (4, 4), (8, 4), (8, 12), (0, 12), (0, 4)]], [_cuadrado(10, 10)]], 3),
+]
+
+def test_ida_y_vuelta_exacta():
+    topo = topologia.topologia(FEATURES, 0.5, 'regiones', ['codigo'])
+    for f, g in zip(FEATURES, topologia.geometrias(topo, 'regiones')):
+        assert g['type'] == f['geometry']['type']
+        assert shape(g).equals(shape(f['geometry']))
+    assert [g['properties'] for g in topo['objects']['regiones']['geometries']] == [{'codigo': c} for c in [1, 2, 3]]
+
+def test_bordes_compartidos_una_vez():
+    topo = topologia.topologia(FEATURES, 0.5, 'regiones')
+    refs = [r for g in topo['objects']['regiones']['geometries']
+            for anillo in (g['arcs'] if g['type'] == 'Polygon' else [a for p in g['arcs'] for a in p])
+            for r in anillo]
+    # Cada arco se usa una vez por cada lado: los compartidos, una de ellas al revés
+    usos = {}
+    for r in refs:
+        usos.setdefault(r if r >= 0 else ~r, []).append(r >= 0)
+    assert set(usos) == set(range(len(topo['arcs'])))
+    assert all(sorted(u) in ([True], [False, True]) for u in usos.values())
+    assert sum(len(u) == 2 for u in usos.values()) == 3  # x=4 entre los cuadrados; y=4 con cada uno
+
+def test_provincias_a_la_tolerancia():
+    # Cada provincia, simplificada y cuantizada, solo difiere de la original
+    # en una banda a lo largo del borde de media tolerancia de ancho (los
+    # islotes de menos de un píxel que se descartan también caben en ella)
+    zoom = geografia.PROVINCIAS.zoom_detalle
+    tol = geografia.tolerancia(zoom)
+    originales = [shape(f['geometry']) for f in geografia.PROVINCIAS.geojson()['features']]
+    # Al cuantizar, algún anillo puede tocarse a sí mismo
+    simplificadas = [shapely.make_valid(shape(g)) for g in geografia.PROVINCIAS.geometrias(zoom)]
+    for original, simplificada in zip(originales, simplificadas):
+        assert original.symmetric_difference(simplificada).area < original.length * tol / 2
+    # Las vecinas siguen encajando: sin solapes
+    total = sum(s.area for s in simplificadas)
+    assert shapely.union_all(simplificadas).area > total * 0.9999